@@ -0,0 +1,163 @@
+from PyQt5.QtCore import QObject, QThread, QTimer, pyqtSignal, pyqtSlot
+
+from result_cache import ResultCache
+
+# Budget of every analysis (see code_analyzer.AnalysisBudget), so that pathological input (a pasted binary blob,
+# thousands of stray symbols) cannot keep the results from showing up: diagnostics per phase and seconds
+MAX_DIAGNOSTICS = 1000
+TIME_LIMIT = 10.0
+
+
+class AnalysisWorker(QObject):
+    # Runs the analysis pipeline inside the background thread.
+    # The worker keeps an IncrementalAnalyzer, so that unchanged parts of the document are not lexed and parsed again.
+    # Every request carries a generation number: requests that are already stale when they are
+    # dequeued are skipped, and a running analysis is cancelled as soon as a newer one is requested.
+    # When the runner has profiling enabled, the Profile of the analysis is sent along with its errors.
+    # Results are also kept in the persistent ResultCache, so reopening a file that was already checked
+    # does not analyze it again (profiled analyses bypass the cache).
+    # The analysis modules, with the ANTLR runtime and the generated parser, are imported by the first request,
+    # on the background thread, so they do not delay the opening of the window.
+    # A request may carry the tokens of every line kept by the editor's syntax highlighter; when they match
+    # the source, the parts of the document that changed are parsed from them instead of being lexed again.
+    # Every analysis runs within the budget of the runner; partial results are shown (marked as truncated)
+    # but not cached, and the next analysis continues from the parts of the document parsed so far.
+    finished = pyqtSignal(int, object, object)
+    failed = pyqtSignal(int, str)
+
+    def __init__(self, runner):
+        super().__init__()
+        self.runner = runner
+        self.analyzer = None
+        self.dfa_cache_loaded = False
+        self.result_cache = None
+
+    @pyqtSlot(int, str, object)
+    def run(self, generation, source, line_tokens):
+        def is_cancelled():
+            return self.runner.generation != generation
+
+        if is_cancelled():
+            return
+        from code_analyzer import AnalysisBudget, AnalysisCancelled
+        from diagnostics import is_truncated
+
+        if not self.dfa_cache_loaded:
+            from dfa_cache import load_dfa_cache
+            from incremental_analyzer import IncrementalAnalyzer
+
+            # Preload the DFAs saved by the previous session before the first parse
+            load_dfa_cache()
+            self.dfa_cache_loaded = True
+            self.analyzer = IncrementalAnalyzer()
+            self.result_cache = ResultCache()
+        profile = None
+        if self.runner.profiling:
+            from profiling import Profile
+
+            profile = Profile()
+        key = None
+        if profile is None:
+            key = self.result_cache.key(source)
+            errors = self.result_cache.get(key)
+            if errors is not None:
+                self.finished.emit(generation, errors, None)
+                return
+        try:
+            budget = AnalysisBudget(self.runner.max_diagnostics, self.runner.time_limit)
+            errors = self.analyzer.analyze(source, is_cancelled, profile, line_tokens, budget)
+        except AnalysisCancelled:
+            return
+        except Exception as e:
+            self.failed.emit(generation, str(e))
+            return
+        if key is not None and not is_truncated(errors):
+            self.result_cache.put(key, errors)
+        self.finished.emit(generation, errors, profile)
+
+
+class AnalysisRunner(QObject):
+    # Owns the background thread and hands analysis requests to the worker.
+    # Only the results of the most recent request are emitted; results of superseded requests are discarded.
+    # request_debounced() restarts a timer on every call, so that typing only triggers one analysis
+    # once the user pauses for `debounce_ms` milliseconds.
+    # While `profiling` is set, every analysis is instrumented and its Profile is emitted by profile_ready.
+    # `max_diagnostics` and `time_limit` are the budget of every analysis (None for no limit).
+    # `tokens_provider`, if given, returns the editor's tokens of every line (or None) along with the source.
+    results_ready = pyqtSignal(object)
+    profile_ready = pyqtSignal(object)
+    analysis_failed = pyqtSignal(str)
+    busy_changed = pyqtSignal(bool)
+    _requested = pyqtSignal(int, str, object)
+
+    def __init__(self, source_provider, debounce_ms=400, parent=None, tokens_provider=None):
+        super().__init__(parent)
+        self.source_provider = source_provider
+        self.tokens_provider = tokens_provider
+        self.generation = 0
+        self.busy = False
+        self.profiling = False
+        self.max_diagnostics = MAX_DIAGNOSTICS
+        self.time_limit = TIME_LIMIT
+
+        self.debounce_timer = QTimer(self)
+        self.debounce_timer.setSingleShot(True)
+        self.debounce_timer.setInterval(debounce_ms)
+        self.debounce_timer.timeout.connect(self.request)
+
+        self.thread = QThread(self)
+        self.worker = AnalysisWorker(self)
+        self.worker.moveToThread(self.thread)
+        self._requested.connect(self.worker.run)
+        self.worker.finished.connect(self._on_finished)
+        self.worker.failed.connect(self._on_failed)
+        self.thread.start()
+
+    def request(self):
+        # Starts an analysis of the current source, cancelling any analysis still in progress.
+        self.debounce_timer.stop()
+        self.generation += 1
+        self._set_busy(True)
+        line_tokens = self.tokens_provider() if self.tokens_provider is not None else None
+        self._requested.emit(self.generation, self.source_provider(), line_tokens)
+
+    def request_debounced(self):
+        self.debounce_timer.start()
+
+    def cancel(self):
+        # Cancels the pending and running analyses without starting a new one.
+        self.debounce_timer.stop()
+        self.generation += 1
+        self._set_busy(False)
+
+    def shutdown(self):
+        # Stops the background thread and saves the DFAs warmed up during the session for the next start.
+        # The result cache is trimmed to its size limit.
+        self.cancel()
+        self.thread.quit()
+        self.thread.wait()
+        if self.worker.dfa_cache_loaded:
+            from dfa_cache import save_dfa_cache
+
+            try:
+                save_dfa_cache()
+            except OSError:
+                pass
+            self.worker.result_cache.prune()
+
+    def _set_busy(self, busy):
+        if busy != self.busy:
+            self.busy = busy
+            self.busy_changed.emit(busy)
+
+    def _on_finished(self, generation, errors, profile):
+        if generation == self.generation:
+            self._set_busy(False)
+            self.results_ready.emit(errors)
+            if profile is not None:
+                self.profile_ready.emit(profile)
+
+    def _on_failed(self, generation, message):
+        if generation == self.generation:
+            self._set_busy(False)
+            self.analysis_failed.emit(message)
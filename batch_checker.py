@@ -0,0 +1,316 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from functools import partial
+
+from diagnostics import ERROR, TRUNCATION_CODES
+from result_cache import DEFAULT_MAX_BYTES, DEFAULT_RESULT_CACHE_DIR, ResultCache
+from rule_engine import RULES
+from source_files import read_source
+
+# The analysis modules (and with them the ANTLR runtime and the generated parser) are imported by the
+# functions that need them, so that e.g. `--help` or a run served from the result cache starts quickly.
+
+SARIF_SCHEMA = "https://json.schemastore.org/sarif-2.1.0.json"
+
+
+def collect_files(paths, pattern):
+    # Expands the command-line arguments into a sorted list of unique source files.
+    # Arguments can be files, directories (searched recursively for `pattern`) or glob expressions.
+    files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            matches = glob.glob(os.path.join(path, "**", pattern), recursive=True)
+        elif os.path.isfile(path):
+            matches = [path]
+        else:
+            matches = glob.glob(path, recursive=True)
+        files.update(os.path.normpath(match) for match in matches if os.path.isfile(match))
+    return sorted(files)
+
+
+def check_file(path, source=None, two_stage=True, profile=False, fast_lexer=False, token_store=False,
+               disabled_rules=(), max_diagnostics=None, time_limit=None):
+    # Runs the full analysis pipeline on a single file, reading it unless its `source` is given.
+    # Executed inside the worker processes, so it only returns plain picklable data.
+    # The last item of the result is the Profile of the analysis when `profile` is set, None otherwise.
+    # `max_diagnostics` and `time_limit` are the budget of the analysis (see code_analyzer.AnalysisBudget).
+    from code_analyzer import analysis_budget, analyze_code
+    from profiling import Profile
+
+    if source is None:
+        source = read_source(path)
+    file_profile = Profile() if profile else None
+    errors = analyze_code(source, two_stage=two_stage, profile=file_profile, fast_lexer=fast_lexer,
+                          token_store=token_store, disabled_rules=disabled_rules,
+                          budget=analysis_budget(max_diagnostics, time_limit))
+    return path, source.count("\n") + 1, errors, file_profile
+
+
+def analyze_files(files, sources, jobs, two_stage=True, dfa_cache=None, profile=False, split=False, fast_lexer=False,
+                  token_store=False, disabled_rules=(), max_diagnostics=None, time_limit=None):
+    # Analyzes the files, spreading them across `jobs` worker processes.
+    # Every process preloads the DFA cache, if one is given, before its first parse.
+    # With `split`, the files are analyzed one after the other, each one split across the worker processes
+    # (see parallel_analyzer.py), which suits a few huge files better; split analyses are neither profiled
+    # nor budgeted.
+    from dfa_cache import load_dfa_cache
+
+    if split:
+        from parallel_analyzer import analyze_parallel
+        for path, source in zip(files, sources):
+            if source is None:
+                source = read_source(path)
+            errors = analyze_parallel(source, jobs, two_stage, dfa_cache, fast_lexer, token_store, disabled_rules)
+            yield path, source.count("\n") + 1, errors, None
+        return
+    check = partial(check_file, two_stage=two_stage, profile=profile, fast_lexer=fast_lexer, token_store=token_store,
+                    disabled_rules=disabled_rules, max_diagnostics=max_diagnostics, time_limit=time_limit)
+    if jobs <= 1 or len(files) <= 1:
+        if dfa_cache:
+            load_dfa_cache(dfa_cache)
+        yield from map(check, files, sources)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+
+    chunksize = max(1, len(files) // (jobs * 8))
+    initializer, initargs = (load_dfa_cache, (dfa_cache,)) if dfa_cache else (None, ())
+    with ProcessPoolExecutor(max_workers=jobs, initializer=initializer, initargs=initargs) as executor:
+        yield from executor.map(check, files, sources, chunksize=chunksize)
+
+
+def run_checks(files, jobs, two_stage=True, dfa_cache=None, profile=False, result_cache=None, split=False,
+               fast_lexer=False, token_store=False, disabled_rules=(), max_diagnostics=None, time_limit=None):
+    # Checks the files and yields the results in input order as (path, line_count, errors, profile).
+    # With a ResultCache, every file is read and hashed first, and only the files without a cached result
+    # are analyzed (their sources are handed to the workers); the new results are added to the cache,
+    # which must have been created with the same `disabled_rules`. Cached results have no profile.
+    # Results cut short by the budget (`max_diagnostics`, `time_limit`) are not cached, while a cached result,
+    # being complete, is used whatever the budget.
+    if result_cache is None:
+        yield from analyze_files(files, [None] * len(files), jobs, two_stage, dfa_cache, profile, split, fast_lexer,
+                                 token_store, disabled_rules, max_diagnostics, time_limit)
+        return
+
+    cached = {}
+    pending = []
+    sources = []
+    keys = []
+    for path in files:
+        source = read_source(path)
+        key = result_cache.key(source)
+        errors = result_cache.get(key)
+        if errors is not None:
+            cached[path] = (path, source.count("\n") + 1, errors, None)
+        else:
+            pending.append(path)
+            sources.append(source)
+            keys.append(key)
+
+    from diagnostics import is_truncated
+
+    analyzed = analyze_files(pending, sources, jobs, two_stage, dfa_cache, profile, split, fast_lexer, token_store,
+                             disabled_rules, max_diagnostics, time_limit)
+    keys = iter(keys)
+    for path in files:
+        if path in cached:
+            yield cached[path]
+            continue
+        result = next(analyzed)
+        key = next(keys)
+        if not is_truncated(result[2]):
+            result_cache.put(key, result[2])
+        yield result
+
+
+def write_jsonl(results, output):
+    # Writes one JSON object per diagnostic.
+    count = 0
+    for path, _, errors, _ in results:
+        for error in errors:
+            record = {"file": path}
+            record.update(error.to_dict())
+            output.write(json.dumps(record) + "\n")
+            count += 1
+    return count
+
+
+def write_sarif(results, output):
+    # Writes all diagnostics as a single SARIF 2.1.0 log.
+    sarif_results = []
+    rules = {}  # code -> phase
+    for path, _, errors, _ in results:
+        uri = path.replace(os.sep, "/")
+        for error in errors:
+            rules.setdefault(error.code, error.phase)
+            location = {"artifactLocation": {"uri": uri}}
+            if error.line is not None:
+                region = {"startLine": error.line}
+                if error.column is not None:
+                    region["startColumn"] = error.column + 1  # SARIF columns are 1-based
+                if error.end_line is not None and error.end_column is not None:
+                    region["endLine"] = error.end_line
+                    region["endColumn"] = error.end_column + 1
+                location["region"] = region
+            sarif_results.append({
+                "ruleId": error.code,
+                "level": error.severity,
+                "message": {"text": error.message},
+                "locations": [{"physicalLocation": location}],
+            })
+    log = {
+        "$schema": SARIF_SCHEMA,
+        "version": "2.1.0",
+        "runs": [{
+            "tool": {"driver": {
+                "name": "BugBuster",
+                "rules": [{"id": code, "properties": {"category": phase}} for code, phase in sorted(rules.items())],
+            }},
+            "results": sarif_results,
+        }],
+    }
+    json.dump(log, output, indent=2)
+    output.write("\n")
+    return len(sarif_results)
+
+
+def main(argv=None):
+    # Command-line entry point of the headless checker.
+    # Exits with status 1 when an error is reported, or the analysis of a file was cut short by --max-diagnostics
+    # or --time-limit (its results are partial), and with --warnings-as-errors when any diagnostic is reported;
+    # 0 otherwise.
+    arg_parser = argparse.ArgumentParser(description="Check source files for lexical, syntactic and semantic errors.")
+    arg_parser.add_argument("paths", nargs="+", help="files, directories or glob patterns to check")
+    arg_parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                            help="number of worker processes (default: number of CPUs)")
+    arg_parser.add_argument("-f", "--format", choices=("jsonl", "sarif"), default="jsonl",
+                            help="output format of the diagnostics (default: jsonl)")
+    arg_parser.add_argument("-o", "--output", help="write diagnostics to this file instead of stdout")
+    arg_parser.add_argument("--pattern", default="*.java",
+                            help="file name pattern used when searching directories (default: *.java)")
+    arg_parser.add_argument("--parse-mode", choices=("two-stage", "ll"), default="two-stage",
+                            help="try fast SLL prediction first and fall back to full LL on errors (two-stage, "
+                                 "the default), or always use full LL prediction (ll)")
+    arg_parser.add_argument("--lexer", choices=("antlr", "fast"), default="antlr",
+                            help="lexer engine: the generated ANTLR lexer (antlr, the default) or the equivalent "
+                                 "and several times faster regex tokenizer of fast_lexer.py (fast)")
+    arg_parser.add_argument("--token-store", action="store_true",
+                            help="keep the tokens in the compact arrays of token_store.py instead of one object "
+                                 "per token (much less memory on very large files)")
+    arg_parser.add_argument("--disable-rule", action="append", default=[], choices=sorted(RULES), metavar="RULE",
+                            help="skip an optional semantic check of rule_engine.py; may be repeated "
+                                 "(rules: %(choices)s)")
+    arg_parser.add_argument("--warnings-as-errors", action="store_true",
+                            help="exit with status 1 when warnings are found too, not only errors")
+    arg_parser.add_argument("--max-diagnostics", type=int, metavar="N",
+                            help="report at most N diagnostics per phase and file; the parser stops at the error "
+                                 "after the Nth instead of recovering from it")
+    arg_parser.add_argument("--time-limit", type=float, metavar="SECONDS",
+                            help="stop analyzing a file after this many seconds; partial results end with a "
+                                 "warning saying where they stop")
+    arg_parser.add_argument("--dfa-cache", metavar="PATH",
+                            help="preload the lexer and parser DFAs from this file; when running in a single "
+                                 "process (-j 1) the warmed-up DFAs are saved back to it")
+    arg_parser.add_argument("--cache-dir", default=DEFAULT_RESULT_CACHE_DIR,
+                            help="directory of the persistent result cache (default: ~/.cache/bugbuster/results)")
+    arg_parser.add_argument("--cache-size", type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024), metavar="MB",
+                            help="size limit of the result cache; the least recently used results are evicted "
+                                 "beyond it (default: %(default)s)")
+    arg_parser.add_argument("--no-cache", action="store_true",
+                            help="analyze every file, without reading or updating the result cache")
+    arg_parser.add_argument("--profile", action="store_true",
+                            help="print the time spent in every phase, semantic rule and parser decision "
+                                 "(summed over all files) to stderr")
+    arg_parser.add_argument("--project", action="store_true",
+                            help="analyze the files as one project: the classes of every file are known in the "
+                                 "others; only the changed files and the files using their classes are analyzed "
+                                 "again (see project_analyzer.py)")
+    arg_parser.add_argument("--project-index", metavar="PATH",
+                            help="file of the project index (default: one per set of paths in "
+                                 "~/.cache/bugbuster/projects)")
+    arg_parser.add_argument("--split", action="store_true",
+                            help="analyze one file at a time, splitting every file into chunks analyzed by the "
+                                 "worker processes (faster for a few very large files)")
+    args = arg_parser.parse_args(argv)
+    if args.split and args.profile:
+        arg_parser.error("--profile cannot be combined with --split")
+    if args.project and (args.split or args.profile):
+        arg_parser.error("--project cannot be combined with --split or --profile")
+    if args.split and (args.max_diagnostics is not None or args.time_limit is not None):
+        arg_parser.error("--split cannot be combined with --max-diagnostics or --time-limit")
+    if args.max_diagnostics is not None and args.max_diagnostics < 1:
+        arg_parser.error("--max-diagnostics must be at least 1")
+    if args.time_limit is not None and args.time_limit <= 0:
+        arg_parser.error("--time-limit must be positive")
+
+    files = collect_files(args.paths, args.pattern)
+    if not files:
+        print("No files to check.", file=sys.stderr)
+        return 0
+
+    # Profiling measures the analysis itself, so cached results are not used. The diagnostics of a file of a
+    # project also depend on the other files, so the project index replaces the result cache.
+    result_cache = None
+    if not args.no_cache and not args.profile and not args.project:
+        result_cache = ResultCache(args.cache_dir, args.cache_size * 1024 * 1024, args.disable_rule)
+
+    start = time.perf_counter()
+    project = None
+    if args.project:
+        from project_analyzer import ProjectAnalyzer, default_index_path
+
+        if args.dfa_cache:
+            from dfa_cache import load_dfa_cache
+            load_dfa_cache(args.dfa_cache)
+        project = ProjectAnalyzer(args.project_index or default_index_path(args.paths, args.pattern),
+                                  args.disable_rule, args.parse_mode == "two-stage", args.lexer == "fast",
+                                  args.token_store, args.max_diagnostics, args.time_limit)
+        project.update(files)
+        results = list(project.results(files))
+    else:
+        results = list(run_checks(files, args.jobs, args.parse_mode == "two-stage", args.dfa_cache, args.profile,
+                                  result_cache, args.split, args.lexer == "fast", args.token_store,
+                                  args.disable_rule, args.max_diagnostics, args.time_limit))
+    elapsed = time.perf_counter() - start
+    if result_cache is not None:
+        result_cache.prune()
+    if args.dfa_cache and (args.jobs <= 1 or len(files) <= 1 or args.project) and not args.split:
+        from dfa_cache import save_dfa_cache
+        save_dfa_cache(args.dfa_cache)
+
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        writer = write_sarif if args.format == "sarif" else write_jsonl
+        diagnostics = writer(results, output)
+    finally:
+        if args.output:
+            output.close()
+
+    lines = sum(line_count for _, line_count, _, _ in results)
+    elapsed = max(elapsed, 1e-9)
+    print(f"Checked {len(files)} files ({lines} lines) in {elapsed:.2f}s: "
+          f"{len(files) / elapsed:.1f} files/s, {lines / elapsed:.1f} lines/s, "
+          f"{diagnostics} diagnostics.", file=sys.stderr)
+    if result_cache is not None:
+        print(f"Result cache: {result_cache.stats()}.", file=sys.stderr)
+    if project is not None:
+        print(f"Project index: {project.stats()}.", file=sys.stderr)
+    if args.profile:
+        from profiling import Profile
+
+        total = Profile()
+        for _, _, _, file_profile in results:
+            total.merge(file_profile)
+        print(total.report(), file=sys.stderr)
+    # Warnings (the optional checks of rule_engine.py) only fail the run with --warnings-as-errors, but partial
+    # results never pass: the truncation markers are warnings too
+    failed = any(args.warnings_as_errors or error.severity == ERROR or error.code in TRUNCATION_CODES
+                 for _, _, errors, _ in results for error in errors)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
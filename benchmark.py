@@ -0,0 +1,364 @@
+import argparse
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from antlr4 import InputStream, CommonTokenStream
+from code_analyzer import LexerErrorListener, ParserErrorListener, analyze_code, parse_start
+from diagnostics import LEXICAL, Diagnostic
+from fast_lexer import FastTokenSource
+from generated.LanguageLexer import LanguageLexer
+from generated.LanguageParser import LanguageParser
+from program_generator import generate_program
+from semantic_analyzer import SemanticAnalyzer
+from syntax_tree import Block, MainMethodDeclaration, Name, NotExpression, Program, ReturnStatement, VariableDeclaration
+from token_store import TokenStore, TokenStoreStream, unknown_token_errors
+from tree_builder import build_syntax_tree
+
+PHASES = ("lex", "parse", "semantic")
+DEFAULT_SIZES = "1k,10k"
+DEFAULT_THRESHOLD = 0.15
+
+
+def parse_size(text):
+    # "1000", "10k" or "1M" -> number of lines
+    text = text.strip().lower()
+    multiplier = {"k": 1000, "m": 1000000}.get(text[-1:], 1)
+    return int(float(text.rstrip("km")) * multiplier)
+
+
+def size_label(lines):
+    if lines >= 1000000 and lines % 1000000 == 0:
+        return f"{lines // 1000000}M"
+    if lines >= 1000 and lines % 1000 == 0:
+        return f"{lines // 1000}k"
+    return str(lines)
+
+
+def run_phases(source, two_stage, measure, fast_lexer=False, token_store=False):
+    """
+    Runs the lexer, the parser (including the conversion to a syntax tree) and the semantic analyzer on `source`
+    one after the other, calling `measure(phase, function)` to run (and measure) each phase.
+    With `fast_lexer`, the regex tokenizer of fast_lexer.py replaces the generated lexer.
+    With `token_store`, the tokens are kept in a TokenStore (see token_store.py).
+    Returns the number of tokens and of diagnostics.
+    """
+    errors = []
+
+    def lex():
+        if token_store:
+            if fast_lexer:
+                store = TokenStore.from_source(source)
+            else:
+                lexer = LanguageLexer(InputStream(source))
+                lexer.removeErrorListeners()
+                lexer.addErrorListener(LexerErrorListener(errors))
+                store = TokenStore.from_lexer(lexer, source)
+            errors.extend(unknown_token_errors(store))
+            return TokenStoreStream(store)
+        if fast_lexer:
+            token_stream = CommonTokenStream(FastTokenSource(source, errors=errors))
+            token_stream.fill()
+            return token_stream
+        lexer = LanguageLexer(InputStream(source))
+        lexer.removeErrorListeners()
+        lexer.addErrorListener(LexerErrorListener(errors))
+        token_stream = CommonTokenStream(lexer)
+        token_stream.fill()
+        # The scan for unknown symbols of analyze_code, which the fast tokenizer does while tokenizing
+        for token in token_stream.tokens:
+            if token.type == LanguageLexer.UNKNOWN:
+                errors.append(Diagnostic.at_token(LEXICAL, "unrecognized-symbol", token, token.text))
+        return token_stream
+
+    token_stream = measure("lex", lex)
+
+    def parse():
+        # The parse tree is converted to the syntax tree the semantic checks run on, and dropped
+        return build_syntax_tree(parse_start(LanguageParser(token_stream), ParserErrorListener(errors), two_stage))
+
+    tree = measure("parse", parse)
+
+    def semantic():
+        analyzer = SemanticAnalyzer()
+        analyzer.visit(tree)
+        return analyzer.errors
+
+    errors += measure("semantic", semantic)
+    return (token_stream.size if token_store else len(token_stream.tokens)), len(errors)
+
+
+def benchmark_source(source, two_stage=True, repeat=3, memory=True, fast_lexer=False, token_store=False):
+    """
+    Measures every phase of the analysis of `source`.
+    Times are the best of `repeat` runs. When `memory` is set, one more run is traced with tracemalloc
+    to record the peak memory allocated by each phase (excluding what was allocated before the phase started)
+    and the overall peak; tracing is kept out of the timed runs since it slows Python down considerably.
+    """
+    result = {f"{phase}_s": float("inf") for phase in PHASES}
+
+    def timed(phase, function):
+        gc.collect()
+        start = time.perf_counter()
+        value = function()
+        elapsed = time.perf_counter() - start
+        result[f"{phase}_s"] = min(result[f"{phase}_s"], elapsed)
+        return value
+
+    for _ in range(max(1, repeat)):
+        result["tokens"], result["diagnostics"] = run_phases(source, two_stage, timed, fast_lexer, token_store)
+    result["total_s"] = sum(result[f"{phase}_s"] for phase in PHASES)
+
+    if memory:
+        def traced(phase, function):
+            gc.collect()
+            start, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            value = function()
+            _, peak = tracemalloc.get_traced_memory()
+            result[f"{phase}_peak_bytes"] = peak - start
+            result["peak_bytes"] = max(result.get("peak_bytes", 0), peak)
+            return value
+
+        tracemalloc.start()
+        try:
+            run_phases(source, two_stage, traced, fast_lexer, token_store)
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def run_benchmarks(sizes, seed=0, two_stage=True, repeat=3, memory=True, error_rate=0.05, warmup=True, report=None,
+                   fast_lexer=False, token_store=False):
+    """
+    Benchmarks a valid and a broken generated program of every size.
+    Unless `warmup` is disabled, a small program is analyzed first, so that the measurements reflect
+    the warm prediction DFAs of a long-running process rather than the cold start of the first file.
+    `report` is called with every result as soon as it is available.
+    """
+    if warmup:
+        for broken in (False, True):
+            run_phases(generate_program(500, seed, broken, error_rate), two_stage, lambda phase, function: function(),
+                       fast_lexer, token_store)
+    results = []
+    for lines in sizes:
+        for broken in (False, True):
+            source = generate_program(lines, seed, broken, error_rate)
+            result = {"case": f"{'broken' if broken else 'valid'}-{size_label(lines)}",
+                      "lines": source.count("\n")}
+            result.update(benchmark_source(source, two_stage, repeat, memory, fast_lexer, token_store))
+            results.append(result)
+            if report is not None:
+                report(result)
+    return results
+
+
+def nested_source(depth):
+    # A valid program whose syntax tree is `depth` levels deep: a chain of `depth` additions, which the parser
+    # reads in a loop (parentheses or `!` nested that deep would exceed the recursion limit in the generated parser)
+    chain = " + ".join(["a"] * depth)
+    return f"public class Deep {{\n    public int sum(int a) {{\n        int total = {chain};\n        return total;\n" \
+           f"    }}\n}}\n"
+
+
+def parenthesized_source(depth):
+    # A program reading an undeclared variable, then nesting `!(` `depth` times: beyond the recursion limit, the
+    # generated parser reports the nesting as a syntax error, and the first statement must still be checked
+    return f"int first = undeclared;\nboolean deep = {'!(' * depth}true{')' * depth};\n"
+
+
+def nested_tree(depth):
+    """
+    A valid syntax tree `depth` levels deep both in statements and in expressions, which the parser cannot produce:
+    `depth` nested blocks in the main method, each declaring a variable initialized with the one of the enclosing
+    block, around a return statement applying `!` `depth` times to the innermost variable.
+    """
+    value = Name((depth + 1, 7, depth + 1, 8), f"b{depth - 1}")
+    for _ in range(depth):
+        value = NotExpression((depth + 1, 7, depth + 1, 8), value)
+    statements = [ReturnStatement((depth + 1, 0, depth + 1, 8), value)]
+    for level in reversed(range(depth)):
+        span = (level + 1, 0, 2 * depth + 1 - level, 1)
+        initial = Name(span, f"b{level - 1}") if level else Name(span, "args")
+        block = Block(span, [VariableDeclaration(span, "boolean", f"b{level}", initial)] + statements)
+        statements = [block]
+    return Program((1, 0, 2 * depth + 1, 1), [MainMethodDeclaration((1, 0, 2 * depth + 1, 1), statements[0])])
+
+
+def run_nesting(depth):
+    """
+    Stress test of the iterative tree walks: analyzes nested_source(depth) (lexing, parsing, conversion and
+    semantic analysis) and runs the semantic analyzer on nested_tree(depth), under the current recursion limit;
+    then analyzes parenthesized_source() nested at least as deep as the recursion limit, which must be reported
+    as a syntax error rather than crash the analysis.
+    Returns (case, seconds, diagnostics, expected diagnostic codes) for each; a walk that recurses raises
+    RecursionError.
+    """
+    results = []
+    start = time.perf_counter()
+    errors = analyze_code(nested_source(depth))
+    results.append((f"chain of {depth} `+`", time.perf_counter() - start, errors, []))
+
+    tree = nested_tree(depth)
+    start = time.perf_counter()
+    analyzer = SemanticAnalyzer()
+    analyzer.symbols.declare("args", "boolean")
+    analyzer.visit(tree)
+    results.append((f"{depth} nested blocks and `!`", time.perf_counter() - start, analyzer.errors, []))
+
+    parentheses = max(depth, sys.getrecursionlimit())
+    start = time.perf_counter()
+    errors = analyze_code(parenthesized_source(parentheses))
+    results.append((f"{parentheses} nested `!(`", time.perf_counter() - start, errors,
+                    ["undeclared-variable", "nested-too-deeply"]))
+    return results
+
+
+def metadata(args):
+    import antlr4
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "antlr4_runtime": getattr(antlr4, "__version__", None),
+        "seed": args.seed,
+        "parse_mode": args.parse_mode,
+        "lexer": args.lexer,
+        "token_store": args.token_store,
+        "repeat": args.repeat,
+        "error_rate": args.error_rate,
+    }
+
+
+def format_bytes(count):
+    if count is None:
+        return "-"
+    return f"{count / (1024 * 1024):.1f}M"
+
+
+def format_result(result):
+    lines_per_s = result["lines"] / max(result["total_s"], 1e-9)
+    return (f"{result['case']:<14} {result['lines']:>9} {result['tokens']:>10} {result['lex_s']:>9.3f} "
+            f"{result['parse_s']:>9.3f} {result['semantic_s']:>9.3f} {lines_per_s:>11.0f} "
+            f"{format_bytes(result.get('peak_bytes')):>9} {result['diagnostics']:>7}")
+
+
+HEADER = (f"{'case':<14} {'lines':>9} {'tokens':>10} {'lex s':>9} {'parse s':>9} {'sem s':>9} "
+          f"{'lines/s':>11} {'peak':>9} {'diags':>7}")
+
+# Metrics compared against the baseline: lower is better for all of them
+COMPARED_METRICS = tuple(f"{phase}_s" for phase in PHASES) + ("total_s",) + \
+    tuple(f"{phase}_peak_bytes" for phase in PHASES) + ("peak_bytes",)
+
+
+def compare_results(baseline, results, threshold):
+    """
+    Compares the results with the baseline case by case.
+    Returns (case, metric, baseline value, current value, ratio) for every metric that grew
+    by more than `threshold` (e.g. 0.15 for 15%).
+    """
+    baseline_cases = {result["case"]: result for result in baseline}
+    regressions = []
+    for result in results:
+        previous = baseline_cases.get(result["case"])
+        if previous is None:
+            continue
+        for metric in COMPARED_METRICS:
+            old, new = previous.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            ratio = new / old
+            if ratio > 1 + threshold:
+                regressions.append((result["case"], metric, old, new, ratio))
+    return regressions
+
+
+def main(argv=None):
+    # Command-line entry point of the benchmarks.
+    # Exits with status 1 when --compare finds a regression beyond the threshold, 0 otherwise.
+    arg_parser = argparse.ArgumentParser(
+        description="Benchmark the lexer, parser and semantic analyzer on generated programs.")
+    arg_parser.add_argument("--sizes", default=DEFAULT_SIZES,
+                            help=f"comma-separated program sizes in lines, e.g. 1k,10k,100k,1M (default: {DEFAULT_SIZES})")
+    arg_parser.add_argument("-s", "--seed", type=int, default=0, help="seed of the program generator (default: 0)")
+    arg_parser.add_argument("-r", "--repeat", type=int, default=3,
+                            help="timed runs per case, the best one is kept (default: 3)")
+    arg_parser.add_argument("--error-rate", type=float, default=0.05,
+                            help="fraction of the statements with an error in broken programs (default: 0.05)")
+    arg_parser.add_argument("--parse-mode", choices=("two-stage", "ll"), default="two-stage",
+                            help="parsing mode, as in batch_checker.py (default: two-stage)")
+    arg_parser.add_argument("--lexer", choices=("antlr", "fast"), default="antlr",
+                            help="lexer engine, as in batch_checker.py (default: antlr)")
+    arg_parser.add_argument("--token-store", action="store_true",
+                            help="keep the tokens in compact arrays, as in batch_checker.py")
+    arg_parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run measuring peak memory")
+    arg_parser.add_argument("--no-warmup", action="store_true",
+                            help="measure with cold prediction DFAs (no warm-up run before the first case)")
+    arg_parser.add_argument("--nesting", type=int, metavar="DEPTH",
+                            help="instead of the benchmarks, check that programs nested DEPTH levels deep (e.g. "
+                                 "100000) are analyzed without exceeding the recursion limit")
+    arg_parser.add_argument("--save", metavar="PATH", help="save the results to PATH, e.g. as a new baseline")
+    arg_parser.add_argument("--compare", metavar="PATH", help="compare the results with the baseline saved in PATH")
+    arg_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                            help=f"relative slowdown (or memory growth) reported as a regression by --compare "
+                                 f"(default: {DEFAULT_THRESHOLD})")
+    args = arg_parser.parse_args(argv)
+
+    if args.nesting:
+        print(f"Recursion limit: {sys.getrecursionlimit()}")
+        try:
+            results = run_nesting(args.nesting)
+        except RecursionError:
+            print(f"FAILED: the recursion limit was exceeded at a depth of {args.nesting}.")
+            return 1
+        failed = False
+        for case, seconds, errors, expected in results:
+            print(f"  {case:<32} {seconds:>8.2f}s  {len(errors)} diagnostics")
+            codes = [error.code for error in errors]
+            if codes != expected:
+                print(f"FAILED: expected {expected or 'no diagnostics'}, got {codes}.")
+                failed = True
+        return 1 if failed else 0
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+
+    sizes = [parse_size(size) for size in args.sizes.split(",") if size.strip()]
+    print(HEADER)
+
+    def report(result):
+        print(format_result(result), flush=True)
+
+    results = run_benchmarks(sizes, args.seed, args.parse_mode == "two-stage", args.repeat, not args.no_memory,
+                             args.error_rate, not args.no_warmup, report, args.lexer == "fast", args.token_store)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as output:
+            json.dump({"metadata": metadata(args), "results": results}, output, indent=2)
+            output.write("\n")
+
+    if baseline is not None:
+        regressions = compare_results(baseline["results"], results, args.threshold)
+        if baseline.get("metadata", {}).get("platform") != platform.platform():
+            print("Warning: the baseline was recorded on a different platform.", file=sys.stderr)
+        if not regressions:
+            print(f"\nNo regressions beyond {args.threshold:.0%} compared to {args.compare}.")
+            return 0
+        print(f"\nRegressions beyond {args.threshold:.0%} compared to {args.compare}:")
+        for case, metric, old, new, ratio in regressions:
+            if metric.endswith("_bytes"):
+                old, new = format_bytes(old), format_bytes(new)
+            else:
+                old, new = f"{old:.3f}s", f"{new:.3f}s"
+            print(f"  {case:<14} {metric:<20} {old:>10} -> {new:>10} ({ratio - 1:+.0%})")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
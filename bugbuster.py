@@ -0,0 +1,55 @@
+# Programmatic entry point of the analyzer, e.g. for scripts, pre-commit hooks and other tools:
+#
+#     import bugbuster
+#     for diagnostic in bugbuster.analyze(source):
+#         print(diagnostic.text)
+#
+# Importing this module never imports Qt, and it does not even import the ANTLR runtime: the generated lexer
+# and parser (whose ATNs are deserialized when their modules are loaded) and the semantic analyzer are
+# imported on the first analysis. The other analyzers and helpers are available as attributes of this module
+# and are imported the first time they are accessed.
+from diagnostics import ERROR, LEXICAL, SEMANTIC, SYNTAX, WARNING, Diagnostic, is_truncated
+
+# Attributes imported on first access: name -> module defining it
+LAZY_ATTRIBUTES = {
+    "AnalysisBudget": "code_analyzer",
+    "AnalysisCancelled": "code_analyzer",
+    "IncrementalAnalyzer": "incremental_analyzer",
+    "analyze_parallel": "parallel_analyzer",
+    "ProjectAnalyzer": "project_analyzer",
+    "Profile": "profiling",
+    "ResultCache": "result_cache",
+    "load_dfa_cache": "dfa_cache",
+    "save_dfa_cache": "dfa_cache",
+}
+
+__all__ = ["analyze", "analyze_file", "Diagnostic", "is_truncated", "ERROR", "WARNING", "LEXICAL", "SYNTAX",
+           "SEMANTIC"] + list(LAZY_ATTRIBUTES)
+
+
+def analyze(source, two_stage=True, profile=None, is_cancelled=None, fast_lexer=False, token_store=False,
+            disabled_rules=(), budget=None):
+    """
+    Analyzes a piece of source code and returns its lexical, syntax and semantic errors
+    as Diagnostic records sorted by line (see code_analyzer.analyze_code for the arguments).
+    """
+    from code_analyzer import analyze_code
+    return analyze_code(source, is_cancelled, two_stage, profile, fast_lexer, token_store, disabled_rules, budget)
+
+
+def analyze_file(path, two_stage=True, profile=None, fast_lexer=False, token_store=False, disabled_rules=(),
+                 budget=None):
+    # Reads a UTF-8 source file and analyzes it.
+    from source_files import read_source
+    return analyze(read_source(path), two_stage, profile, fast_lexer=fast_lexer, token_store=token_store,
+                   disabled_rules=disabled_rules, budget=budget)
+
+
+def __getattr__(name):
+    module_name = LAZY_ATTRIBUTES.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    import importlib
+    value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,400 @@
+from antlr4 import InputStream, CommonTokenStream
+from antlr4.atn.PredictionMode import PredictionMode
+from antlr4.error.ErrorListener import ErrorListener
+from antlr4.error.ErrorStrategy import BailErrorStrategy, DefaultErrorStrategy
+from antlr4.error.Errors import ParseCancellationException
+from antlr4.tree.Tree import ParseTreeListener
+import time
+
+from diagnostics import (LEXICAL, SEMANTIC, SYNTAX, TIME_LIMIT_EXCEEDED, TOO_MANY_DIAGNOSTICS, WARNING, Diagnostic,
+                         sort_diagnostics)
+from fast_lexer import FastTokenSource
+from generated.LanguageLexer import LanguageLexer
+from generated.LanguageParser import LanguageParser
+from profiling import profile_phase
+from semantic_analyzer import SemanticAnalyzer
+from token_store import TokenStore, TokenStoreStream, unknown_token_errors
+from tree_builder import build_syntax_tree
+
+
+class AnalysisCancelled(Exception):
+    # Raised when an analysis is abandoned because a newer request superseded it.
+    pass
+
+
+class CancellationListener(ParseTreeListener):
+    # Parse listener that polls the cancellation callback every time the parser enters a rule,
+    # so that a long parse can be abandoned without waiting for it to finish.
+    def __init__(self, is_cancelled):
+        self.is_cancelled = is_cancelled
+
+    def enterEveryRule(self, ctx):
+        if self.is_cancelled():
+            raise AnalysisCancelled()
+
+
+class AnalysisBudget:
+    """
+    Bounds the cost of an analysis on pathological input (a pasted binary blob, thousands of stray symbols):
+    at most `max_diagnostics` diagnostics per phase and at most `time_limit` seconds of wall-clock time from
+    start(), either limit being None when unbounded. Once the syntax errors reach the cap or the time is up,
+    the parser bails out at its next error instead of recovering from it, and whatever it parsed until then is
+    still checked; the semantic analysis stops between top-level statements. Lexing stops once the time is up
+    (with the generated lexer only: the regex tokenizer of fast_lexer.py is not interrupted).
+    A budget is started again for every analysis. The phases cut short are recorded in `truncated`
+    (phase -> (line, column) where its reporting stopped), and the partial results end with a warning per
+    such phase (see markers() and diagnostics.is_truncated), so they are never mistaken for complete ones.
+    """
+
+    def __init__(self, max_diagnostics=None, time_limit=None):
+        self.max_diagnostics = max_diagnostics
+        self.time_limit = time_limit
+        self.deadline = None
+        self.remaining = None  # Time left when paused
+        self.truncated = {}
+        self.reasons = {}  # phase -> code of the marker of a phase cut short
+
+    def start(self):
+        self.deadline = time.perf_counter() + self.time_limit if self.time_limit is not None else None
+        self.truncated = {}
+        self.reasons = {}
+        return self
+
+    def pause(self):
+        # Stops the clock until resume(), e.g. while other files are parsed between the phases of this analysis
+        if self.deadline is not None:
+            self.remaining = self.deadline - time.perf_counter()
+
+    def resume(self):
+        if self.deadline is not None:
+            self.deadline = time.perf_counter() + self.remaining
+
+    def expired(self):
+        return self.deadline is not None and time.perf_counter() > self.deadline
+
+    def capped(self, count):
+        # Whether `count` diagnostics reach the cap
+        return self.max_diagnostics is not None and count >= self.max_diagnostics
+
+    def exhausted(self, count):
+        # Whether a phase that has found `count` diagnostics must stop
+        return self.capped(count) or self.expired()
+
+    def cut(self, phase, reason, line, column=None):
+        # Records that the diagnostics of `phase` stop at the given position, for the given reason
+        # (TOO_MANY_DIAGNOSTICS or TIME_LIMIT_EXCEEDED); the earliest cut of a phase is kept
+        position = (line or 0, column or 0)
+        previous = self.truncated.get(phase)
+        if previous is None or position < (previous[0] or 0, previous[1] or 0):
+            self.truncated[phase] = (line, column)
+            self.reasons[phase] = reason
+
+    def limit(self, phase, diagnostics):
+        # Drops the diagnostics of a phase beyond the cap, in place
+        if self.max_diagnostics is not None and len(diagnostics) > self.max_diagnostics:
+            first_dropped = diagnostics[self.max_diagnostics]
+            self.cut(phase, TOO_MANY_DIAGNOSTICS, first_dropped.line, first_dropped.column)
+            del diagnostics[self.max_diagnostics:]
+        return diagnostics
+
+    def visit(self, semantic_analyzer, trees):
+        # Runs the semantic analyzer over the trees in order, stopping before the next one once the semantic errors
+        # reach the cap or the time is up
+        for tree in trees:
+            if self.exhausted(len(semantic_analyzer.errors)):
+                reason = TOO_MANY_DIAGNOSTICS if self.capped(len(semantic_analyzer.errors)) else TIME_LIMIT_EXCEEDED
+                self.cut(SEMANTIC, reason, tree.line, tree.column)
+                break
+            semantic_analyzer.visit(tree)
+        self.limit(SEMANTIC, semantic_analyzer.errors)
+
+    def markers(self):
+        # The warnings marking the phases cut short, at the position where their diagnostics stop
+        markers = []
+        for phase, (line, column) in self.truncated.items():
+            code = self.reasons[phase]
+            args = (phase, self.max_diagnostics) if code == TOO_MANY_DIAGNOSTICS else (self.time_limit, phase)
+            markers.append(Diagnostic(phase, code, line, column, severity=WARNING, args=args))
+        return markers
+
+
+def analysis_budget(max_diagnostics=None, time_limit=None):
+    # The AnalysisBudget of the analysis of a file, None when it is not limited
+    if max_diagnostics is None and time_limit is None:
+        return None
+    return AnalysisBudget(max_diagnostics, time_limit)
+
+
+class BudgetListener(ParseTreeListener):
+    # Parse listener of a budgeted parse (see parse_start): bails out as soon as the time of the budget is up.
+    def __init__(self, budget):
+        self.budget = budget
+        self.stopped_at = None  # Token where the time ran out
+
+    def enterEveryRule(self, ctx):
+        if self.budget.expired():
+            self.stopped_at = ctx.start
+            raise ParseCancellationException("time limit exceeded")
+
+
+class CustomErrorMessage:
+    # Provides utility methods for transforming default error messages into more readable and user-friendly text.
+    @staticmethod
+    def transform(msg, offending_symbol):
+        # Transforms specific parser error messages into clearer explanations.
+        # like unexpected end of input and incomplete statements.
+        # Returns the diagnostic code and its message arguments (see diagnostics.MESSAGES).
+        if "mismatched input '<EOF>'" in msg:
+            if offending_symbol.text == "<EOF>":
+                return "unexpected-end-of-input", ()
+            return "error-near", (offending_symbol.text,)
+        if "no viable alternative at input" in msg:
+            if offending_symbol.text == "<EOF>":
+                return "incomplete-statement", ()
+            return "error-near", (offending_symbol.text,)
+        if "'<EOF>'" in msg:
+            msg = msg.replace(" at '<EOF>'", "")
+        return "syntax-error", (msg,)
+
+
+class LexerErrorListener(ErrorListener):
+    # Custom error listener for the lexer to capture token recognition errors as Diagnostic records.
+    def __init__(self, errors):
+        super().__init__()
+        self.errors = errors
+
+    def syntaxError(self, recognizer, offendingSymbol, line, column, msg, e):
+        # There is no offending token: the error spans the input the lexer could not match (see Lexer.notifyListeners)
+        length = recognizer._input.index - recognizer._tokenStartCharIndex + 1
+        self.errors.append(Diagnostic(LEXICAL, "token-recognition", line, column, line, column + length, args=(msg,)))
+
+
+class ParserErrorListener(ErrorListener):
+    # Custom error listener for the parser to capture syntax errors as Diagnostic records.
+    # Overrides the default error handling mechanism to provide more user-friendly messages.
+    # With an AnalysisBudget, the parser is switched to the BailErrorStrategy once the errors reach the cap
+    # or the time is up, so it stops at its next error instead of recovering from it.
+    def __init__(self, errors, budget=None):
+        super().__init__()
+        self.errors = errors
+        self.budget = budget
+
+    def syntaxError(self, recognizer, offendingSymbol, line, column, msg, e):
+        code, args = CustomErrorMessage.transform(msg, offendingSymbol)
+        diagnostic = Diagnostic.at_token(SYNTAX, code, offendingSymbol, *args)
+        diagnostic.line, diagnostic.column = line, column
+        self.errors.append(diagnostic)
+        if self.budget is not None and self.budget.exhausted(len(self.errors)):
+            recognizer._errHandler = BailErrorStrategy()
+
+
+def check_cancelled(is_cancelled):
+    # Aborts the running analysis if the optional cancellation callback says so.
+    if is_cancelled is not None and is_cancelled():
+        raise AnalysisCancelled()
+
+
+def fill_tokens(token_stream, is_cancelled=None, budget=None):
+    # Equivalent to token_stream.fill(), but fetches the tokens in batches
+    # and checks for cancellation between them. With an AnalysisBudget, lexing stops once the time is up.
+    token_stream.lazyInit()
+    while token_stream.fetch(1000) == 1000:
+        check_cancelled(is_cancelled)
+        if budget is not None and budget.expired():
+            last_token = token_stream.tokens[-1]
+            budget.cut(LEXICAL, TIME_LIMIT_EXCEEDED, last_token.line, last_token.column)
+            break
+
+
+def parse_rooted(parser, roots):
+    """
+    parser.start_(), appending the root of the parse tree to `roots` as soon as the parse begins, so that the
+    part of the tree built so far is still reachable when the parse is abandoned by an exception (ANTLR unwinds
+    its own reference). The first Parser.enterRule call is intercepted once, so the rest of the parse costs
+    nothing more.
+    """
+    def enter_root(localctx, state, rule_index):
+        del parser.enterRule
+        roots.append(localctx)
+        parser.enterRule(localctx, state, rule_index)
+
+    parser.enterRule = enter_root
+    try:
+        return parser.start_()
+    finally:
+        parser.__dict__.pop("enterRule", None)
+
+
+def partial_tree(roots):
+    # The part of the parse tree built by an abandoned parse (see parse_rooted), an empty start rule when the
+    # parse did not begin
+    return roots[-1] if roots else LanguageParser.Start_Context(None)
+
+
+def parse_start(parser, error_listener, two_stage=True, profile=None, budget=None):
+    # Parses the token stream with the start rule and reports syntax errors to `error_listener`.
+    # In two-stage mode the input is first parsed with the faster SLL prediction and an error strategy
+    # that bails out at the first error; only if that fails (a syntax error, or an input that really
+    # needs full context) the input is parsed again with full LL prediction and the default error recovery,
+    # which also reports the errors. Valid input therefore never pays for full-LL prediction.
+    # With a `profile` (see profiling.py), the two stages are timed separately and prediction is instrumented.
+    # With an AnalysisBudget, a parse that runs out of it (see BudgetListener and ParserErrorListener) returns
+    # the part of the parse tree built so far, and the syntax phase is marked as cut short.
+    # The generated parser recurses at every nesting level of the code: code nested deeper than the recursion
+    # limit allows (an expression within a thousand parentheses) is reported as a `nested-too-deeply` syntax
+    # error to `error_listener` (a ParserErrorListener), and the part of the parse tree built before it is
+    # returned, so that the code preceding it is still checked.
+    parser.removeErrorListeners()
+    if profile is not None:
+        profile.instrument_parser(parser)
+    budget_listener = None
+    if budget is not None:
+        budget_listener = BudgetListener(budget)
+        parser.addParseListener(budget_listener)
+    roots = []
+    try:
+        if two_stage:
+            parser._interp.predictionMode = PredictionMode.SLL
+            parser._errHandler = BailErrorStrategy()
+            try:
+                with profile_phase(profile, "parse (SLL)"):
+                    return parse_rooted(parser, roots)
+            except ParseCancellationException:
+                if profile is not None:
+                    profile.count("LL fallbacks")
+                parser._interp.predictionMode = PredictionMode.LL
+                parser._errHandler = DefaultErrorStrategy()
+                # Parser.reset() fails when parse listeners are registered (it tries to remove a missing tracer),
+                # so they are set aside while resetting
+                parse_listeners, parser._parseListeners = parser._parseListeners, None
+                parser.reset()
+                parser._parseListeners = parse_listeners
+                roots.clear()
+        parser.addErrorListener(error_listener)
+        with profile_phase(profile, "parse (LL)"):
+            if budget is None:
+                return parse_rooted(parser, roots)
+            budget_listener.stopped_at = None
+            try:
+                return parse_rooted(parser, roots)
+            except ParseCancellationException:
+                # Stopped where the time ran out, or at the error that was not recovered from once the errors
+                # reached the cap (or the time was up)
+                stop = budget_listener.stopped_at or parser.getCurrentToken()
+                capped = budget_listener.stopped_at is None and budget.capped(len(error_listener.errors))
+                budget.cut(SYNTAX, TOO_MANY_DIAGNOSTICS if capped else TIME_LIMIT_EXCEEDED, stop.line, stop.column)
+                return partial_tree(roots)
+    except RecursionError:
+        error_listener.errors.append(Diagnostic.at_token(SYNTAX, "nested-too-deeply", parser.getCurrentToken()))
+        return partial_tree(roots)
+
+
+def new_lexer(input_code, line, column, lexer_errors):
+    # Generated lexer over the code, starting at the given document position and reporting its errors
+    lexer = LanguageLexer(InputStream(input_code))
+    lexer.line = line
+    lexer.column = column
+    lexer.removeErrorListeners()
+    lexer.addErrorListener(LexerErrorListener(lexer_errors))
+    return lexer
+
+
+def parse_code(input_code, is_cancelled=None, two_stage=True, profile=None, line=1, column=0, fast_lexer=False,
+               token_store=False, budget=None):
+    # Lexes and parses a piece of source code, see analyze_code for the arguments (a `budget` must be started).
+    # `line` and `column` are the position of the code in its document (e.g. for a part of a larger file),
+    # so that the tokens, and therefore all the diagnostics, carry document positions.
+    # Returns the parse tree, the lexical errors and the syntax errors.
+    lexer_errors = []
+    if token_store:
+        # The tokens are kept in the arrays of a TokenStore rather than as one object per token
+        if isinstance(token_store, TokenStore):
+            store = token_store  # Already tokenized, e.g. by the editor (see TokenStore.from_lines)
+        else:
+            with profile_phase(profile, "lex (store)"):
+                if fast_lexer:
+                    store = TokenStore.from_source(input_code, line, column)
+                else:
+                    store = TokenStore.from_lexer(new_lexer(input_code, line, column, lexer_errors), input_code,
+                                                  is_cancelled, budget=budget)
+                    if store is None:
+                        raise AnalysisCancelled()
+            check_cancelled(is_cancelled)
+        with profile_phase(profile, "unknown token scan"):
+            lexer_errors += unknown_token_errors(store)
+        token_stream = TokenStoreStream(store)
+    elif fast_lexer:
+        # The fast tokenizer reports the unknown symbols while tokenizing
+        with profile_phase(profile, "lex (fast)"):
+            token_stream = CommonTokenStream(FastTokenSource(input_code, line, column, lexer_errors))
+            token_stream.fill()
+        check_cancelled(is_cancelled)
+    else:
+        lexer = new_lexer(input_code, line, column, lexer_errors)
+        token_stream = CommonTokenStream(lexer)
+        with profile_phase(profile, "lex (fill)"):
+            fill_tokens(token_stream, is_cancelled, budget)
+
+        with profile_phase(profile, "unknown token scan"):
+            for token in token_stream.tokens:
+                if token.type == lexer.UNKNOWN:
+                    lexer_errors.append(Diagnostic.at_token(LEXICAL, "unrecognized-symbol", token, token.text))
+
+    if budget is not None:
+        budget.limit(LEXICAL, lexer_errors)
+
+    parser = LanguageParser(token_stream)
+    parser_errors = []
+
+    if is_cancelled is not None:
+        parser.addParseListener(CancellationListener(is_cancelled))
+    tree = parse_start(parser, ParserErrorListener(parser_errors, budget), two_stage, profile, budget)
+    check_cancelled(is_cancelled)
+    return tree, lexer_errors, parser_errors
+
+
+def parse_syntax_tree(input_code, is_cancelled=None, two_stage=True, profile=None, line=1, column=0, fast_lexer=False,
+                      token_store=False, budget=None):
+    # Same as parse_code, but returns the syntax tree the semantic checks run on (see tree_builder.py)
+    # instead of the parse tree, which is dropped once converted along with the parser and its tokens.
+    tree, lexer_errors, parser_errors = parse_code(input_code, is_cancelled, two_stage, profile, line, column,
+                                                   fast_lexer, token_store, budget)
+    with profile_phase(profile, "build syntax tree"):
+        syntax_tree = build_syntax_tree(tree)
+    return syntax_tree, lexer_errors, parser_errors
+
+
+def analyze_code(input_code, is_cancelled=None, two_stage=True, profile=None, fast_lexer=False, token_store=False,
+                 disabled_rules=(), budget=None):
+    # Performs lexical, syntactic, and semantic analysis on a piece of source code.
+    # This is the Qt-free core of the analyzer, shared by the GUI and the batch checker.
+    # Returns the errors of every phase as Diagnostic records sorted by line.
+    # `is_cancelled` is an optional callable polled between (and during) the phases;
+    # when it returns True the analysis stops by raising AnalysisCancelled.
+    # `two_stage` selects the SLL-then-LL parsing mode (see parse_start).
+    # `profile` is an optional profiling.Profile that records the cost of every phase.
+    # `fast_lexer` replaces the generated lexer with the equivalent regex tokenizer of fast_lexer.py.
+    # `token_store` keeps the tokens in a compact TokenStore (see token_store.py), for large inputs;
+    # it may also be the TokenStore of `input_code` itself, whose tokens are then parsed without lexing again.
+    # `disabled_rules` lists the codes of the optional semantic checks of rule_engine.py to skip.
+    # `budget` is an optional AnalysisBudget bounding the diagnostics per phase and the time of the analysis,
+    # which then returns partial results, marked as such, once it runs out.
+    if budget is not None:
+        budget.start()
+    syntax_tree, lexer_errors, parser_errors = parse_syntax_tree(input_code, is_cancelled, two_stage, profile,
+                                                                 fast_lexer=fast_lexer, token_store=token_store,
+                                                                 budget=budget)
+
+    semantic_analyzer = SemanticAnalyzer(disabled_rules)
+    if profile is not None:
+        profile.instrument_visitor(semantic_analyzer)
+    with profile_phase(profile, "semantic"):
+        if budget is None:
+            semantic_analyzer.visit(syntax_tree)
+        else:
+            budget.visit(semantic_analyzer, syntax_tree.statements)
+
+    errors = lexer_errors + parser_errors + semantic_analyzer.errors
+    if budget is not None:
+        errors += budget.markers()
+    return sort_diagnostics(errors)
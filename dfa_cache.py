@@ -0,0 +1,241 @@
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+
+from antlr4.PredictionContext import (ArrayPredictionContext, PredictionContext, SingletonPredictionContext)
+from antlr4.atn.ATNConfig import ATNConfig, LexerATNConfig
+from antlr4.atn.ATNConfigSet import ATNConfigSet, OrderedATNConfigSet
+from antlr4.atn.ATNSimulator import ATNSimulator
+from antlr4.atn.LexerActionExecutor import LexerActionExecutor
+from antlr4.atn.SemanticContext import SemanticContext
+from antlr4.dfa.DFAState import DFAState
+from generated.LanguageLexer import LanguageLexer
+from generated.LanguageParser import LanguageParser
+
+CACHE_FORMAT = 1
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "bugbuster", "dfa_cache.pickle")
+
+EMPTY_CONTEXT_ID = 0
+ERROR_STATE_ID = -1
+
+
+def recognizer_fingerprint(recognizer_class):
+    # Identifies the ATN the DFAs were built for; a regenerated lexer or parser invalidates the cache.
+    serialized_atn = sys.modules[recognizer_class.__module__].serializedATN()
+    return hashlib.sha256(repr(serialized_atn).encode("utf-8")).hexdigest()
+
+
+class DFAWriter:
+    """
+    Converts the DFAs of a recognizer into plain tuples that can be pickled.
+    ATN states, lexer actions and DFA states are referenced by number, prediction contexts by an id
+    into a shared table, so the result does not depend on the identity of the runtime objects.
+    DFAs whose states carry semantic predicates are skipped, since predicates are not serializable.
+    """
+
+    def __init__(self, atn):
+        self.atn = atn
+        self.contexts = []  # (returnStates, parent ids), parents always precede children
+        self.context_ids = {id(PredictionContext.EMPTY): EMPTY_CONTEXT_ID}
+        self.contexts.append(None)
+
+    def context_id(self, context):
+        key = id(context)
+        if key in self.context_ids:
+            return self.context_ids[key]
+        stack = [context]
+        while stack:
+            current = stack[-1]
+            parents = [current.getParent(i) for i in range(len(current))]
+            missing = [parent for parent in parents if parent is not None and id(parent) not in self.context_ids]
+            if missing:
+                stack.extend(missing)
+                continue
+            stack.pop()
+            if id(current) in self.context_ids:
+                continue
+            return_states = tuple(current.getReturnState(i) for i in range(len(current)))
+            parent_ids = tuple(None if parent is None else self.context_ids[id(parent)] for parent in parents)
+            self.context_ids[id(current)] = len(self.contexts)
+            self.contexts.append((return_states, parent_ids))
+        return self.context_ids[key]
+
+    def executor(self, lexer_action_executor):
+        if lexer_action_executor is None:
+            return None
+        return tuple(self.atn.lexerActions.index(action) for action in lexer_action_executor.lexerActions)
+
+    def config(self, config):
+        if config.semanticContext is not SemanticContext.NONE:
+            raise ValueError("semantic predicates cannot be cached")
+        data = (config.state.stateNumber, config.alt, self.context_id(config.context),
+                config.reachesIntoOuterContext, config.precedenceFilterSuppressed)
+        if isinstance(config, LexerATNConfig):
+            data += (self.executor(config.lexerActionExecutor), config.passedThroughNonGreedyDecision)
+        return data
+
+    def state(self, state):
+        if state.predicates is not None:
+            raise ValueError("semantic predicates cannot be cached")
+        configs = state.configs
+        edges = None
+        if state.edges is not None:
+            edges = tuple(None if edge is None else (ERROR_STATE_ID if edge is ATNSimulator.ERROR else edge.stateNumber)
+                          for edge in state.edges)
+        return (state.stateNumber, state.isAcceptState, state.prediction, state.requiresFullContext,
+                self.executor(state.lexerActionExecutor), edges,
+                tuple(self.config(config) for config in configs),
+                (configs.fullCtx, configs.uniqueAlt,
+                 None if configs.conflictingAlts is None else tuple(configs.conflictingAlts),
+                 configs.hasSemanticContext, configs.dipsIntoOuterContext))
+
+    def dfa(self, dfa):
+        try:
+            states = tuple(self.state(state) for state in dfa.states)
+            if dfa.precedenceDfa:
+                start = ("precedence", tuple(None if edge is None else edge.stateNumber for edge in dfa.s0.edges))
+            else:
+                start = ("state", None if dfa.s0 is None else dfa.s0.stateNumber)
+        except ValueError:
+            return None
+        return dfa.decision, start, states
+
+
+class DFAReader:
+    """
+    Rebuilds DFA states from the tuples produced by DFAWriter and installs them into the recognizer's DFAs.
+    """
+
+    def __init__(self, atn, contexts, lexer):
+        self.atn = atn
+        self.lexer = lexer
+        self.contexts = [PredictionContext.EMPTY]
+        for return_states, parent_ids in contexts[1:]:
+            parents = [None if parent_id is None else self.contexts[parent_id] for parent_id in parent_ids]
+            if len(return_states) == 1:
+                context = SingletonPredictionContext.create(parents[0], return_states[0])
+            else:
+                context = ArrayPredictionContext(parents, list(return_states))
+            self.contexts.append(context)
+
+    def executor(self, data):
+        if data is None:
+            return None
+        return LexerActionExecutor([self.atn.lexerActions[index] for index in data])
+
+    def config(self, data):
+        state = self.atn.states[data[0]]
+        context = self.contexts[data[2]]
+        if self.lexer:
+            config = LexerATNConfig(state, data[1], context, SemanticContext.NONE, self.executor(data[5]))
+            config.passedThroughNonGreedyDecision = data[6]
+        else:
+            config = ATNConfig(state, data[1], context, SemanticContext.NONE)
+        config.reachesIntoOuterContext = data[3]
+        config.precedenceFilterSuppressed = data[4]
+        return config
+
+    def load(self, dfa, data):
+        _, start, states = data
+        by_number = {}
+        edges = {}
+        for number, accept, prediction, full_context, executor, state_edges, configs, flags in states:
+            config_set = OrderedATNConfigSet() if self.lexer else ATNConfigSet(flags[0])
+            for config in configs:
+                config_set.add(self.config(config))
+            config_set.uniqueAlt = flags[1]
+            config_set.conflictingAlts = None if flags[2] is None else set(flags[2])
+            config_set.hasSemanticContext = flags[3]
+            config_set.dipsIntoOuterContext = flags[4]
+            config_set.setReadonly(True)
+            state = DFAState(number, config_set)
+            state.isAcceptState = accept
+            state.prediction = prediction
+            state.requiresFullContext = full_context
+            state.lexerActionExecutor = self.executor(executor)
+            by_number[number] = state
+            edges[number] = state_edges
+
+        def target(number):
+            return ATNSimulator.ERROR if number == ERROR_STATE_ID else by_number.get(number)
+
+        for number, state_edges in edges.items():
+            if state_edges is not None:
+                by_number[number].edges = [None if edge is None else target(edge) for edge in state_edges]
+
+        dfa.states.clear()
+        for state in by_number.values():
+            dfa.states[state] = state
+        kind, value = start
+        if kind == "precedence":
+            dfa.s0.edges = [None if edge is None else by_number.get(edge) for edge in value]
+        else:
+            dfa.s0 = None if value is None else by_number.get(value)
+
+
+def dump_recognizer(recognizer_class):
+    writer = DFAWriter(recognizer_class.atn)
+    dfas = [data for data in (writer.dfa(dfa) for dfa in recognizer_class.decisionsToDFA) if data is not None]
+    return {"fingerprint": recognizer_fingerprint(recognizer_class), "contexts": writer.contexts, "dfas": dfas}
+
+
+def load_recognizer(recognizer_class, data, lexer):
+    if data is None or data.get("fingerprint") != recognizer_fingerprint(recognizer_class):
+        return 0
+    reader = DFAReader(recognizer_class.atn, data["contexts"], lexer)
+    for dfa_data in data["dfas"]:
+        reader.load(recognizer_class.decisionsToDFA[dfa_data[0]], dfa_data)
+    return len(data["dfas"])
+
+
+def save_dfa_cache(path=DEFAULT_CACHE_PATH):
+    """
+    Writes the DFAs warmed up by the lexer and parser in this process to `path`.
+    The file is replaced atomically, so concurrent readers never see a partial cache.
+    """
+    data = {
+        "format": CACHE_FORMAT,
+        "lexer": dump_recognizer(LanguageLexer),
+        "parser": dump_recognizer(LanguageParser),
+    }
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as cache_file:
+            pickle.dump(data, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def load_dfa_cache(path=DEFAULT_CACHE_PATH):
+    """
+    Preloads the lexer and parser DFAs saved by save_dfa_cache, so that the first parse of the process
+    does not have to rebuild them from the ATN.
+    Must be called before any lexing or parsing. A missing, stale or unreadable cache is ignored.
+    Returns the number of decisions that were restored.
+    """
+    try:
+        with open(path, "rb") as cache_file:
+            data = pickle.load(cache_file)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return 0
+    if not isinstance(data, dict) or data.get("format") != CACHE_FORMAT:
+        return 0
+    try:
+        return load_recognizer(LanguageLexer, data.get("lexer"), True) + \
+            load_recognizer(LanguageParser, data.get("parser"), False)
+    except (IndexError, KeyError, TypeError, ValueError):
+        # Corrupted cache: start again from empty DFAs
+        for recognizer_class in (LanguageLexer, LanguageParser):
+            for dfa in recognizer_class.decisionsToDFA:
+                dfa.states.clear()
+                if not dfa.precedenceDfa:
+                    dfa.s0 = None
+                else:
+                    dfa.s0.edges = []
+        return 0
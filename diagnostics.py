@@ -0,0 +1,181 @@
+LEXICAL = "lexical"
+SYNTAX = "syntax"
+SEMANTIC = "semantic"
+
+ERROR = "error"
+WARNING = "warning"
+
+# Message templates of every diagnostic code, filled in with the arguments of the diagnostic when displayed
+MESSAGES = {
+    # Lexical analysis
+    "token-recognition": "{0}",
+    "unrecognized-symbol": "unrecognized symbol '{0}'",
+    # Syntax analysis
+    "syntax-error": "{0}",
+    "unexpected-end-of-input": "Unexpected end of input: check for missing or incomplete statements.",
+    "nested-too-deeply": "Code nested too deeply to be parsed: the code from here on is not checked.",
+    "incomplete-statement": "Incomplete statement or missing input at the end of the code.",
+    "error-near": "Error near '{0}'",
+    # Semantic analysis
+    "declaration-without-identifier": "Declaration without an identifier.",
+    "invalid-data-type": "Invalid data type '{0}' for variable '{1}'.",
+    "variable-already-declared": "Variable '{0}' already declared.",
+    "incompatible-declaration": "Incompatible type '{0}' with declaration '{1}' for variable '{2}'.",
+    "undeclared-variable": "Variable '{0}' used without declaration.",
+    "incompatible-assignment": "Assignment of type '{0}' to variable of type '{1}'.",
+    "method-without-name": "Method without a name.",
+    "parameter-without-identifier": "Parameter without an identifier.",
+    "invalid-system-out-method": "Method '{0}' called on 'System.out' is not recognized as valid.",
+    "undeclared-method": "Method '{0}' called without being declared in class '{1}'.",
+    "method-outside-class": "Method '{0}' called outside of a class.",
+    "class-without-name": "Class without a name.",
+    "class-already-declared": "Class '{0}' already declared.",
+    "method-already-declared": "Method '{0}' already declared in class '{1}'.",
+    # Semantic warnings (see rule_engine.py)
+    "unused-variable": "Variable '{0}' is declared but never used.",
+    "unreachable-code": "Unreachable statement after 'return'.",
+    "shadowed-field": "Local variable '{0}' shadows a field of class '{1}'.",
+    # Analyses cut short by their budget (see code_analyzer.AnalysisBudget), in the phase that was cut short
+    "too-many-diagnostics": "Too many {0} errors: only the first {1} are reported.",
+    "time-limit-exceeded": "Time limit of {0:g} s exceeded: {1} errors from here on are not reported.",
+}
+
+# Codes of the warnings marking the partial results of an analysis cut short by its budget, by reason
+TOO_MANY_DIAGNOSTICS = "too-many-diagnostics"
+TIME_LIMIT_EXCEEDED = "time-limit-exceeded"
+TRUNCATION_CODES = (TOO_MANY_DIAGNOSTICS, TIME_LIMIT_EXCEEDED)
+
+# Text shown for a diagnostic, per phase: lexical and syntax errors also report the column
+LOCATION_FORMATS = {
+    LEXICAL: "{severity} at line {line}, column {column}: {message}",
+    SYNTAX: "{severity} at line {line}, column {column},  {message}",
+    SEMANTIC: "{severity} at line {line}: {message}",
+}
+
+
+class Diagnostic:
+    """
+    A single lexical, syntax or semantic diagnostic.
+    The record only stores the message code and its arguments; the message text is formatted on demand
+    (see `message` and `text`), so collecting, sorting, de-duplicating and serializing diagnostics
+    never builds or parses strings.
+    Lines are 1-based and columns 0-based, as in ANTLR tokens. The line is None when it is unknown,
+    the column and the end position are None when they are not available.
+    """
+
+    __slots__ = ("phase", "code", "line", "column", "end_line", "end_column", "severity", "args")
+
+    def __init__(self, phase, code, line, column=None, end_line=None, end_column=None, severity=ERROR, args=()):
+        self.phase = phase
+        self.code = code
+        self.line = line
+        self.column = column
+        self.end_line = end_line
+        self.end_column = end_column
+        self.severity = severity
+        self.args = args
+
+    @classmethod
+    def at_token(cls, phase, code, token, *args, severity=ERROR):
+        # Diagnostic spanning a single token (None for errors reported without an offending token)
+        if token is None:
+            return cls(phase, code, None, severity=severity, args=args)
+        return cls(phase, code, token.line, token.column, *token_end(token), severity=severity, args=args)
+
+    @classmethod
+    def at_node(cls, phase, code, node, *args, severity=ERROR):
+        # Diagnostic spanning a syntax tree node (see syntax_tree.Node)
+        return cls(phase, code, node.line, node.column, node.end_line, node.end_column, severity=severity, args=args)
+
+    @property
+    def message(self):
+        return MESSAGES[self.code].format(*self.args)
+
+    @property
+    def text(self):
+        # The message with its location, as displayed in the output console
+        return LOCATION_FORMATS[self.phase].format(
+            severity=self.severity.capitalize(),
+            line="unknown" if self.line is None else self.line,
+            column=self.column,
+            message=self.message)
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return (f"Diagnostic({self.phase!r}, {self.code!r}, {self.line!r}, {self.column!r}, "
+                f"{self.end_line!r}, {self.end_column!r}, {self.severity!r}, {self.args!r})")
+
+    def key(self):
+        return (self.phase, self.code, self.line, self.column, self.end_line, self.end_column, self.severity, self.args)
+
+    def __eq__(self, other):
+        if not isinstance(other, Diagnostic):
+            return NotImplemented
+        return self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def shifted(self, line_delta, column_delta, first_line):
+        """
+        Returns a copy of the diagnostic moved by `line_delta` lines. Columns only move by `column_delta`
+        on `first_line`, the first line of the moved text.
+        """
+        line, column, end_line, end_column = self.line, self.column, self.end_line, self.end_column
+        if line == first_line and column is not None:
+            column += column_delta
+        if end_line == first_line and end_column is not None:
+            end_column += column_delta
+        return Diagnostic(self.phase, self.code,
+                          None if line is None else line + line_delta, column,
+                          None if end_line is None else end_line + line_delta, end_column,
+                          self.severity, self.args)
+
+    def to_dict(self):
+        return {
+            "line": self.line,
+            "column": self.column,
+            "end_line": self.end_line,
+            "end_column": self.end_column,
+            "phase": self.phase,
+            "code": self.code,
+            "severity": self.severity,
+            "message": self.message,
+        }
+
+
+def token_end(token):
+    # (line, column) just past the last character of a token; the end of file has no width.
+    text = token.text
+    if token.type == -1 or not text:  # EOF
+        return token.line, token.column
+    newlines = text.count("\n")
+    if newlines:
+        return token.line + newlines, len(text) - text.rfind("\n") - 1
+    return token.line, token.column + len(text)
+
+
+def sort_diagnostics(diagnostics):
+    # Sorts diagnostics by line, in place. The sort is stable, so diagnostics of the same line stay in
+    # phase order (lexical, syntax, semantic) and in the order they were found; unknown lines come first.
+    diagnostics.sort(key=lambda diagnostic: diagnostic.line or 0)
+    return diagnostics
+
+
+def unique_diagnostics(diagnostics):
+    # Drops repeated diagnostics, keeping the first occurrence of each.
+    seen = set()
+    unique = []
+    for diagnostic in diagnostics:
+        key = diagnostic.key()
+        if key not in seen:
+            seen.add(key)
+            unique.append(diagnostic)
+    return unique
+
+
+def is_truncated(diagnostics):
+    # Whether the diagnostics are the partial results of an analysis cut short by its budget
+    return any(diagnostic.code in TRUNCATION_CODES for diagnostic in diagnostics)
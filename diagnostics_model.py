@@ -0,0 +1,64 @@
+from PyQt5.QtCore import QAbstractListModel, QModelIndex, Qt
+from PyQt5.QtGui import QColor
+
+LOCATION_ROLE = Qt.UserRole + 1
+
+
+class DiagnosticsModel(QAbstractListModel):
+    # List model over the Diagnostic records of the last analysis, displayed by a QListView.
+    # The view only asks for the rows that are visible, so the message text of a diagnostic is formatted
+    # when its row is painted, and replacing 50k diagnostics is a single model reset.
+    # When there are no diagnostics, a single disabled row shows the placeholder text instead
+    # (e.g. "No errors found!").
+    def __init__(self, placeholder="", parent=None):
+        super().__init__(parent)
+        self.diagnostics = []
+        self.placeholder = placeholder
+
+    def set_diagnostics(self, diagnostics, placeholder=None):
+        self.beginResetModel()
+        self.diagnostics = list(diagnostics)
+        if placeholder is not None:
+            self.placeholder = placeholder
+        self.endResetModel()
+
+    def set_placeholder(self, placeholder):
+        self.placeholder = placeholder
+        if not self.diagnostics:
+            self.dataChanged.emit(self.index(0), self.index(0))
+
+    def clear(self, placeholder=None):
+        self.set_diagnostics([], placeholder)
+
+    def diagnostic(self, index):
+        # The Diagnostic of a row, or None for the placeholder row.
+        if not index.isValid() or index.row() >= len(self.diagnostics):
+            return None
+        return self.diagnostics[index.row()]
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.diagnostics) or 1
+
+    def flags(self, index):
+        if self.diagnostic(index) is None:
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+    def data(self, index, role=Qt.DisplayRole):
+        diagnostic = self.diagnostic(index)
+        if diagnostic is None:
+            if role == Qt.DisplayRole and index.isValid() and index.row() == 0:
+                return self.placeholder
+            if role == Qt.ForegroundRole:
+                return QColor("#8a8a8a")
+            return None
+        if role == Qt.DisplayRole:
+            return diagnostic.text
+        if role == Qt.ToolTipRole:
+            return f"{diagnostic.phase}: {diagnostic.code}"
+        if role == LOCATION_ROLE:
+            # Every row carries its own location, so identical messages on different lines stay distinct
+            return diagnostic.line, diagnostic.column
+        return None
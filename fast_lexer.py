@@ -0,0 +1,315 @@
+import argparse
+import random
+import re
+import sys
+from array import array
+
+from antlr4.CommonTokenFactory import CommonTokenFactory
+from antlr4.Lexer import TokenSource
+from antlr4.Token import CommonToken, Token
+from diagnostics import LEXICAL, Diagnostic
+from generated.LanguageLexer import LanguageLexer
+from source_files import read_source
+
+IDENTIFIER_PATTERN = re.compile(r"[a-zA-Z_][a-zA-Z0-9_]*\Z")
+
+# Token types of the literal tokens of the grammar ('int', '+=', 'true', ...), which ANTLR defines before
+# the lexer rules: a keyword is never an ID, and 'true'/'false' never produce BOOLEAN_LITERAL tokens.
+LITERAL_TYPES = {name[1:-1]: token_type for token_type, name in enumerate(LanguageLexer.literalNames)
+                 if name.startswith("'")}
+KEYWORDS = {text: token_type for text, token_type in LITERAL_TYPES.items() if IDENTIFIER_PATTERN.match(text)}
+OPERATORS = {text: token_type for text, token_type in LITERAL_TYPES.items() if text not in KEYWORDS}
+
+# Groups of the master pattern, in order of precedence. Python tries the alternatives in order rather than
+# looking for the longest match, so they are arranged to give the same tokens as ANTLR's longest match:
+# '//' starts a comment rather than '/', longer operators come before their prefixes, and a word is matched
+# as a whole before being classified as a keyword or an ID. Every character matches UNKNOWN at worst.
+WS_GROUP, COMMENT_GROUP, STRING_GROUP, NUMBER_GROUP, WORD_GROUP, OPERATOR_GROUP, UNKNOWN_GROUP = range(1, 8)
+MASTER_PATTERN = re.compile("|".join((
+    r"([ \t\n\r]+)",
+    r"(//[^\r\n]*)",
+    r'("[^"\\]*")',
+    r"([0-9]+(?:\.[0-9]+)?[fF]?)",
+    r"([a-zA-Z_][a-zA-Z0-9_]*)",
+    "(" + "|".join(re.escape(text) for text in sorted(OPERATORS, key=len, reverse=True)) + ")",
+    r"(.)",
+)), re.DOTALL)
+
+GROUP_TYPES = {STRING_GROUP: LanguageLexer.STRING_LITERAL, NUMBER_GROUP: LanguageLexer.NUMBER,
+               UNKNOWN_GROUP: LanguageLexer.UNKNOWN}
+
+
+class FastToken(CommonToken):
+    # CommonToken whose fields are all set at once; it behaves like the tokens of the generated lexer.
+    def __init__(self, source, type, start, stop, line, column, text):
+        self.source = source
+        self.type = type
+        self.channel = Token.DEFAULT_CHANNEL
+        self.start = start
+        self.stop = stop
+        self.tokenIndex = -1
+        self.line = line
+        self.column = column
+        self._text = text
+
+
+def scan(source, line=1, column=0):
+    """
+    Generates the (type, start, stop, line, column) fields of the tokens that LanguageLexer would produce
+    from the source, followed by those of the EOF token (whitespace and comments are skipped).
+    `line` and `column` are the position of the source in its document, as for the generated lexer.
+    """
+    keywords = KEYWORDS
+    operators = OPERATORS
+    group_types = GROUP_TYPES
+    identifier = LanguageLexer.ID
+    line_start = -column  # Index of the first character of the current line
+    for match in MASTER_PATTERN.finditer(source):
+        group = match.lastindex
+        start, end = match.span()
+        if group == WS_GROUP:
+            newlines = source.count("\n", start, end)
+            if newlines:
+                line += newlines
+                line_start = source.rfind("\n", start, end) + 1
+            continue
+        if group == COMMENT_GROUP:
+            continue
+        if group == WORD_GROUP:
+            yield keywords.get(match.group(), identifier), start, end - 1, line, start - line_start
+        elif group == OPERATOR_GROUP:
+            yield operators[match.group()], start, end - 1, line, start - line_start
+        else:
+            yield group_types[group], start, end - 1, line, start - line_start
+            if group == STRING_GROUP:
+                newlines = source.count("\n", start, end)
+                if newlines:
+                    line += newlines
+                    line_start = source.rfind("\n", start, end) + 1
+    yield Token.EOF, len(source), len(source) - 1, line, len(source) - line_start
+
+
+def tokenize(source, line=1, column=0, errors=None, token_source=None):
+    """
+    Splits the source into the tokens that LanguageLexer would produce, followed by an EOF token:
+    same types, texts, start/stop indexes, lines and columns (see scan).
+    When an `errors` list is given, an "unrecognized-symbol" Diagnostic is added to it for every UNKNOWN token,
+    so the tokens do not have to be scanned a second time.
+    """
+    pair = (token_source, None)
+    tokens = []
+    append = tokens.append
+    unknown = LanguageLexer.UNKNOWN
+    for token_type, start, stop, token_line, token_column in scan(source, line, column):
+        token = FastToken(pair, token_type, start, stop, token_line, token_column, source[start:stop + 1])
+        append(token)
+        if token_type == unknown and errors is not None:
+            errors.append(Diagnostic.at_token(LEXICAL, "unrecognized-symbol", token, token.text))
+    tokens[-1]._text = "<EOF>"
+    return tokens
+
+
+# Line states of tokenize_line: a string literal is the only token of the grammar that can span lines
+NORMAL, IN_STRING = 0, 1
+COMMENT = -2  # Pseudo token type of comments, which the lexer skips but an editor shows
+STRING_REST = re.compile(r'[^"\\]*')  # The characters a string literal may contain
+
+
+class LineTokens:
+    # Tokens of one line of a document, as (type, start column, stop column) triples in a flat array,
+    # comments included. A line starting inside a string literal begins with the rest of that string, and a
+    # line ending inside one ends with its beginning (to the end of the line). `exact` is False when the
+    # tokens differ from those of the lexer: a string spanning lines that turns out to contain a backslash
+    # is not a string literal at all, but that is only known on a later line.
+    __slots__ = ("text_hash", "start_state", "end_state", "exact", "tokens")
+
+    def __init__(self, text_hash, start_state, end_state, exact, tokens):
+        self.text_hash = text_hash
+        self.start_state = start_state
+        self.end_state = end_state
+        self.exact = exact
+        self.tokens = tokens
+
+
+def tokenize_line(text, start_state=NORMAL):
+    """
+    Tokenizes a single line (without its newline) that starts in the given state, e.g. for an editor
+    re-highlighting the lines touched by an edit. Returns a LineTokens.
+    """
+    tokens = array("i")
+    exact = True
+    position = 0
+    if start_state == IN_STRING:
+        end = STRING_REST.match(text).end()
+        if end == len(text):
+            # Neither a quote nor a backslash: the whole line is inside the string
+            tokens.extend((LanguageLexer.STRING_LITERAL, 0, end - 1))
+            return LineTokens(hash(text), start_state, IN_STRING, True, tokens)
+        if text[end] == '"':
+            tokens.extend((LanguageLexer.STRING_LITERAL, 0, end))
+            position = end + 1
+        else:
+            tokens.extend((LanguageLexer.STRING_LITERAL, 0, end - 1))
+            exact = False
+            position = end
+    keywords = KEYWORDS
+    operators = OPERATORS
+    for match in MASTER_PATTERN.finditer(text, position):
+        group = match.lastindex
+        if group == WS_GROUP:
+            continue
+        start, end = match.span()
+        if group == WORD_GROUP:
+            token_type = keywords.get(match.group(), LanguageLexer.ID)
+        elif group == OPERATOR_GROUP:
+            token_type = operators[match.group()]
+        elif group == COMMENT_GROUP:
+            token_type = COMMENT
+        else:
+            token_type = GROUP_TYPES[group]
+            if (token_type == LanguageLexer.UNKNOWN and text[start] == '"'
+                    and STRING_REST.match(text, end).end() == len(text)):
+                # A quote that is not closed on this line starts a string literal continuing on the next one
+                tokens.extend((LanguageLexer.STRING_LITERAL, start, len(text) - 1))
+                return LineTokens(hash(text), start_state, IN_STRING, exact, tokens)
+        tokens.extend((token_type, start, end - 1))
+    return LineTokens(hash(text), start_state, NORMAL, exact, tokens)
+
+
+class FastTokenSource(TokenSource):
+    """
+    Token source feeding LanguageParser (through a CommonTokenStream) with the tokens of tokenize(),
+    in place of the generated lexer. The whole source is tokenized when the token source is created.
+    """
+
+    def __init__(self, source, line=1, column=0, errors=None, source_name="<string>"):
+        super().__init__()
+        self._factory = CommonTokenFactory.DEFAULT
+        self.sourceName = source_name
+        self.tokens = tokenize(source, line, column, errors, self)
+        self.pos = 0
+
+    def nextToken(self):
+        token = self.tokens[self.pos]
+        if self.pos < len(self.tokens) - 1:
+            self.pos += 1
+        return token
+
+    @property
+    def line(self):
+        return self.tokens[self.pos].line
+
+    @property
+    def column(self):
+        return self.tokens[self.pos].column
+
+    def getInputStream(self):
+        return None
+
+    def getSourceName(self):
+        return self.sourceName
+
+
+def antlr_tokens(source, line=1, column=0):
+    # The tokens of the generated lexer, including EOF
+    from antlr4 import InputStream
+    lexer = LanguageLexer(InputStream(source))
+    lexer.line = line
+    lexer.column = column
+    lexer.removeErrorListeners()
+    tokens = lexer.getAllTokens()
+    tokens.append(lexer.emitEOF())
+    return tokens
+
+
+def token_fields(token):
+    return token.type, token.text, token.start, token.stop, token.line, token.column, token.channel
+
+
+def compare_tokens(source, line=1, column=0):
+    """
+    Tokenizes the source with both lexers. Returns None if they agree, otherwise a description
+    of the first difference.
+    """
+    expected = antlr_tokens(source, line, column)
+    actual = tokenize(source, line, column)
+    for index, (wanted, got) in enumerate(zip(expected, actual)):
+        if token_fields(wanted) != token_fields(got):
+            return f"token {index}: expected {token_fields(wanted)}, got {token_fields(got)}"
+    if len(expected) != len(actual):
+        return f"expected {len(expected)} tokens, got {len(actual)}"
+    return None
+
+
+# Inputs exercising the corners of the lexical rules
+EDGE_CASES = (
+    "", " ", "\n\n", "x", "int", "int2", "_", "__a1", "true", "false", "trueish", "String Strings",
+    "1", "12.5", "1.", "1.f", "1.5f", "2F", "1.5.3", "12abc", "007", ".5",
+    '"text"', '""', '"multi\nline"', '"unterminated', '"back\\slash"', '"a" "b"',
+    "// comment", "a // comment\nb", "//", "a/b", "a/=b", "a//=b", "/ /",
+    "a++", "a+++b", "a+=b", "a--b", "a-=-b", "a*=b", "a<=b", "a<b", "a>=b", "a==b", "a=b", "a!=b", "!a",
+    "a&&b", "a&b", "a||b", "a|b", "args[]", "a[0]", "[]", "[ ]",
+    "@", "#$`~^?:'", "\\", "été", "x\U0001F600y", "\r\n\r\n", "a\rb", "\t\tint x;",
+    "public static void main(String[] args) { System.out.println(\"hi\"); }",
+)
+
+
+def random_source(rng, length):
+    # Random mix of grammar fragments and arbitrary characters
+    fragments = list(LITERAL_TYPES) + ["x", "_y1", "12", "3.5", "4.0f", '"s"', '"', "//c\n", " ", "\n", "\t",
+                                       "\r", "@", "&", "|", "[", "]", "\\", "é", "\U0001F600", "."]
+    return "".join(rng.choice(fragments) if rng.random() < 0.8 else chr(rng.randint(1, 0x2FF))
+                   for _ in range(length))
+
+
+def run_equivalence_checks(fuzz=500, seed=0, files=(), generated_lines=2000):
+    """
+    Compares tokenize() with the generated lexer on the edge cases, on generated programs (valid and broken),
+    on `fuzz` random inputs, at shifted document positions, and on the given files.
+    Returns the list of failures as (input name, difference).
+    """
+    from program_generator import generate_program
+
+    inputs = [(f"edge case {source!r}", source) for source in EDGE_CASES]
+    inputs += [(f"generated program ({'broken' if broken else 'valid'})", generate_program(generated_lines, seed, broken))
+               for broken in (False, True)]
+    rng = random.Random(seed)
+    inputs += [(f"random input #{index}", random_source(rng, rng.randint(1, 80))) for index in range(fuzz)]
+    for path in files:
+        inputs.append((path, read_source(path)))
+
+    failures = []
+    for name, source in inputs:
+        for line, column in ((1, 0), (7, 3)):
+            difference = compare_tokens(source, line, column)
+            if difference is not None:
+                failures.append((f"{name} at {line}:{column}", difference))
+                break
+        else:
+            errors = []
+            tokenize(source, errors=errors)
+            expected = sum(1 for token in antlr_tokens(source) if token.type == LanguageLexer.UNKNOWN)
+            if len(errors) != expected:
+                failures.append((name, f"{len(errors)} unrecognized symbols reported, expected {expected}"))
+    return failures, len(inputs)
+
+
+def main(argv=None):
+    # Command-line entry point of the equivalence checks against the generated lexer.
+    # Exits with status 1 when the two lexers disagree on any input.
+    arg_parser = argparse.ArgumentParser(
+        description="Check that the fast tokenizer produces the same tokens as the generated ANTLR lexer.")
+    arg_parser.add_argument("files", nargs="*", help="additional source files to compare")
+    arg_parser.add_argument("--fuzz", type=int, default=500, help="number of random inputs (default: 500)")
+    arg_parser.add_argument("-s", "--seed", type=int, default=0, help="seed of the random inputs (default: 0)")
+    args = arg_parser.parse_args(argv)
+
+    failures, count = run_equivalence_checks(args.fuzz, args.seed, args.files)
+    for name, difference in failures:
+        print(f"MISMATCH {name}: {difference}")
+    print(f"{count - len(failures)} of {count} inputs tokenized identically.")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,357 @@
+import hashlib
+from bisect import bisect_left
+
+from antlr4 import InputStream, CommonTokenStream
+from antlr4.ListTokenSource import ListTokenSource
+from antlr4.Token import CommonToken, Token
+from antlr4.tree.Tree import ErrorNode, TerminalNode
+from generated.LanguageLexer import LanguageLexer
+from generated.LanguageParser import LanguageParser
+from code_analyzer import (AnalysisCancelled, CancellationListener, LexerErrorListener, ParserErrorListener, analyze_code,
+                           check_cancelled, parse_start)
+from diagnostics import LEXICAL, SYNTAX, TIME_LIMIT_EXCEEDED, Diagnostic, sort_diagnostics
+from fast_lexer import FastToken
+from profiling import profile_phase
+from segmentation import CLASS_END, CLASS_HEADER, MEMBER, UnbalancedSource, split_segments
+from semantic_analyzer import SemanticAnalyzer
+from syntax_tree import shift
+from token_store import TokenStore
+from tree_builder import TreeBuilder
+
+
+def synthetic_token(token_type, text, line, column):
+    # Creates a token that is not part of the source, used to wrap class members into a parsable class.
+    token = CommonToken(type=token_type)
+    token.text = text
+    token.line = line
+    token.column = column
+    return token
+
+
+def stored_tokens(token_store, segment):
+    # The tokens of a segment taken from the TokenStore of the whole document, followed by an EOF token,
+    # as the lexer would produce them from the segment text alone (start and stop relative to the segment).
+    # Segments never split a token, since their boundaries are outside string literals and comments.
+    first = bisect_left(token_store.starts, segment.start)
+    last = bisect_left(token_store.starts, segment.end, first)
+    pair = (None, None)
+    base = segment.start
+    types, starts, stops = token_store.types, token_store.starts, token_store.stops
+    lines, columns = token_store.lines, token_store.columns
+    tokens = [FastToken(pair, types[index], starts[index] - base, stops[index] - base, lines[index], columns[index],
+                        token_store.text(index)) for index in range(first, last)]
+    eof = FastToken(pair, Token.EOF, segment.end - base, segment.end - base - 1, segment.end_line,
+                    segment.end_column, "<EOF>")
+    return tokens, eof
+
+
+def token_node(tree, token):
+    # The terminal node of a token in a parse tree, or None. The tree is searched from its end, without recursion.
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, TerminalNode):
+            if node.symbol is token:
+                return node
+        elif node.children:
+            stack.extend(node.children)
+    return None
+
+
+class DocumentTokens:
+    # The TokenStore of a document assembled from the tokens of its lines (see TokenStore.from_lines),
+    # the first time some part of the document has to be lexed. get() returns None without line tokens,
+    # or when they do not match the document.
+    def __init__(self, source, line_tokens, profile=None):
+        self.source = source
+        self.line_tokens = line_tokens
+        self.profile = profile
+        self.store = None
+
+    def get(self):
+        if self.line_tokens is not None:
+            with profile_phase(self.profile, "reuse line tokens"):
+                self.store = TokenStore.from_lines(self.source, self.line_tokens)
+            self.line_tokens = None
+        return self.store
+
+
+CLASS_TOKEN = LanguageParser.literalNames.index("'class'")
+LBRACE_TOKEN = LanguageParser.literalNames.index("'{'")
+RBRACE_TOKEN = LanguageParser.literalNames.index("'}'")
+# The tokens that can start a top-level statement and a class member: at any other token, the parser of the whole
+# document leaves the statements of the start rule (without an error, it ends there) or the class body
+STATEMENT_START = LanguageParser.atn.nextTokens(LanguageParser.atn.ruleToStartState[LanguageParser.RULE_statement])
+MEMBER_START = LanguageParser.atn.nextTokens(LanguageParser.atn.ruleToStartState[LanguageParser.RULE_class_body])
+
+
+class SegmentResult:
+    """
+    Cached analysis of a single segment: its syntax tree (see syntax_tree.py) and its lexical and syntax errors.
+    Positions are absolute for the place where the segment was last used (line, column);
+    rebase() moves them when the segment is reused at a different place of the document.
+    `complete` tells whether the parse of the segment ended exactly at its end (see IncrementalAnalyzer.complete);
+    otherwise the document splits differently than the parser reads it.
+    """
+
+    def __init__(self, line, column, tree, lexer_errors, parser_errors, complete=True):
+        self.line = line
+        self.column = column
+        self.tree = tree
+        self.lexer_errors = lexer_errors
+        self.parser_errors = parser_errors
+        self.complete = complete
+
+    def rebase(self, line, column):
+        """
+        Shifts the syntax tree and errors of the segment so that it starts at (line, column).
+        Only positions on the first line of the segment depend on its starting column.
+        """
+        line_delta = line - self.line
+        column_delta = column - self.column
+        if not line_delta and not column_delta:
+            return
+        first_line = self.line
+        if self.tree is not None:
+            shift(self.tree, line_delta, column_delta, first_line)
+        # The records are copied rather than moved in place, since earlier results may still refer to them
+        self.lexer_errors = [error.shifted(line_delta, column_delta, first_line) for error in self.lexer_errors]
+        self.parser_errors = [error.shifted(line_delta, column_delta, first_line) for error in self.parser_errors]
+        self.line = line
+        self.column = column
+
+
+class IncrementalAnalyzer:
+    """
+    Analyzes a document that changes over time, re-lexing and re-parsing only the parts that changed.
+    The document is split into top-level statements and class members (see segmentation.py);
+    the syntax tree and lexical/syntax errors of every segment are cached by the hash of its text,
+    so after an edit only the touched segments are lexed and parsed again, while the cached ones are moved
+    to their new position. The semantic analysis still visits all the (cached) trees, since its result
+    depends on the declarations of the whole document.
+    Documents whose braces do not match cannot be split and are analyzed in full, and so are documents where
+    a syntax error makes the parser read the braces differently than the split (e.g. a stray '}' balanced by
+    an extra '{' further on), which shows as a segment whose parse does not end exactly at its end.
+    `disabled_rules` lists the codes of the optional semantic checks of rule_engine.py to skip.
+    """
+
+    def __init__(self, disabled_rules=()):
+        self.cache = {}  # (kind, digest) -> list of SegmentResult
+        self.builder = TreeBuilder()
+        self.disabled_rules = disabled_rules
+
+    def analyze(self, input_code, is_cancelled=None, profile=None, line_tokens=None, budget=None):
+        """
+        Returns the same Diagnostic records as code_analyzer.analyze_code: the segments are parsed in the same
+        context as in the whole document, and a document whose segments do not all parse to their end
+        (see complete) is analyzed in full.
+        `profile` is an optional profiling.Profile, which also counts the reused and re-analyzed segments.
+        `line_tokens` are the optional fast_lexer.LineTokens of every line of `input_code` (e.g. those of the
+        editor's syntax highlighter); when they match the code, the parts that have to be analyzed again take
+        their tokens from them instead of being lexed.
+        `budget` is an optional code_analyzer.AnalysisBudget, as for analyze_code. Once its time is up, no further
+        segment is parsed; a segment whose parse it cut short is not cached, the segments left unparsed keep
+        their cached results for the next analysis.
+        """
+        document_tokens = DocumentTokens(input_code, line_tokens, profile)
+        try:
+            with profile_phase(profile, "segmentation"):
+                segments = split_segments(input_code)
+        except UnbalancedSource:
+            self.cache = {}
+            return analyze_code(input_code, is_cancelled, profile=profile, token_store=document_tokens.get(),
+                                disabled_rules=self.disabled_rules, budget=budget)
+
+        if budget is not None:
+            budget.start()
+        previous_cache = self.cache
+        cache = {}
+        results = []
+        split_mismatch = False
+        try:
+            for segment in segments:
+                check_cancelled(is_cancelled)
+                if budget is not None and budget.expired():
+                    budget.cut(SYNTAX, TIME_LIMIT_EXCEEDED, segment.line, segment.column)
+                    break
+                text = input_code[segment.start:segment.end]
+                key = (segment.kind, hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest())
+                candidates = previous_cache.get(key)
+                if candidates:
+                    result = candidates.pop()
+                    result.rebase(segment.line, segment.column)
+                    if profile is not None:
+                        profile.count("segments reused")
+                else:
+                    result = self.analyze_segment(segment, text, is_cancelled, profile, document_tokens.get(), budget)
+                    if profile is not None:
+                        profile.count("segments analyzed")
+                    if budget is not None and SYNTAX in budget.truncated:
+                        results.append((segment, result))
+                        break
+                cache.setdefault(key, []).append(result)
+                results.append((segment, result))
+                if not result.complete:
+                    split_mismatch = True
+                    break
+        except AnalysisCancelled:
+            # Keep both the old and the new segments, the next request will most likely need them
+            for key, entries in cache.items():
+                previous_cache.setdefault(key, []).extend(entries)
+            raise
+        if len(results) < len(segments):
+            # Cut short by the budget: the segments left unparsed keep their results
+            for key, entries in previous_cache.items():
+                cache.setdefault(key, []).extend(entries)
+        self.cache = cache
+
+        if split_mismatch or all(result.tree is None for _, result in results):
+            # The split does not match the parse (the parser would read on across the end of a segment, or stop
+            # before it), or nothing but whitespace and comments: let the full parser analyze the document
+            return analyze_code(input_code, is_cancelled, profile=profile, token_store=document_tokens.get(),
+                                disabled_rules=self.disabled_rules, budget=budget)
+
+        check_cancelled(is_cancelled)
+        lexer_errors = [error for _, result in results for error in result.lexer_errors]
+        parser_errors = [error for _, result in results for error in result.parser_errors]
+        if budget is not None:
+            budget.limit(LEXICAL, lexer_errors)
+            budget.limit(SYNTAX, parser_errors)
+        semantic_errors = self.analyze_semantics(results, profile, budget)
+        errors = lexer_errors + parser_errors + semantic_errors
+        if budget is not None:
+            errors += budget.markers()
+        return sort_diagnostics(errors)
+
+    def analyze_segment(self, segment, text, is_cancelled, profile=None, token_store=None, budget=None):
+        """
+        Lexes and parses a single segment. Top-level statements are parsed with the start rule;
+        class headers and class members are completed with synthetic tokens into a class declaration,
+        so they are parsed in the same context as in the whole document.
+        With the TokenStore of the document, the tokens of the segment are taken from it rather than lexed.
+        With an AnalysisBudget, the parse stops once its time is up (its cap on the number of diagnostics
+        applies to the whole document, see analyze).
+        The result records whether the parse ended exactly at the end of the segment (see complete).
+        """
+        lexer_errors = []
+        if token_store is not None:
+            with profile_phase(profile, "lex (stored tokens)"):
+                tokens, eof = stored_tokens(token_store, segment)
+        else:
+            lexer = LanguageLexer(InputStream(text))
+            lexer.line = segment.line
+            lexer.column = segment.column
+            lexer.removeErrorListeners()
+            lexer.addErrorListener(LexerErrorListener(lexer_errors))
+            with profile_phase(profile, "lex"):
+                tokens = lexer.getAllTokens()
+                eof = lexer.emitEOF()
+
+        with profile_phase(profile, "unknown token scan"):
+            for token in tokens:
+                if token.type == LanguageLexer.UNKNOWN:
+                    lexer_errors.append(Diagnostic.at_token(LEXICAL, "unrecognized-symbol", token, token.text))
+
+        if segment.kind == CLASS_END or (segment.kind != MEMBER and segment.kind != CLASS_HEADER and not tokens):
+            return SegmentResult(segment.line, segment.column, None, lexer_errors, [])
+
+        closing = synthetic_token(RBRACE_TOKEN, "}", segment.end_line, segment.end_column)
+        if segment.kind == MEMBER:
+            parse_tokens = [synthetic_token(CLASS_TOKEN, "class", segment.line, segment.column),
+                            synthetic_token(LanguageLexer.ID, "_", segment.line, segment.column),
+                            synthetic_token(LBRACE_TOKEN, "{", segment.line, segment.column)]
+            parse_tokens += tokens
+            parse_tokens += [closing, eof]
+        elif segment.kind == CLASS_HEADER:
+            parse_tokens = tokens + [closing, eof]
+        else:
+            parse_tokens = tokens + [eof]
+
+        parser = LanguageParser(CommonTokenStream(ListTokenSource(parse_tokens)))
+        parser_errors = []
+        if is_cancelled is not None:
+            parser.addParseListener(CancellationListener(is_cancelled))
+        tree = parse_start(parser, ParserErrorListener(parser_errors), profile=profile, budget=budget)
+        with profile_phase(profile, "build syntax tree"):
+            if segment.kind == MEMBER or segment.kind == CLASS_HEADER:
+                class_declaration = self.find_class_declaration(tree)
+                syntax_tree = self.builder.class_declaration(class_declaration) if class_declaration else None
+            else:
+                syntax_tree = self.builder.build(tree)
+        complete = self.complete(segment, tokens, parser, tree, closing, parser_errors)
+        return SegmentResult(segment.line, segment.column, syntax_tree, lexer_errors, parser_errors, complete)
+
+    @staticmethod
+    def complete(segment, tokens, parser, tree, closing, parser_errors):
+        """
+        Whether the parse of a segment ended exactly at its end, so that the parser of the whole document reads
+        the segment the same way: its first token starts a statement (or a member), all its tokens are consumed,
+        its last token is not skipped to recover from an error and no syntax error is on its last token or after it
+        (where the parser of the document would see the tokens of the next segment instead) and, for class headers
+        and members, the closing '}' added after them closes the wrapping class rather than some block left open
+        by an error.
+        """
+        if tokens and tokens[0].type not in (MEMBER_START if segment.kind == MEMBER else STATEMENT_START):
+            return False
+        if parser.getCurrentToken().type != Token.EOF:
+            return False  # The start rule stopped at a token that cannot start a statement, e.g. a stray '}'
+        if tokens and parser_errors:
+            last = tokens[-1]
+            if any((error.line, error.column) >= (last.line, last.column) for error in parser_errors):
+                return False
+            if isinstance(token_node(tree, last), (ErrorNode, type(None))):
+                return False
+        if segment.kind != MEMBER and segment.kind != CLASS_HEADER:
+            return True
+        statements = tree.statement()
+        if len(statements) != 1 or statements[0].class_declaration() is None:
+            return False
+        class_declaration = statements[0].class_declaration()
+        last = class_declaration.getChild(class_declaration.getChildCount() - 1)
+        return getattr(last, "symbol", None) is closing
+
+    @staticmethod
+    def find_class_declaration(tree):
+        # Returns the class declaration wrapping a class header or member, or None if it could not be parsed.
+        for statement in tree.getTypedRuleContexts(LanguageParser.StatementContext):
+            if statement.class_declaration() is not None:
+                return statement.class_declaration()
+        return None
+
+    def analyze_semantics(self, results, profile=None, budget=None):
+        """
+        Runs the semantic analyzer over the cached syntax trees in document order (see segment_trees),
+        within the optional AnalysisBudget.
+        """
+        semantic_analyzer = SemanticAnalyzer(self.disabled_rules)
+        if profile is not None:
+            profile.instrument_visitor(semantic_analyzer)
+        with profile_phase(profile, "semantic"):
+            trees = self.segment_trees(results)
+            if budget is None:
+                for tree in trees:
+                    semantic_analyzer.visit(tree)
+            else:
+                budget.visit(semantic_analyzer, trees)
+        return semantic_analyzer.errors
+
+    @staticmethod
+    def segment_trees(results):
+        # The trees of the segments in document order. The members of a top-level class are grafted into
+        # (a copy of) the class declaration of its header, so the analyzer sees the same class declaration
+        # as for the whole document.
+        class_tree = None
+        members = []
+        for segment, result in results:
+            if segment.kind == CLASS_HEADER:
+                class_tree = result.tree
+                members = []
+            elif segment.kind == MEMBER:
+                if result.tree is not None:
+                    members.extend(result.tree.members)
+            elif segment.kind == CLASS_END:
+                if class_tree is not None:
+                    yield class_tree.with_members(members)
+                class_tree = None
+            elif result.tree is not None:
+                yield result.tree
@@ -0,0 +1,190 @@
+import argparse
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+
+from code_analyzer import analyze_code
+from lsp_server import REQUEST_CANCELLED, read_message, to_lsp_diagnostic, write_message
+from program_generator import generate_program
+
+URI = "file:///scripted/Program.java"
+
+
+class LspClient:
+    # Minimal JSON-RPC client driving a language server subprocess over stdio.
+    # Incoming messages are read on a background thread and queued for wait_for().
+    def __init__(self, command):
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.messages = queue.Queue()
+        self.next_id = 0
+        threading.Thread(target=self.read_messages, daemon=True).start()
+
+    def read_messages(self):
+        while True:
+            message = read_message(self.process.stdout)
+            if message is None:
+                return
+            self.messages.put(message)
+
+    def send(self, message):
+        message["jsonrpc"] = "2.0"
+        write_message(self.process.stdin, message)
+
+    def request(self, method, params):
+        self.next_id += 1
+        self.send({"id": self.next_id, "method": method, "params": params})
+        return self.next_id
+
+    def notify(self, method, params):
+        self.send({"method": method, "params": params})
+
+    def wait_for(self, predicate, timeout=60):
+        # Returns the first message matching `predicate`, and the messages received before it
+        deadline = time.monotonic() + timeout
+        skipped = []
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("no matching message from the server")
+            message = self.messages.get(timeout=remaining)
+            if predicate(message):
+                return message, skipped
+            skipped.append(message)
+
+    def response(self, request_id, timeout=60):
+        return self.wait_for(lambda message: message.get("id") == request_id and "method" not in message, timeout)[0]
+
+    def published(self, version, timeout=60):
+        # Waits for the diagnostics of the given document version; returns them and the earlier publications
+        def matches(message):
+            return (message.get("method") == "textDocument/publishDiagnostics"
+                    and message["params"].get("version") == version)
+
+        message, skipped = self.wait_for(matches, timeout)
+        earlier = [m for m in skipped if m.get("method") == "textDocument/publishDiagnostics"]
+        return message["params"]["diagnostics"], earlier
+
+
+def expected_diagnostics(text):
+    lines = text.split("\n")
+    return [to_lsp_diagnostic(error, lines) for error in analyze_code(text)]
+
+
+def position(text, offset):
+    # LSP position of an offset in an ASCII text
+    line = text.count("\n", 0, offset)
+    return {"line": line, "character": offset - (text.rfind("\n", 0, offset) + 1)}
+
+
+def run_session(client, text, typed, debounce):
+    """
+    Scripted session: opens a document, types `typed` one character per didChange at the start of the
+    document's middle line, deletes it again with a single range change, pulls diagnostics and cancels
+    a pull request. Every published or pulled result is compared with analyze_code on the expected text.
+    Returns the list of failures.
+    """
+    failures = []
+
+    def check(step, actual, text):
+        expected = expected_diagnostics(text)
+        if actual != expected:
+            failures.append(f"{step}: {len(actual)} diagnostics, expected {len(expected)}")
+        print(f"{step}: {len(actual)} diagnostics {'OK' if actual == expected else 'MISMATCH'}")
+
+    response = client.response(client.request("initialize", {"processId": os.getpid(), "capabilities": {}}))
+    sync = response["result"]["capabilities"]["textDocumentSync"]
+    print(f"initialize: textDocumentSync {sync}")
+    client.notify("initialized", {})
+
+    start = time.perf_counter()
+    client.notify("textDocument/didOpen", {"textDocument": {"uri": URI, "languageId": "java", "version": 1,
+                                                            "text": text}})
+    diagnostics, _ = client.published(1)
+    check(f"open ({text.count(chr(10))} lines, {time.perf_counter() - start:.2f}s)", diagnostics, text)
+
+    # Typing: one incremental change per keystroke, faster than the debounce delay
+    insert_at = text.index("\n", len(text) // 2) + 1
+    version = 1
+    for index, char in enumerate(typed):
+        version += 1
+        at = position(text, insert_at + index)
+        client.notify("textDocument/didChange", {
+            "textDocument": {"uri": URI, "version": version},
+            "contentChanges": [{"range": {"start": at, "end": at}, "text": char}],
+        })
+        time.sleep(debounce / 4)
+    typed_text = text[:insert_at] + typed + text[insert_at:]
+    start = time.perf_counter()
+    diagnostics, earlier = client.published(version)
+    check(f"typed {len(typed)} characters ({len(earlier)} intermediate publications, "
+          f"{time.perf_counter() - start:.2f}s after the last keystroke)", diagnostics, typed_text)
+
+    # Deleting the typed line with a single range change
+    version += 1
+    client.notify("textDocument/didChange", {
+        "textDocument": {"uri": URI, "version": version},
+        "contentChanges": [{"range": {"start": position(typed_text, insert_at),
+                                      "end": position(typed_text, insert_at + len(typed))}, "text": ""}],
+    })
+    start = time.perf_counter()
+    diagnostics, _ = client.published(version)
+    check(f"deleted the line ({time.perf_counter() - start:.2f}s)", diagnostics, text)
+
+    # Pull diagnostics: the document did not change, so the last result is reused
+    response = client.response(client.request("textDocument/diagnostic", {"textDocument": {"uri": URI}}))
+    check("pull", response["result"]["items"], text)
+
+    # Cancelling a pull request right after an edit
+    version += 1
+    client.notify("textDocument/didChange", {"textDocument": {"uri": URI, "version": version},
+                                             "contentChanges": [{"text": typed_text}]})
+    request_id = client.request("textDocument/diagnostic", {"textDocument": {"uri": URI}})
+    client.notify("$/cancelRequest", {"id": request_id})
+    response = client.response(request_id)
+    if response.get("error", {}).get("code") == REQUEST_CANCELLED:
+        print("cancelled pull: RequestCancelled")
+    else:
+        check("cancelled pull (answered before the cancellation arrived)", response["result"]["items"], typed_text)
+
+    client.notify("textDocument/didClose", {"textDocument": {"uri": URI}})
+    client.published(None)
+    client.response(client.request("shutdown", None))
+    client.notify("exit", None)
+    exit_code = client.process.wait(timeout=30)
+    print(f"exit code: {exit_code}")
+    if exit_code != 0:
+        failures.append(f"server exited with {exit_code}")
+    return failures
+
+
+def main(argv=None):
+    # Runs a scripted session against lsp_server.py and exits with status 1 if any result was wrong.
+    arg_parser = argparse.ArgumentParser(description="Scripted JSON-RPC client checking the BugBuster language server.")
+    arg_parser.add_argument("path", nargs="?", help="ASCII source to open (default: a generated program)")
+    arg_parser.add_argument("-n", "--lines", type=int, default=2000, help="size of the generated program (default: 2000)")
+    arg_parser.add_argument("--debounce", type=int, default=100, metavar="MS",
+                            help="debounce delay of the server (default: %(default)s)")
+    args = arg_parser.parse_args(argv)
+
+    if args.path:
+        with open(args.path, encoding="utf-8") as source_file:
+            text = source_file.read()
+    else:
+        text = generate_program(args.lines, broken=True)
+    server = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lsp_server.py")
+    client = LspClient([sys.executable, server, "--debounce", str(args.debounce), "--no-dfa-cache"])
+    try:
+        failures = run_session(client, text, "undeclaredValue = \"text\";\n", args.debounce / 1000)
+    finally:
+        if client.process.poll() is None:
+            client.process.kill()
+    for failure in failures:
+        print(f"FAILED {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
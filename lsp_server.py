@@ -0,0 +1,422 @@
+import argparse
+import json
+import queue
+import sys
+import threading
+
+from code_analyzer import AnalysisBudget, AnalysisCancelled
+from dfa_cache import load_dfa_cache, save_dfa_cache
+from diagnostics import WARNING, is_truncated
+from incremental_analyzer import IncrementalAnalyzer
+
+DEFAULT_DEBOUNCE_MS = 300
+# Budget of every analysis (see code_analyzer.AnalysisBudget), as in the editor
+DEFAULT_MAX_DIAGNOSTICS = 1000
+DEFAULT_TIME_LIMIT = 10.0
+
+# JSON-RPC and LSP error codes
+PARSE_ERROR = -32700
+METHOD_NOT_FOUND = -32601
+INTERNAL_ERROR = -32603
+SERVER_NOT_INITIALIZED = -32002
+REQUEST_CANCELLED = -32800
+
+# LSP constants
+SYNC_INCREMENTAL = 2
+SEVERITY_ERROR = 1
+SEVERITY_WARNING = 2
+
+
+class ProtocolError(Exception):
+    # Raised when the input stream does not follow the base protocol (headers + JSON content).
+    pass
+
+
+def read_message(stream):
+    """
+    Reads one message of the LSP base protocol from a binary stream: "Content-Length: N" and other headers,
+    an empty line and N bytes of JSON. Returns None at the end of the stream.
+    """
+    length = None
+    while True:
+        line = stream.readline()
+        if not line:
+            return None
+        line = line.strip()
+        if not line:
+            if length is None:
+                raise ProtocolError("missing Content-Length header")
+            break
+        name, _, value = line.decode("ascii", "replace").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value.strip())
+    content = stream.read(length)
+    if len(content) < length:
+        return None
+    return json.loads(content.decode("utf-8"))
+
+
+def write_message(stream, message):
+    content = json.dumps(message, separators=(",", ":")).encode("utf-8")
+    stream.write(b"Content-Length: %d\r\n\r\n" % len(content))
+    stream.write(content)
+    stream.flush()
+
+
+def utf16_length(text):
+    return len(text.encode("utf-16-le")) // 2
+
+
+def utf16_to_index(line_text, character):
+    # LSP positions count UTF-16 code units; Python strings count code points
+    if line_text.isascii():
+        return min(character, len(line_text))
+    units = 0
+    for index, char in enumerate(line_text):
+        if units >= character:
+            return index
+        units += 2 if ord(char) > 0xFFFF else 1
+    return len(line_text)
+
+
+def index_to_utf16(line_text, index):
+    if line_text.isascii():
+        return index
+    return utf16_length(line_text[:index])
+
+
+class Document:
+    """
+    An open text document: its text, the version reported by the client and the analyzer that keeps
+    the tokens, parse trees and errors of its segments between edits (see incremental_analyzer.py).
+    `generation` counts the edits, so that analyses of an outdated text can be recognized and cancelled.
+    The text is edited by the message loop while the analysis thread reads it, so both use `lock`.
+    """
+
+    def __init__(self, uri, text, version):
+        self.uri = uri
+        self.text = text
+        self.version = version
+        self.generation = 0
+        self.analyzer = IncrementalAnalyzer()
+        self.diagnostics = None  # (generation, Diagnostic records) of the last completed analysis
+        self.timer = None
+        self.lock = threading.Lock()
+        self.line_starts = None
+
+    def offset_at(self, position):
+        # Offset in the text of an LSP position {"line", "character"}
+        if self.line_starts is None:
+            starts = [0]
+            find = self.text.find
+            index = find("\n")
+            while index != -1:
+                starts.append(index + 1)
+                index = find("\n", index + 1)
+            self.line_starts = starts
+        line = position["line"]
+        if line >= len(self.line_starts):
+            return len(self.text)
+        start = self.line_starts[line]
+        end = self.line_starts[line + 1] - 1 if line + 1 < len(self.line_starts) else len(self.text)
+        return start + utf16_to_index(self.text[start:end], position["character"])
+
+    def apply_change(self, change):
+        # A change either replaces a range of the text or, without a range, the whole text
+        if "range" not in change:
+            self.text = change["text"]
+        else:
+            start = self.offset_at(change["range"]["start"])
+            end = self.offset_at(change["range"]["end"])
+            self.text = self.text[:start] + change["text"] + self.text[end:]
+        self.line_starts = None
+
+
+def to_lsp_diagnostic(diagnostic, lines):
+    # Converts a Diagnostic record to an LSP Diagnostic. `lines` are the lines of the analyzed text,
+    # needed to convert columns to UTF-16 offsets. A missing end position spans the rest of the line.
+    line = max((diagnostic.line or 1) - 1, 0)
+    line_text = lines[line] if line < len(lines) else ""
+    column = diagnostic.column or 0
+    if diagnostic.end_line is not None and diagnostic.end_column is not None:
+        end_line = max(diagnostic.end_line - 1, 0)
+        end_text = lines[end_line] if end_line < len(lines) else ""
+        end_column = diagnostic.end_column
+    else:
+        end_line, end_text, end_column = line, line_text, len(line_text)
+    return {
+        "range": {
+            "start": {"line": line, "character": index_to_utf16(line_text, column)},
+            "end": {"line": end_line, "character": index_to_utf16(end_text, end_column)},
+        },
+        "severity": SEVERITY_WARNING if diagnostic.severity == WARNING else SEVERITY_ERROR,
+        "code": diagnostic.code,
+        "source": "bugbuster",
+        "message": diagnostic.message,
+    }
+
+
+class LanguageServer:
+    """
+    Language Server Protocol endpoint publishing the diagnostics of the analyzer.
+    Messages are read on the calling thread, while the analyses run one at a time on a background thread,
+    so edits keep being applied during a long analysis. Documents are synchronized incrementally
+    (only the changed ranges are sent) and every document keeps its own IncrementalAnalyzer, so an edit only
+    re-lexes and re-parses the segments it touched.
+    After an edit, diagnostics are published once the document has not changed for `debounce` seconds;
+    an edit also cancels the running analysis of the previous text. Diagnostics can also be pulled with
+    textDocument/diagnostic, a request that the client can cancel with $/cancelRequest.
+    Every analysis runs within a budget of `max_diagnostics` diagnostics per phase and `time_limit` seconds
+    (None for no limit); partial results are published, marked as truncated, and the next analysis of the
+    document continues from the segments parsed so far.
+    """
+
+    def __init__(self, reader, writer, debounce=DEFAULT_DEBOUNCE_MS / 1000, dfa_cache=True,
+                 max_diagnostics=DEFAULT_MAX_DIAGNOSTICS, time_limit=DEFAULT_TIME_LIMIT):
+        self.reader = reader
+        self.writer = writer
+        self.debounce = debounce
+        self.dfa_cache = dfa_cache
+        self.max_diagnostics = max_diagnostics
+        self.time_limit = time_limit
+        self.documents = {}  # uri -> Document
+        self.jobs = queue.Queue()  # callables run by the analysis thread, None stops it
+        self.write_lock = threading.Lock()
+        self.cancelled = set()  # ids of the requests cancelled by the client
+        self.cancel_lock = threading.Lock()
+        self.initialized = False
+        self.shutdown_requested = False
+        self.analysis_thread = threading.Thread(target=self.run_jobs, name="analysis", daemon=True)
+
+    def send(self, message):
+        message["jsonrpc"] = "2.0"
+        with self.write_lock:
+            write_message(self.writer, message)
+
+    def respond(self, request_id, result=None, error_code=None, error_message=""):
+        if error_code is not None:
+            self.send({"id": request_id, "error": {"code": error_code, "message": error_message}})
+        else:
+            self.send({"id": request_id, "result": result})
+
+    def notify(self, method, params):
+        self.send({"method": method, "params": params})
+
+    def log(self, message):
+        self.notify("window/logMessage", {"type": 1, "message": message})
+
+    def serve(self):
+        """
+        Runs the message loop until the client sends "exit" or closes the input stream.
+        Returns the exit code: 0 if "shutdown" was requested before "exit", 1 otherwise.
+        """
+        self.analysis_thread.start()
+        try:
+            while True:
+                try:
+                    message = read_message(self.reader)
+                except (ProtocolError, ValueError) as error:
+                    self.respond(None, error_code=PARSE_ERROR, error_message=str(error))
+                    continue
+                if message is None or message.get("method") == "exit":
+                    break
+                self.dispatch(message)
+        finally:
+            for document in self.documents.values():
+                if document.timer is not None:
+                    document.timer.cancel()
+            self.jobs.put(None)
+            self.analysis_thread.join()
+            if self.dfa_cache and self.initialized:
+                # The client may be gone by now, so a cache that cannot be written is only reported on stderr
+                try:
+                    save_dfa_cache()
+                except OSError as error:
+                    print(f"could not save the DFA cache: {error}", file=sys.stderr)
+        return 0 if self.shutdown_requested else 1
+
+    def dispatch(self, message):
+        method = message.get("method")
+        request_id = message.get("id")
+        params = message.get("params") or {}
+        if method is None:
+            return  # A response to a request of the server: none are sent
+        handler = getattr(self, "on_" + method.replace("/", "_").replace("$", "dollar"), None)
+        if not self.initialized and method != "initialize":
+            if request_id is not None:
+                self.respond(request_id, error_code=SERVER_NOT_INITIALIZED, error_message="server not initialized")
+            return
+        if handler is None:
+            if request_id is not None:
+                self.respond(request_id, error_code=METHOD_NOT_FOUND, error_message=f"unsupported method {method}")
+            return
+        try:
+            if request_id is None:
+                handler(params)
+            else:
+                handler(request_id, params)
+        except Exception as error:
+            if request_id is not None:
+                self.respond(request_id, error_code=INTERNAL_ERROR, error_message=str(error))
+            else:
+                self.log(f"{method} failed: {error}")
+
+    def on_initialize(self, request_id, params):
+        self.initialized = True
+        if self.dfa_cache:
+            # Preload the DFAs saved by the previous session before the first parse
+            self.jobs.put(load_dfa_cache)
+        self.respond(request_id, {
+            "capabilities": {
+                "textDocumentSync": {"openClose": True, "change": SYNC_INCREMENTAL},
+                "diagnosticProvider": {"interFileDependencies": False, "workspaceDiagnostics": False},
+            },
+            "serverInfo": {"name": "bugbuster"},
+        })
+
+    def on_initialized(self, params):
+        pass
+
+    def on_shutdown(self, request_id, params):
+        self.shutdown_requested = True
+        self.respond(request_id, None)
+
+    def on_dollar_cancelRequest(self, params):
+        with self.cancel_lock:
+            self.cancelled.add(params.get("id"))
+
+    def is_request_cancelled(self, request_id):
+        with self.cancel_lock:
+            return request_id in self.cancelled
+
+    def on_textDocument_didOpen(self, params):
+        item = params["textDocument"]
+        document = Document(item["uri"], item["text"], item.get("version"))
+        self.documents[document.uri] = document
+        self.schedule(document, 0)
+
+    def on_textDocument_didChange(self, params):
+        document = self.documents.get(params["textDocument"]["uri"])
+        if document is None:
+            return
+        with document.lock:
+            for change in params["contentChanges"]:
+                document.apply_change(change)
+            document.version = params["textDocument"].get("version")
+            document.generation += 1  # Cancels the analysis of the previous text, if it is running
+        self.schedule(document, self.debounce)
+
+    def on_textDocument_didClose(self, params):
+        document = self.documents.pop(params["textDocument"]["uri"], None)
+        if document is None:
+            return
+        with document.lock:
+            document.generation += 1
+        if document.timer is not None:
+            document.timer.cancel()
+        self.notify("textDocument/publishDiagnostics", {"uri": document.uri, "diagnostics": []})
+
+    def on_textDocument_diagnostic(self, request_id, params):
+        document = self.documents.get(params["textDocument"]["uri"])
+        if document is None:
+            self.respond(request_id, {"kind": "full", "items": []})
+            return
+        self.jobs.put(lambda: self.pull_diagnostics(request_id, document))
+
+    def schedule(self, document, delay):
+        # (Re)starts the debounce timer of the document; when it fires, the analysis is queued
+        if document.timer is not None:
+            document.timer.cancel()
+        generation = document.generation
+
+        def job():
+            self.publish_diagnostics(document, generation)
+
+        if delay <= 0:
+            self.jobs.put(job)
+            return
+        document.timer = threading.Timer(delay, self.jobs.put, args=(job,))
+        document.timer.daemon = True
+        document.timer.start()
+
+    def run_jobs(self):
+        # Body of the analysis thread
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            try:
+                job()
+            except Exception as error:
+                self.log(f"analysis failed: {error}")
+
+    def analyze(self, document, is_cancelled):
+        # Runs on the analysis thread. Returns the diagnostics of the current text of the document,
+        # reusing the last complete result if the document has not changed since.
+        with document.lock:
+            text = document.text
+            generation = document.generation
+            version = document.version
+        if document.diagnostics is not None and document.diagnostics[0] == generation:
+            return text, version, document.diagnostics[1]
+        budget = AnalysisBudget(self.max_diagnostics, self.time_limit)
+        errors = document.analyzer.analyze(text, is_cancelled, budget=budget)
+        if not is_truncated(errors):
+            document.diagnostics = (generation, errors)
+        return text, version, errors
+
+    def publish_diagnostics(self, document, generation):
+        def is_cancelled():
+            return document.generation != generation
+
+        if is_cancelled():
+            return
+        try:
+            text, version, errors = self.analyze(document, is_cancelled)
+        except AnalysisCancelled:
+            return
+        if is_cancelled():
+            return
+        lines = text.split("\n")
+        params = {"uri": document.uri, "diagnostics": [to_lsp_diagnostic(error, lines) for error in errors]}
+        if version is not None:
+            params["version"] = version
+        self.notify("textDocument/publishDiagnostics", params)
+
+    def pull_diagnostics(self, request_id, document):
+        def is_cancelled():
+            return self.is_request_cancelled(request_id)
+
+        try:
+            if is_cancelled():
+                raise AnalysisCancelled()
+            text, _, errors = self.analyze(document, is_cancelled)
+        except AnalysisCancelled:
+            self.respond(request_id, error_code=REQUEST_CANCELLED, error_message="request cancelled")
+            return
+        finally:
+            with self.cancel_lock:
+                self.cancelled.discard(request_id)
+        lines = text.split("\n")
+        self.respond(request_id, {"kind": "full", "items": [to_lsp_diagnostic(error, lines) for error in errors]})
+
+
+def main(argv=None):
+    # Command-line entry point: serves the Language Server Protocol over the standard input and output.
+    arg_parser = argparse.ArgumentParser(description="BugBuster language server (LSP over stdio).")
+    arg_parser.add_argument("--debounce", type=int, default=DEFAULT_DEBOUNCE_MS, metavar="MS",
+                            help="delay between the last edit and the analysis (default: %(default)s)")
+    arg_parser.add_argument("--no-dfa-cache", action="store_true",
+                            help="do not preload or save the prediction DFAs in ~/.cache/bugbuster/")
+    arg_parser.add_argument("--max-diagnostics", type=int, default=DEFAULT_MAX_DIAGNOSTICS, metavar="N",
+                            help="diagnostics reported per phase at most, 0 for no limit (default: %(default)s)")
+    arg_parser.add_argument("--time-limit", type=float, default=DEFAULT_TIME_LIMIT, metavar="SECONDS",
+                            help="time limit of an analysis, 0 for no limit (default: %(default)s)")
+    args = arg_parser.parse_args(argv)
+    server = LanguageServer(sys.stdin.buffer, sys.stdout.buffer, args.debounce / 1000, not args.no_dfa_cache,
+                            args.max_diagnostics or None, args.time_limit or None)
+    return server.serve()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
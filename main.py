@@ -1,41 +1,28 @@
+import html
 import sys
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QTextEdit, QVBoxLayout, QWidget,
-                             QToolBar, QAction, QMessageBox)
-from PyQt5.QtCore import Qt
+                             QToolBar, QAction, QMessageBox, QListView, QPlainTextEdit, QLabel)
+from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtGui import QIcon, QPixmap, QTextCursor, QColor, QTextCharFormat
-from antlr4 import InputStream, CommonTokenStream
-from antlr4.error.ErrorListener import ErrorListener
-from generated.LanguageLexer import LanguageLexer
-from generated.LanguageParser import LanguageParser
-from semantic_analyzer import SemanticAnalyzer
-
-
-class CustomErrorMessage:
-    # Provides utility methods for transforming default error messages into more readable and user-friendly text.
-    @staticmethod
-    def transform(msg, offending_symbol):
-        # Transforms specific parser error messages into clearer explanations.
-        # like unexpected end of input and incomplete statements.
-        if "mismatched input '<EOF>'" in msg:
-            if offending_symbol.text == "<EOF>":
-                return "Unexpected end of input: check for missing or incomplete statements."
-            return f"Error near '{offending_symbol.text}'"
-        if "no viable alternative at input" in msg:
-            if offending_symbol.text == "<EOF>":
-                return "Incomplete statement or missing input at the end of the code."
-            return f"Error near '{offending_symbol.text}'"
-        return msg
+from analysis_worker import AnalysisRunner
+from diagnostics_model import LOCATION_ROLE, DiagnosticsModel
 
 
 class CodeAnalyzerGUI(QMainWindow):
     # Main GUI class for the code analyzer application.
-    # Provides a text editor for writing code, an output console for displaying errors,
+    # Provides a text editor for writing code, an output list for displaying errors,
     # and tools for analyzing and interacting with the input code.
     def __init__(self):
         super().__init__()
         self.setWindowTitle("BugBuster")
         self.setGeometry(100, 100, 800, 600)
-        self.error_lines = {}
+        self.highlighter = None
+        self.analysis_runner = AnalysisRunner(self.code_input_text, parent=self, tokens_provider=self.line_tokens)
+        self.analysis_runner.results_ready.connect(self.show_results)
+        self.analysis_runner.analysis_failed.connect(
+            lambda message: self.show_error_message(f"An error occurred: {message}"))
+        self.analysis_runner.busy_changed.connect(self.show_busy)
+        self.analysis_runner.profile_ready.connect(self.show_profile)
         self.initUI()
 
     def initUI(self):
@@ -43,20 +30,23 @@ class CodeAnalyzerGUI(QMainWindow):
         # output console, toolbar, and layout.
         # Sets up actions like running analysis, cleaning input, and exiting the application.
 
-        # Text area to input code
-        self.code_input = QTextEdit(self)
+        # Text area to input code (a plain text editor lays out only the visible blocks, even for huge files)
+        self.code_input = QPlainTextEdit(self)
         self.code_input.setPlaceholderText("Write code here...")
 
-        # Output console for errors
-        self.output_console = QTextEdit(self)
-        self.output_console.setReadOnly(True)
-        self.output_console.setPlaceholderText("Output console...")
-        self.output_console.mousePressEvent = self.handle_output_click
+        # Output list for errors: a model/view list only lays out and paints the visible rows
+        self.diagnostics_model = DiagnosticsModel("Output console...", self)
+        self.output_view = QListView(self)
+        self.output_view.setModel(self.diagnostics_model)
+        self.output_view.setUniformItemSizes(True)
+        self.output_view.setEditTriggers(QListView.NoEditTriggers)
+        self.output_view.clicked.connect(self.jump_to_diagnostic)
+        self.output_view.activated.connect(self.jump_to_diagnostic)
 
         # Layout
         layout = QVBoxLayout()
         layout.addWidget(self.code_input, stretch=3)
-        layout.addWidget(self.output_console, stretch=1)
+        layout.addWidget(self.output_view, stretch=1)
 
         container = QWidget()
         container.setLayout(layout)
@@ -79,6 +69,25 @@ class CodeAnalyzerGUI(QMainWindow):
         clean_action.setToolTip("Clean")
         toolbar.addAction(clean_action)
 
+        # Check as you type button
+        self.live_action = QAction("Live", self)
+        self.live_action.setCheckable(True)
+        self.live_action.toggled.connect(self.toggle_live_check)
+        self.live_action.setToolTip("Check as you type")
+        toolbar.addAction(self.live_action)
+
+        # Profiling button
+        self.profile_action = QAction("Profile", self)
+        self.profile_action.setCheckable(True)
+        self.profile_action.toggled.connect(self.toggle_profiling)
+        self.profile_action.setToolTip("Measure the time spent in every phase of the analysis")
+        toolbar.addAction(self.profile_action)
+
+        # Status bar showing the profile of the last analysis; its tooltip holds the full report
+        self.profile_label = QLabel(self)
+        self.statusBar().addPermanentWidget(self.profile_label, 1)
+        self.statusBar().hide()
+
         # Info button
         info_action = QAction(QIcon("images/info.png"), "", self)
         info_action.triggered.connect(self.show_info)
@@ -95,99 +104,92 @@ class CodeAnalyzerGUI(QMainWindow):
 
         self.apply_stylesheet()
 
+        # The highlighter loads the lexer tables, so it is installed once the window is up
+        QTimer.singleShot(0, self.install_highlighter)
+
+    def install_highlighter(self):
+        # Syntax highlighting driven by the token types of the grammar; only edited lines are tokenized again
+        from syntax_highlighter import SyntaxHighlighter
+
+        self.highlighter = SyntaxHighlighter(self.code_input.document())
+
+    def line_tokens(self):
+        # The highlighter's tokens of every line, reused by the analysis instead of lexing the code again
+        return self.highlighter.line_tokens() if self.highlighter is not None else None
+
     def check_text(self):
         if self.code_input.toPlainText().strip():
             self.run_action.setEnabled(True)
+            if self.live_action.isChecked():
+                self.analysis_runner.request_debounced()
         else:
             self.run_action.setEnabled(False)
+            self.analysis_runner.cancel()
+
+    def code_input_text(self):
+        return self.code_input.toPlainText()
+
+    def toggle_live_check(self, checked):
+        # Enables or disables the "check as you type" mode.
+        # When enabled, every edit (re)starts a short timer and the analysis runs once typing pauses.
+        if checked and self.code_input.toPlainText().strip():
+            self.analysis_runner.request_debounced()
+        elif not checked:
+            self.analysis_runner.cancel()
+
+    def toggle_profiling(self, checked):
+        # Enables or disables the instrumentation of the analysis; the next analysis reports its profile.
+        self.analysis_runner.profiling = checked
+        self.statusBar().setVisible(checked)
+        if checked:
+            self.profile_label.setText("Run an analysis to see its profile.")
+            self.profile_label.setToolTip("")
+
+    def show_profile(self, profile):
+        self.profile_label.setText(profile.summary())
+        self.profile_label.setToolTip(f"<pre>{html.escape(profile.report())}</pre>")
 
     def apply_stylesheet(self):
         self.setStyleSheet("""
             QMainWindow { background-color: #3f4240; }
             QToolBar QToolButton { margin: 2px; padding: 5px; color: white; font-size: 18px; }
             QToolBar QToolButton:hover { background-color: #161716; color: white; }
-            QTextEdit { background-color: #202420; border: 1px solid #055405; color: white; font-family: Consolas, monaco, monospace; font-size: 18px; }
-            QTextEdit[readOnly="true"] { background-color: #202420; border: 1px solid #055405; color: white; font-family: Consolas, monaco, monospace; font-size: 14px; }
+            QPlainTextEdit { background-color: #202420; border: 1px solid #055405; color: white; font-family: Consolas, monaco, monospace; font-size: 18px; }
+            QStatusBar QLabel { color: white; font-family: Consolas, monaco, monospace; font-size: 12px; }
+            QListView { background-color: #202420; border: 1px solid #055405; color: white; font-family: Consolas, monaco, monospace; font-size: 14px; }
         """)
 
     def run_analysis(self):
-        # Performs lexical, syntactic, and semantic analysis on the user's code.
-        # Collects errors from each phase of analysis and displays them in the output console.
-        try:
-            input_code = self.code_input.toPlainText()
-            input_stream = InputStream(input_code)
-            lexer = LanguageLexer(input_stream)
-            lexer_errors = []
-
-            class LexerErrorListener(ErrorListener):
-                # Custom error listener for the parser to capture and format syntax errors.
-                # Overrides the default error handling mechanism to provide more user-friendly messages.
-                def syntaxError(self, recognizer, offendingSymbol, line, column, msg, e):
-                    lexer_errors.append((line, f"Error at line {line}, column {column}: {msg}"))
-
-            lexer.removeErrorListeners()
-            lexer.addErrorListener(LexerErrorListener())
-            token_stream = CommonTokenStream(lexer)
-            token_stream.fill()
-
-            for token in token_stream.tokens:
-                if token.type == lexer.UNKNOWN:
-                    lexer_errors.append(
-                        (token.line, f"Error at line {token.line}, column {token.column}: unrecognized symbol '{token.text}'")
-                    )
-
-            parser = LanguageParser(token_stream)
-            parser_errors = []
-
-            class ParserErrorListener(ErrorListener):
-                def syntaxError(self, recognizer, offendingSymbol, line, column, msg, e):
-                    msg = CustomErrorMessage.transform(msg, offendingSymbol)
-
-                    if "'<EOF>'" in msg:
-                        msg = msg.replace(" at '<EOF>'", "")
-                    parser_errors.append((line, f"Error at line {line}, column {column},  {msg}"))
-
-            parser.removeErrorListeners()
-            parser.addErrorListener(ParserErrorListener())
-            tree = parser.start_()
-
-            semantic_analyzer = SemanticAnalyzer()
-            semantic_analyzer.visit(tree)
-
-            all_errors = lexer_errors + parser_errors + [(line, err) for err in semantic_analyzer.errors for line in [int(err.split()[3][:-1])]]
-            all_errors.sort(key=lambda x: x[0])
-
-            self.error_lines = {}
-            if all_errors:
-                self.output_console.clear()
-                for line, message in all_errors:
-                    self.error_lines[message] = line
-                    self.output_console.append(message)
-            else:
-                self.output_console.setPlainText("No errors found!")
-
-        except Exception as e:
-            self.show_error_message(f"An error occurred: {str(e)}")
-
-    def handle_output_click(self, event):
-        # Handles user clicks on the output console.
-        # Checks if the clicked error message corresponds to a specific line number
-        # and highlights that line in the code editor.
-        cursor = self.output_console.cursorForPosition(event.pos())
-        cursor.select(QTextCursor.LineUnderCursor)
-        clicked_text = cursor.selectedText()
-
-        if clicked_text in self.error_lines:
-            line_number = self.error_lines[clicked_text]
-            self.highlight_line(line_number)
-
-    def highlight_line(self, line_number):
+        # Starts the lexical, syntactic, and semantic analysis of the user's code.
+        # The analysis runs on a background thread so the editor stays responsive;
+        # its errors are delivered to show_results once it completes.
+        self.analysis_runner.request()
+
+    def show_results(self, all_errors):
+        # Displays the errors collected from each phase of analysis in the output list.
+        self.diagnostics_model.set_diagnostics(all_errors, "No errors found!")
+
+    def show_busy(self, busy):
+        if not self.diagnostics_model.diagnostics:
+            self.diagnostics_model.set_placeholder("Analyzing..." if busy else "Output console...")
+
+    def jump_to_diagnostic(self, index):
+        # Handles clicks (and Enter) on the output list.
+        # Every row carries the location of its error, which is highlighted in the code editor.
+        location = index.data(LOCATION_ROLE)
+        if location is not None and location[0] is not None:
+            self.highlight_line(*location)
+
+    def highlight_line(self, line_number, column=None):
         # Highlights the specified line in the code editor.
-        # Moves the cursor to the given line and sets focus on the editor for clarity.
-        cursor = self.code_input.textCursor()
-        cursor.movePosition(QTextCursor.Start)
-        for _ in range(line_number - 1):
-            cursor.movePosition(QTextCursor.Down)
+        # Moves the cursor to the given line (and column, if known) and sets focus on the editor for clarity.
+        # The line is looked up directly as a block of the document, so wrapped lines do not matter.
+        block = self.code_input.document().findBlockByNumber(line_number - 1)
+        if not block.isValid():
+            return
+        cursor = QTextCursor(block)
+        if column is not None:
+            cursor.setPosition(block.position() + min(column, block.length() - 1))
         extra_selection = QTextEdit.ExtraSelection()
         line_color = QColor("#383631")
         extra_selection.format.setBackground(line_color)
@@ -202,7 +204,11 @@ class CodeAnalyzerGUI(QMainWindow):
 
     def clean_text(self):
         self.code_input.clear()
-        self.output_console.clear()
+        self.diagnostics_model.clear("Output console...")
+
+    def closeEvent(self, event):
+        self.analysis_runner.shutdown()
+        super().closeEvent(event)
 
     def show_info(self):
         info_text = (
@@ -217,7 +223,9 @@ class CodeAnalyzerGUI(QMainWindow):
     def confirm_exit(self):
         reply = QMessageBox.question(self, "Exit", "Are you sure you want to exit?", QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         if reply == QMessageBox.Yes:
-            QApplication.instance().quit()
+            # Closing the window (rather than quitting the application) runs closeEvent, which stops the analysis
+            # thread and saves the caches; the application quits once its last window is closed
+            self.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,373 @@
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+from antlr4.Token import Token
+from antlr4.tree.Tree import ErrorNode, TerminalNode
+
+from code_analyzer import analyze_code, parse_code
+from dfa_cache import load_dfa_cache
+from diagnostics import sort_diagnostics
+from incremental_analyzer import STATEMENT_START
+from rule_engine import RULES
+from segmentation import CLASS_HEADER, STATEMENT, UnbalancedSource, split_segments
+from semantic_analyzer import SemanticAnalyzer
+from source_files import read_source
+from syntax_tree import Expression, NodeVisitor
+from tree_builder import build_syntax_tree
+
+# Declaration events collected from the tree of a chunk (see DeclarationCollector)
+VARIABLE = "variable"  # (VARIABLE, name, data type): global variable
+CLASS = "class"  # (CLASS, name, top level, conflicts with a local name): class declared anywhere in the chunk
+METHOD = "method"  # (METHOD, class name, method name): method of a class
+
+# Messages sent by the chunk workers
+INDEX = "index"
+DONE = "done"
+FAILED = "failed"
+
+
+class Chunk:
+    # A contiguous part of a document made of whole top-level statements and classes,
+    # with the position of its first character (1-based line, 0-based column).
+    def __init__(self, start, end, line, column):
+        self.start = start
+        self.end = end
+        self.line = line
+        self.column = column
+
+
+def split_chunks(source, count):
+    """
+    Splits the source into at most `count` chunks of about the same size, at top-level boundaries only
+    (before a top-level statement or class, see segmentation.py), so that every chunk parses on its own
+    with the start rule. The trailing segment is never a chunk of its own, since it may only hold
+    whitespace and comments. Raises UnbalancedSource when the braces of the source do not match.
+    """
+    segments = split_segments(source)
+    chunks = []
+    start, line, column = 0, 1, 0
+    for segment in segments[1:-1]:
+        if len(chunks) + 1 >= count:
+            break
+        if segment.kind != STATEMENT and segment.kind != CLASS_HEADER:
+            continue
+        if segment.start >= len(source) * (len(chunks) + 1) / count:
+            chunks.append(Chunk(start, segment.start, line, column))
+            start, line, column = segment.start, segment.line, segment.column
+    chunks.append(Chunk(start, len(source), line, column))
+    return chunks
+
+
+def last_leaf(tree):
+    # The last terminal node of a parse tree (the last token consumed, or one conjured by error recovery), or None.
+    # The tree is searched from its end, without recursion.
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, TerminalNode):
+            return node
+        if node.children:
+            stack.extend(node.children)
+    return None
+
+
+def parsed_to_end(tree, parser_errors):
+    """
+    Whether the parse of a chunk ended exactly at its end, so that the parser of the whole document reads the chunk
+    the same way (as IncrementalAnalyzer.complete for a segment): its first token starts a statement, all its
+    tokens are consumed, and, with syntax errors, no error is on its last token or at its end and its last token
+    was not skipped to recover from an error, where the parser of the document would see the tokens of the next
+    chunk instead.
+    A stray '}' balanced by an extra '{' further on, for instance, makes the parser end a class where the split
+    does not, or stop at a token that cannot start a statement (the start rule then ends without an error).
+    """
+    parser = tree.parser
+    if parser is None or parser.getCurrentToken().type != Token.EOF:
+        return False
+    if tree.start is None or tree.start.type not in STATEMENT_START:
+        return False
+    if not parser_errors:
+        return True
+    last = tree.stop  # The token before EOF, since all the tokens were consumed
+    if any((error.line, error.column) >= (last.line, last.column) for error in parser_errors):
+        return False
+    return not isinstance(last_leaf(tree), (ErrorNode, type(None)))
+
+
+class DeclarationCollector(NodeVisitor):
+    """
+    Cheap first pass over the syntax tree of a chunk, collecting the declarations that the following chunks can see:
+    the global variables, the classes (declared anywhere, since every class name becomes a data type)
+    and the methods of every class, in document order.
+    Whether a class name conflicts with a global name is only known once the declarations of the preceding
+    chunks are known (see DeclarationIndex), so only conflicts with the names of the enclosing local scopes
+    are decided here. Expressions never declare anything and are skipped.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.events = []
+        self.scopes = []  # names declared in the enclosing non-global scopes, innermost last
+        self.current_class = None
+
+    def visit(self, node):
+        if isinstance(node, Expression):
+            return None
+        return super().visit(node)
+
+    def visit_scope(self, node):
+        self.scopes.append(set())
+        self.visitChildren(node)
+        self.scopes.pop()
+        return None
+
+    def visitVariableDeclaration(self, node):
+        if node.name is not None:
+            if self.scopes:
+                self.scopes[-1].add(node.name)
+            else:
+                self.events.append((VARIABLE, node.name, node.data_type))
+        return None
+
+    def visitClassDeclaration(self, node):
+        name = node.name
+        if name is None:
+            return None
+        local_conflict = any(name in names for names in self.scopes)
+        self.events.append((CLASS, name, not self.scopes, local_conflict))
+        if self.scopes and not local_conflict:
+            self.scopes[-1].add(name)
+        previous_class = self.current_class
+        self.current_class = name
+        self.visit_scope(node)
+        self.current_class = previous_class
+        return None
+
+    def visitMethodDeclaration(self, node):
+        if node.name is None:
+            return None
+        if self.current_class:
+            self.events.append((METHOD, self.current_class, node.name))
+        self.scopes.append({param.name for param in node.parameters if param.name is not None})
+        if node.body is not None:
+            self.visit(node.body)
+        self.scopes.pop()
+        return None
+
+    def visitMainMethodDeclaration(self, node):
+        return self.visit_scope(node)
+
+    def visitBlock(self, node):
+        return self.visit_scope(node)
+
+    def visitForLoop(self, node):
+        return self.visit_scope(node)
+
+    def visitWhileLoop(self, node):
+        return self.visit_scope(node)
+
+
+class DeclarationIndex:
+    """
+    The declarations visible at the top level after the chunks applied so far: global variables and classes
+    (name -> type), class names (data types) and the methods of every class.
+    apply() follows the rules of SemanticAnalyzer (a global variable or class is not redeclared, a class
+    name must not clash with a visible name or a data type), so the index of the chunks preceding a chunk
+    is exactly the state the semantic analyzer would have reached when visiting the whole document.
+    """
+
+    def __init__(self):
+        self.global_symbols = {}
+        self.data_types = set(SemanticAnalyzer().valid_data_types)
+        self.class_names = set()
+        self.class_methods = {}
+
+    def apply(self, events):
+        for event in events:
+            if event[0] == VARIABLE:
+                _, name, data_type = event
+                if name not in self.global_symbols:
+                    self.global_symbols[name] = data_type
+            elif event[0] == CLASS:
+                _, name, top_level, local_conflict = event
+                if not (local_conflict or name in self.global_symbols or name in self.data_types):
+                    if top_level:
+                        self.global_symbols[name] = "class"
+                    self.data_types.add(name)
+                    self.class_names.add(name)
+                self.class_methods.setdefault(name, set())
+            else:
+                _, class_name, method_name = event
+                self.class_methods.setdefault(class_name, set()).add(method_name)
+
+    def seed(self):
+        # Arguments of SemanticAnalyzer.preload
+        return self.global_symbols, self.class_names, self.class_methods
+
+
+def chunk_worker(connection, text, line, column, two_stage, dfa_cache, fast_lexer, token_store, disabled_rules):
+    # Runs in a worker process: parses a chunk, sends its declarations and whether it parsed to its end
+    # (see parsed_to_end), waits for the declarations of the preceding chunks and sends back the lexical, syntax
+    # and semantic errors of the chunk; it stops when it gets None instead of the declarations.
+    # The syntax tree stays in the worker between the two passes.
+    try:
+        if dfa_cache:
+            load_dfa_cache(dfa_cache)
+        parse_tree, lexer_errors, parser_errors = parse_code(text, two_stage=two_stage, line=line, column=column,
+                                                             fast_lexer=fast_lexer, token_store=token_store)
+        complete = parsed_to_end(parse_tree, parser_errors)
+        tree = build_syntax_tree(parse_tree)
+        del parse_tree  # Only the syntax tree is kept, as with parse_syntax_tree
+        collector = DeclarationCollector()
+        collector.visit(tree)
+        connection.send((INDEX, (collector.events, complete)))
+
+        seed = connection.recv()
+        if seed is None:
+            return
+        semantic_analyzer = SemanticAnalyzer(disabled_rules)
+        semantic_analyzer.preload(*seed)
+        semantic_analyzer.visit(tree)
+        connection.send((DONE, (lexer_errors, parser_errors, semantic_analyzer.errors)))
+    except Exception:
+        connection.send((FAILED, traceback.format_exc()))
+    finally:
+        connection.close()
+
+
+def receive(connection, expected):
+    try:
+        kind, payload = connection.recv()
+    except EOFError:
+        raise RuntimeError("a chunk worker exited unexpectedly") from None
+    if kind == FAILED:
+        raise RuntimeError(f"a chunk worker failed:\n{payload}")
+    if kind != expected:
+        raise RuntimeError(f"unexpected message from a chunk worker: {kind}")
+    return payload
+
+
+def analyze_parallel(source, jobs=None, two_stage=True, dfa_cache=None, fast_lexer=False, token_store=False,
+                     disabled_rules=()):
+    """
+    Analyzes a single (large) document in parallel and returns the same diagnostics as analyze_code.
+    The document is split into one chunk per worker process at top-level boundaries. Every worker lexes
+    and parses its chunk, with the chunk's document position so that the diagnostics carry absolute lines,
+    and collects its declarations. The declarations of the chunks are merged in document order into a
+    DeclarationIndex; every worker then gets the index of the chunks preceding its own and runs the semantic
+    analysis of its chunk, so that references across chunks resolve exactly as in a sequential analysis.
+    Documents that cannot be split (a single chunk, unbalanced braces) are analyzed sequentially, and so are
+    documents with a chunk that does not parse to its end (see parsed_to_end): a syntax error may make the parser
+    of the whole document read across a chunk boundary, which the chunk parsed on its own cannot.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    try:
+        chunks = split_chunks(source, jobs)
+    except UnbalancedSource:
+        chunks = []
+    if len(chunks) <= 1:
+        if dfa_cache:
+            load_dfa_cache(dfa_cache)
+        return analyze_code(source, two_stage=two_stage, fast_lexer=fast_lexer, token_store=token_store,
+                            disabled_rules=disabled_rules)
+
+    context = multiprocessing.get_context()
+    connections = []
+    processes = []
+    try:
+        for chunk in chunks:
+            connection, worker_connection = context.Pipe()
+            process = context.Process(target=chunk_worker, daemon=True,
+                                      args=(worker_connection, source[chunk.start:chunk.end], chunk.line,
+                                            chunk.column, two_stage, dfa_cache, fast_lexer, token_store,
+                                            disabled_rules))
+            process.start()
+            worker_connection.close()
+            connections.append(connection)
+            processes.append(process)
+
+        indexes = [receive(connection, INDEX) for connection in connections]
+        if not all(complete for _, complete in indexes):
+            for connection in connections:
+                connection.send(None)
+            if dfa_cache:
+                load_dfa_cache(dfa_cache)
+            return analyze_code(source, two_stage=two_stage, fast_lexer=fast_lexer, token_store=token_store,
+                                disabled_rules=disabled_rules)
+        declarations = DeclarationIndex()
+        for connection, (events, _) in zip(connections, indexes):
+            connection.send(declarations.seed())  # Pickled right away, so later updates are not seen
+            declarations.apply(events)
+
+        # Same order as analyze_code: lexical, then syntax, then semantic errors, each in document order
+        results = [receive(connection, DONE) for connection in connections]
+        errors = [error for result in results for error in result[0]]
+        errors += [error for result in results for error in result[1]]
+        errors += [error for result in results for error in result[2]]
+        return sort_diagnostics(errors)
+    finally:
+        for connection in connections:
+            connection.close()
+        for process in processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+
+
+def main(argv=None):
+    # Command-line entry point: analyzes one file in parallel and prints its diagnostics.
+    # With --verify, the file is also analyzed sequentially and the two results are compared.
+    # Exits with status 1 when diagnostics are reported (or, with --verify, when the results differ).
+    arg_parser = argparse.ArgumentParser(description="Analyze a single large file in parallel worker processes.")
+    arg_parser.add_argument("path", help="file to analyze")
+    arg_parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                            help="number of chunks and worker processes (default: number of CPUs)")
+    arg_parser.add_argument("--parse-mode", choices=("two-stage", "ll"), default="two-stage",
+                            help="parsing mode, as in batch_checker.py (default: two-stage)")
+    arg_parser.add_argument("--lexer", choices=("antlr", "fast"), default="antlr",
+                            help="lexer engine, as in batch_checker.py (default: antlr)")
+    arg_parser.add_argument("--token-store", action="store_true",
+                            help="keep the tokens in compact arrays, as in batch_checker.py")
+    arg_parser.add_argument("--disable-rule", action="append", default=[], choices=sorted(RULES), metavar="RULE",
+                            help="skip an optional semantic check, as in batch_checker.py; may be repeated")
+    arg_parser.add_argument("--dfa-cache", metavar="PATH", help="preload the lexer and parser DFAs from this file")
+    arg_parser.add_argument("--verify", action="store_true",
+                            help="also analyze the file sequentially and compare the diagnostics")
+    args = arg_parser.parse_args(argv)
+
+    source = read_source(args.path)
+    two_stage = args.parse_mode == "two-stage"
+
+    start = time.perf_counter()
+    fast_lexer = args.lexer == "fast"
+    errors = analyze_parallel(source, args.jobs, two_stage, args.dfa_cache, fast_lexer, args.token_store,
+                              args.disable_rule)
+    elapsed = time.perf_counter() - start
+    for error in errors:
+        print(error.text)
+    lines = source.count("\n") + 1
+    print(f"Analyzed {lines} lines in {args.jobs} chunks in {elapsed:.2f}s "
+          f"({lines / max(elapsed, 1e-9):.0f} lines/s): {len(errors)} diagnostics.", file=sys.stderr)
+
+    if args.verify:
+        start = time.perf_counter()
+        expected = analyze_code(source, two_stage=two_stage, fast_lexer=fast_lexer, token_store=args.token_store,
+                                disabled_rules=args.disable_rule)
+        elapsed = time.perf_counter() - start
+        if expected != errors:
+            print(f"Sequential analysis ({elapsed:.2f}s) differs: {len(expected)} diagnostics.", file=sys.stderr)
+            for error in set(expected) - set(errors):
+                print(f"  missing: {error.text}", file=sys.stderr)
+            for error in set(errors) - set(expected):
+                print(f"  extra: {error.text}", file=sys.stderr)
+            return 1
+        print(f"Sequential analysis ({elapsed:.2f}s) reports the same diagnostics.", file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,241 @@
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+
+from antlr4.error.ErrorListener import ErrorListener
+from syntax_tree import node_classes
+
+
+class PredictionListener(ErrorListener):
+    # Counts the prediction events that ANTLR reports to the error listeners of the parser.
+    # These are only reported while parsing with full LL prediction.
+    def __init__(self, profile):
+        super().__init__()
+        self.profile = profile
+
+    def reportAmbiguity(self, recognizer, dfa, startIndex, stopIndex, exact, ambigAlts, configs):
+        self.profile.count("ambiguities")
+
+    def reportAttemptingFullContext(self, recognizer, dfa, startIndex, stopIndex, conflictingAlts, configs):
+        self.profile.count("full-context attempts")
+
+    def reportContextSensitivity(self, recognizer, dfa, startIndex, stopIndex, prediction, configs):
+        self.profile.count("context sensitivities")
+
+
+class Profile:
+    """
+    Opt-in instrumentation of a single analysis (or of many, see merge).
+    It records, for every phase, the wall time and the net number of memory blocks allocated
+    (sys.getallocatedblocks(), which costs nothing to read); for the semantic analyzer, the number of
+    visits of every kind of node and the time spent in them, and the time of every rule of rule_engine.py;
+    for the parser, how often each decision was predicted, how often a prediction missed the DFA and had to
+    simulate the ATN, and the fallbacks to full LL prediction.
+    The analysis functions take an optional `profile` argument: when it is None nothing is instrumented,
+    so profiling costs nothing when it is disabled.
+    A Profile only holds plain data, so it can be pickled and sent back from worker processes.
+    """
+
+    def __init__(self):
+        self.phases = {}  # name -> [runs, wall seconds, net allocated blocks], in order of first use
+        self.visits = {}  # node class -> [visits, cumulative seconds, self seconds]
+        self.rules = {}  # rule code -> [handler calls, seconds]
+        self.decisions = {}  # rule#decision -> [predictions, seconds, ATN simulations]
+        self.counters = {}  # name -> count
+
+    @contextmanager
+    def phase(self, name):
+        blocks = sys.getallocatedblocks()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            entry = self.phases.get(name)
+            if entry is None:
+                entry = self.phases[name] = [0, 0.0, 0]
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] += sys.getallocatedblocks() - blocks
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def instrument_visitor(self, walker):
+        """
+        Replaces the enter and leave handlers (enterVariableDeclaration, leaveBlock, ...) of this TreeWalker instance
+        with wrappers that count the visits of every kind of node and measure their time, from entering the node
+        to leaving it. The cumulative time of a visit includes the nested visits, its self time does not.
+        Must be called before the first walk.
+        """
+        visits = self.visits
+        starts = []
+        child_times = [0.0]
+
+        def wrap_enter(handler):
+            def timed_enter(node):
+                child_times.append(0.0)
+                starts.append(time.perf_counter())
+                if handler is not None:
+                    return handler(node)
+                return None
+            return timed_enter
+
+        def wrap_leave(handler, kind):
+            entry = visits.get(kind)
+            if entry is None:
+                entry = visits[kind] = [0, 0.0, 0.0]
+
+            def timed_leave(node):
+                try:
+                    if handler is not None:
+                        handler(node)
+                finally:
+                    elapsed = time.perf_counter() - starts.pop()
+                    children = child_times.pop()
+                    child_times[-1] += elapsed
+                    entry[0] += 1
+                    entry[1] += elapsed
+                    entry[2] += elapsed - children
+            return timed_leave
+
+        for kind in node_classes():
+            enter = getattr(walker, "enter" + kind, None)
+            leave = getattr(walker, "leave" + kind, None)
+            if enter is not None or leave is not None:
+                setattr(walker, "enter" + kind, wrap_enter(enter))
+                setattr(walker, "leave" + kind, wrap_leave(leave, kind))
+        walker.handlers = None
+        rule_engine = getattr(walker, "rule_engine", None)
+        if rule_engine is not None:
+            self.instrument_rules(rule_engine)
+
+    def instrument_rules(self, rule_engine):
+        """
+        Replaces the handlers of a RuleEngine (see rule_engine.py) with wrappers measuring the time of every rule.
+        Handlers run around the visit of their node, so their time counts in the self time of the parent's visit.
+        """
+        rules = self.rules
+
+        def wrap(handler):
+            code = handler.__self__.code
+            entry = rules.get(code)
+            if entry is None:
+                entry = rules[code] = [0, 0.0]
+
+            def timed_handler(node):
+                start = time.perf_counter()
+                try:
+                    return handler(node)
+                finally:
+                    entry[0] += 1
+                    entry[1] += time.perf_counter() - start
+            return timed_handler
+
+        rule_engine.handlers = {node_class: (tuple(map(wrap, enter)), tuple(map(wrap, leave)))
+                                for node_class, (enter, leave) in rule_engine.handlers.items()}
+
+    def instrument_parser(self, parser):
+        """
+        Wraps the prediction of the parser to collect per-decision statistics and adds a listener counting
+        ambiguities and full-context attempts. Must be called after the error listeners of the parser are set up.
+        """
+        interp = parser._interp
+        atn = parser.atn
+        names = [f"{parser.ruleNames[state.ruleIndex]}#{decision}" for decision, state in enumerate(atn.decisionToState)]
+        decisions = self.decisions
+        current = [None]
+        adaptive_predict = interp.adaptivePredict
+        compute_target_state = interp.computeTargetState
+
+        def entry_for(decision):
+            name = names[decision]
+            entry = decisions.get(name)
+            if entry is None:
+                entry = decisions[name] = [0, 0.0, 0]
+            return entry
+
+        def adaptivePredict(input, decision, outerContext):
+            entry = entry_for(decision)
+            current.append(entry)
+            start = time.perf_counter()
+            try:
+                return adaptive_predict(input, decision, outerContext)
+            finally:
+                entry[0] += 1
+                entry[1] += time.perf_counter() - start
+                current.pop()
+
+        def computeTargetState(dfa, previousD, t):
+            # Called when the DFA has no edge for the next token yet, i.e. the ATN must be simulated
+            if current[-1] is not None:
+                current[-1][2] += 1
+            return compute_target_state(dfa, previousD, t)
+
+        interp.adaptivePredict = adaptivePredict
+        interp.computeTargetState = computeTargetState
+        parser.addErrorListener(PredictionListener(self))
+
+    def merge(self, other):
+        # Adds the measurements of another profile to this one.
+        for mine, theirs in ((self.phases, other.phases), (self.visits, other.visits), (self.rules, other.rules),
+                             (self.decisions, other.decisions)):
+            for key, values in theirs.items():
+                entry = mine.get(key)
+                if entry is None:
+                    mine[key] = list(values)
+                else:
+                    for index, value in enumerate(values):
+                        entry[index] += value
+        for name, value in other.counters.items():
+            self.count(name, value)
+
+    def summary(self):
+        # One-line summary, e.g. for a status bar
+        parts = [f"{name} {seconds:.3f}s" for name, (_, seconds, _) in self.phases.items()]
+        predictions = sum(entry[0] for entry in self.decisions.values())
+        if predictions:
+            simulations = sum(entry[2] for entry in self.decisions.values())
+            parts.append(f"{predictions} predictions ({simulations} ATN simulations)")
+        fallbacks = self.counters.get("LL fallbacks")
+        if fallbacks:
+            parts.append(f"{fallbacks} LL fallbacks")
+        return " | ".join(parts)
+
+    def report(self, top=15):
+        # Multi-line report of all the measurements, listing the `top` most expensive rules and decisions
+        lines = ["Phases:", f"  {'phase':<24} {'runs':>7} {'seconds':>10} {'net blocks':>12}"]
+        for name, (runs, seconds, blocks) in self.phases.items():
+            lines.append(f"  {name:<24} {runs:>7} {seconds:>10.4f} {blocks:>12}")
+
+        if self.visits:
+            lines += ["", f"Semantic visits (top {top} by self time; cumulative time includes nested visits):",
+                      f"  {'node':<24} {'visits':>9} {'cumulative s':>13} {'self s':>10}"]
+            ranked = sorted(self.visits.items(), key=lambda item: item[1][2], reverse=True)
+            for kind, (visits, cumulative, own) in ranked[:top]:
+                lines.append(f"  {kind:<24} {visits:>9} {cumulative:>13.4f} {own:>10.4f}")
+
+        if self.rules:
+            lines += ["", "Semantic rules (their time also counts in the self time of the parent nodes' visits):",
+                      f"  {'rule':<24} {'calls':>9} {'seconds':>10}"]
+            for code, (calls, seconds) in sorted(self.rules.items(), key=lambda item: item[1][1], reverse=True):
+                lines.append(f"  {code:<24} {calls:>9} {seconds:>10.4f}")
+
+        if self.decisions or self.counters:
+            predictions = sum(entry[0] for entry in self.decisions.values())
+            simulations = sum(entry[2] for entry in self.decisions.values())
+            lines += ["", "Prediction:", f"  predictions: {predictions}", f"  ATN simulations (DFA misses): {simulations}"]
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"  {name}: {value}")
+            if self.decisions:
+                lines += [f"  {'decision (top ' + str(top) + ' by time)':<24} {'predictions':>11} {'seconds':>10} "
+                          f"{'simulations':>11}"]
+                ranked = sorted(self.decisions.items(), key=lambda item: item[1][1], reverse=True)
+                for name, (count, seconds, misses) in ranked[:top]:
+                    lines.append(f"  {name:<24} {count:>11} {seconds:>10.4f} {misses:>11}")
+        return "\n".join(lines)
+
+
+def profile_phase(profile, name):
+    # profile.phase(name), or a no-op context when profiling is disabled
+    return nullcontext() if profile is None else profile.phase(name)
@@ -0,0 +1,195 @@
+import argparse
+import random
+import sys
+
+# Kinds of generated lines: only statement lines (inside method bodies or at the top level) are mutated
+# when generating broken programs, so that every injected error is reported in the intended phase.
+STATEMENT = "statement"
+OTHER = "other"
+
+ERROR_KINDS = ("lexical", "syntax", "semantic")
+
+
+class ProgramGenerator:
+    """
+    Generates synthetic programs for Language.g4, used by the benchmarks.
+    A program is a sequence of units, each made of a top-level class (with fields, methods, a nested class
+    hierarchy, deep expressions and long for/while/if chains) followed by a few top-level statements,
+    and ends with a main method. Units are added until the requested number of lines is reached.
+    Valid programs are free of lexical, syntax and semantic errors; broken programs have errors of every
+    phase injected into a fraction of their statements. The output only depends on the seed and the options.
+    """
+
+    def __init__(self, seed=0, methods_per_class=6, nesting=2, expr_depth=12, chain_length=6):
+        self.random = random.Random(seed)
+        self.methods_per_class = methods_per_class
+        self.nesting = nesting
+        self.expr_depth = expr_depth
+        self.chain_length = chain_length
+        self.lines = []  # (indentation level, text, kind)
+
+    def emit(self, level, text, kind=OTHER):
+        self.lines.append((level, text, kind))
+
+    def generate(self, target_lines, broken=False, error_rate=0.05):
+        """
+        Returns the source of a program of about `target_lines` lines (a few more, never less).
+        When `broken` is set, about `error_rate` of the statements get a lexical, syntax or semantic error.
+        """
+        self.lines = []
+        unit = 0
+        while len(self.lines) < target_lines:
+            self.unit(unit)
+            unit += 1
+        self.main_method(unit)
+        lines = self.lines
+        if broken:
+            lines = self.inject_errors(lines, error_rate)
+        return "".join("    " * level + text + "\n" for level, text, _ in lines)
+
+    def unit(self, n):
+        class_name = f"Unit{n}"
+        self.emit(0, f"// Unit {n}")
+        self.class_declaration(0, class_name, self.nesting)
+        self.emit(0, f"{class_name} unit{n} = new {class_name}();", STATEMENT)
+        self.emit(0, f"int total{n} = {n} * 3 + {self.random.randint(0, 99)};", STATEMENT)
+        self.emit(0, f"for (int k = 0; k < {self.random.randint(2, 9)}; k++) {{")
+        self.emit(1, f"total{n} += k;", STATEMENT)
+        self.emit(0, "}")
+        self.emit(0, f"System.out.println(\"total: \" + total{n});", STATEMENT)
+        self.emit(0, "")
+
+    def class_declaration(self, level, class_name, nesting):
+        visibility = "public " if level == 0 else ""
+        self.emit(level, f"{visibility}class {class_name} {{")
+        body = level + 1
+        self.emit(body, f"int count = {self.random.randint(0, 9)};")
+        self.emit(body, f"float ratio = {self.random.randint(1, 9)}.5;")
+        self.emit(body, f"String label = \"{class_name}\";")
+        self.emit(body, "boolean active = true;")
+        self.emit(body, "")
+        methods = self.methods_per_class if level == 0 else max(1, self.methods_per_class // 3)
+        for index in range(methods):
+            self.method(body, index)
+        if nesting > 0:
+            self.class_declaration(body, f"{class_name}Inner", nesting - 1)
+        self.emit(level, "}")
+        self.emit(level, "")
+
+    def method(self, level, index):
+        # Methods may only call the methods declared before them in the same class
+        body = level + 1
+        shape = index % 3
+        self.emit(level, f"public int compute{index}(int a, int b) {{")
+        self.emit(body, f"int result = {self.chain('a', 'b')};", STATEMENT)
+        if shape == 0:
+            self.emit(body, f"int deep = {self.deep_expression('a', self.expr_depth)};", STATEMENT)
+            self.emit(body, "result += deep;", STATEMENT)
+        elif shape == 1:
+            self.loop_chain(body)
+        else:
+            self.if_chain(body, self.chain_length)
+        if index > 0:
+            self.emit(body, f"result += compute{index - 1}(a, {self.random.randint(1, 9)});", STATEMENT)
+        self.emit(body, "count++;", STATEMENT)
+        self.emit(body, "System.out.println(label + \": \" + result);", STATEMENT)
+        self.emit(body, "return result;", STATEMENT)
+        self.emit(level, "}")
+        self.emit(level, "")
+
+    def chain(self, left, right):
+        # A flat binary expression of `chain_length` operations
+        operands = [left, right, "count", str(self.random.randint(1, 99))]
+        parts = [self.random.choice(operands)]
+        for _ in range(self.chain_length):
+            parts.append(self.random.choice(("+", "-", "*")))
+            parts.append(self.random.choice(operands))
+        return " ".join(parts)
+
+    def deep_expression(self, name, depth):
+        # A parenthesized expression nested `depth` levels deep, e.g. (((a + 1) * 2) - 3)
+        expression = name
+        for level in range(depth):
+            expression = f"({expression} {self.random.choice(('+', '-', '*', '%'))} {level + 1})"
+        return expression
+
+    def loop_chain(self, level):
+        for index in range(self.chain_length):
+            if index % 2 == 0:
+                self.emit(level, f"for (int i = 0; i < {self.random.randint(2, 50)}; i++) {{")
+                self.emit(level + 1, "result += i * a;", STATEMENT)
+            else:
+                self.emit(level, f"while (result > {self.random.randint(100, 999)}) {{")
+                self.emit(level + 1, f"result -= {self.random.randint(1, 9)} + b;", STATEMENT)
+            self.emit(level, "}")
+
+    def if_chain(self, level, length):
+        # if / else if / ... / else, written as nested blocks since the grammar has no `else if`
+        for depth in range(length):
+            self.emit(level + depth, f"if (result {self.random.choice(('<', '>', '==', '!='))} {depth * 10}) {{")
+            self.emit(level + depth + 1, f"result = result + {depth + 1};", STATEMENT)
+            self.emit(level + depth, "} else {")
+        self.emit(level + length, "result = 0;", STATEMENT)
+        for depth in reversed(range(length)):
+            self.emit(level + depth, "}")
+
+    def main_method(self, units):
+        self.emit(0, "public static void main(String[] args) {")
+        self.emit(1, f"int units = {units};", STATEMENT)
+        self.emit(1, "while (units > 0) {")
+        self.emit(2, "units--;", STATEMENT)
+        self.emit(1, "}")
+        self.emit(1, "System.out.println(\"done\");", STATEMENT)
+        self.emit(0, "}")
+
+    def inject_errors(self, lines, error_rate):
+        result = []
+        errors = 0
+        for level, text, kind in lines:
+            if kind != STATEMENT or self.random.random() >= error_rate:
+                result.append((level, text, kind))
+                continue
+            error_kind = ERROR_KINDS[errors % len(ERROR_KINDS)]
+            if error_kind == "lexical":
+                result.append((level, text[:-1] + " @;", kind))
+            elif error_kind == "syntax":
+                result.append((level, text[:-1], kind))
+            else:
+                result.append((level, text, kind))
+                result.append((level, f"undeclared{errors} = \"text\";", kind))
+            errors += 1
+        return result
+
+
+def generate_program(lines, seed=0, broken=False, error_rate=0.05, **options):
+    # Shortcut for ProgramGenerator(seed, **options).generate(lines, broken, error_rate)
+    return ProgramGenerator(seed, **options).generate(lines, broken, error_rate)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Generate a synthetic program for Language.g4.")
+    arg_parser.add_argument("-n", "--lines", type=int, default=1000, help="approximate number of lines (default: 1000)")
+    arg_parser.add_argument("-s", "--seed", type=int, default=0, help="random seed (default: 0)")
+    arg_parser.add_argument("--broken", action="store_true", help="inject lexical, syntax and semantic errors")
+    arg_parser.add_argument("--error-rate", type=float, default=0.05,
+                            help="fraction of the statements that get an error in broken programs (default: 0.05)")
+    arg_parser.add_argument("--methods", type=int, default=6, help="methods per top-level class (default: 6)")
+    arg_parser.add_argument("--nesting", type=int, default=2, help="depth of the nested classes (default: 2)")
+    arg_parser.add_argument("--expr-depth", type=int, default=12,
+                            help="nesting depth of the parenthesized expressions (default: 12)")
+    arg_parser.add_argument("--chain-length", type=int, default=6,
+                            help="length of the operator, loop and if chains (default: 6)")
+    arg_parser.add_argument("-o", "--output", help="write the program to this file instead of stdout")
+    args = arg_parser.parse_args(argv)
+
+    source = generate_program(args.lines, args.seed, args.broken, args.error_rate, methods_per_class=args.methods,
+                              nesting=args.nesting, expr_depth=args.expr_depth, chain_length=args.chain_length)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            output.write(source)
+    else:
+        sys.stdout.write(source)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+import argparse
+import hashlib
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import time
+
+from diagnostics import Diagnostic, sort_diagnostics
+from result_cache import analyzer_fingerprint
+from syntax_tree import ClassDeclaration, MethodCall, MethodDeclaration, VariableDeclaration, walk
+
+INDEX_FORMAT = 1
+# A file modified less than this long before it was read may be modified again within the resolution of its
+# modification time: its time is not recorded, so the next update compares its text instead
+RACY_NANOSECONDS = 2 * 10 ** 9
+DEFAULT_PROJECT_INDEX_DIR = os.path.join(os.path.expanduser("~"), ".cache", "bugbuster", "projects")
+
+# Attributes of the syntax tree nodes holding names a file may use a class under
+NAME_ATTRIBUTES = ("name", "data_type", "return_type")
+
+
+def default_index_path(paths, pattern):
+    # Index of the project made of the files matching `pattern` under the given paths, in DEFAULT_PROJECT_INDEX_DIR
+    key = "\0".join(sorted(os.path.abspath(path) for path in paths) + [pattern])
+    return os.path.join(DEFAULT_PROJECT_INDEX_DIR, hashlib.sha256(key.encode("utf-8")).hexdigest()[:32] + ".pickle")
+
+
+def source_digest(source):
+    return hashlib.blake2b(source.encode("utf-8", "surrogatepass"), digest_size=20).digest()
+
+
+def declared_classes(tree):
+    """
+    The interface of the classes a file declares at its top level, the part of the file the other files of the
+    project depend on: class name -> (sorted method names, sorted (field name, field type) pairs).
+    A class declared twice in the file keeps its first declaration, as in the semantic analysis.
+    """
+    classes = {}
+    for statement in tree.statements:
+        if type(statement) is not ClassDeclaration or statement.name is None or statement.name in classes:
+            continue
+        members = statement.members
+        methods = {member.name for member in members if type(member) is MethodDeclaration and member.name is not None}
+        fields = {(member.name, member.data_type) for member in members
+                  if type(member) is VariableDeclaration and member.name is not None}
+        classes[statement.name] = (tuple(sorted(methods)), tuple(sorted(fields, key=str)))
+    return classes
+
+
+def referenced_names(tree):
+    # Every name appearing in a file (variables, types, called methods, ...): the diagnostics of the file can only
+    # depend on the classes of the other files named here
+    names = set()
+    for node in walk(tree):
+        if type(node) is MethodCall:
+            names.update(node.path)
+            continue
+        for attribute in NAME_ATTRIBUTES:
+            name = getattr(node, attribute, None)
+            if name is not None:
+                names.add(name)
+    return frozenset(names)
+
+
+class FileEntry:
+    # What the index keeps of a file: its modification time and size (None for a text not read from disk),
+    # the digest of its text, its number of lines, the interface of its classes (see declared_classes),
+    # the names it references and the records of its diagnostics (see Diagnostic.key).
+    __slots__ = ("mtime", "size", "digest", "line_count", "classes", "references", "records")
+
+    def __init__(self, mtime, size, digest, line_count, classes, references, records=()):
+        self.mtime = mtime
+        self.size = size
+        self.digest = digest
+        self.line_count = line_count
+        self.classes = classes
+        self.references = references
+        self.records = records
+
+    def to_tuple(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+
+class ProjectAnalyzer:
+    """
+    Analyzes the files of a project together: the classes declared at the top level of a file, with their
+    methods, are known in all the other files, so that they can be used as data types, created and called
+    (`Helper helper = new Helper(); helper.compute();`) without being reported as undeclared.
+    The index (see FileEntry) records, for every file, the interface of its classes, the names it references
+    and its diagnostics, and is saved to `index_path` after every update, so a later run starts from it.
+    update() only parses the files whose text changed, then analyzes them again together with the files
+    referencing a class whose interface changed (one that was added, removed or got other methods or fields);
+    the diagnostics of every other file are taken from the index. A file is only read when its modification
+    time or size changed, so an update after editing one file of a large project costs a stat() per file
+    and the analysis of the edited file and its dependents.
+    The index is dropped when the analyzer changes (see result_cache.analyzer_fingerprint).
+    With `max_diagnostics` or `time_limit`, every file is parsed and analyzed within an AnalysisBudget of its own
+    (see code_analyzer.py); a file cut short is recorded without its digest, so it is parsed again by the next
+    update instead of keeping its partial results.
+    """
+
+    def __init__(self, index_path=None, disabled_rules=(), two_stage=True, fast_lexer=False, token_store=False,
+                 max_diagnostics=None, time_limit=None):
+        self.index_path = index_path
+        self.disabled_rules = tuple(disabled_rules)
+        self.two_stage = two_stage
+        self.fast_lexer = fast_lexer
+        self.token_store = token_store
+        self.max_diagnostics = max_diagnostics
+        self.time_limit = time_limit
+        self.fingerprint = analyzer_fingerprint(disabled_rules)
+        self.files = {}  # path -> FileEntry
+        self.referrers = {}  # name -> paths of the files referencing it
+        self.class_files = {}  # class name -> paths of the files declaring it
+        self.parsed = 0  # Files parsed by the last update
+        self.analyzed = []  # Paths of the files analyzed by the last update
+        if index_path is not None:
+            self.load()
+
+    def load(self):
+        # Reads the index saved by a previous run; a missing, unreadable or outdated index is ignored
+        try:
+            with open(self.index_path, "rb") as index_file:
+                index_format, fingerprint, files = pickle.load(index_file)
+            if index_format != INDEX_FORMAT or fingerprint != self.fingerprint:
+                return
+            entries = {path: FileEntry(*entry) for path, entry in files.items()}
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError, TypeError):
+            return
+        for path, entry in entries.items():
+            self.add(path, entry)
+
+    def save(self):
+        # Writes the index atomically (temporary file + rename); returns False when it cannot be written
+        if self.index_path is None:
+            return False
+        directory = os.path.dirname(os.path.abspath(self.index_path))
+        files = {path: entry.to_tuple() for path, entry in self.files.items()}
+        try:
+            os.makedirs(directory, exist_ok=True)
+            descriptor, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        except OSError:
+            return False
+        try:
+            with os.fdopen(descriptor, "wb") as index_file:
+                pickle.dump((INDEX_FORMAT, self.fingerprint, files), index_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self.index_path)
+        except OSError:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            return False
+        return True
+
+    def add(self, path, entry):
+        self.files[path] = entry
+        for name in entry.references:
+            self.referrers.setdefault(name, set()).add(path)
+        for name in entry.classes:
+            self.class_files.setdefault(name, set()).add(path)
+
+    def remove(self, path):
+        entry = self.files.pop(path)
+        for mapping, names in ((self.referrers, entry.references), (self.class_files, entry.classes)):
+            for name in names:
+                paths = mapping[name]
+                paths.discard(path)
+                if not paths:
+                    del mapping[name]
+        return entry
+
+    def update(self, paths, sources=None):
+        """
+        Brings the index up to date with the files of the project, `paths` (a file of the index missing from
+        them was deleted), and saves it. `sources` optionally maps some paths to their current text, e.g. the
+        unsaved buffers of an editor, which is then used instead of the file. Returns the paths of the files
+        analyzed again.
+        """
+        from code_analyzer import analysis_budget, parse_syntax_tree
+        from source_files import read_source
+
+        def parse(source):
+            # (syntax tree, lexical and syntax errors, budget of the analysis of the file)
+            budget = analysis_budget(self.max_diagnostics, self.time_limit)
+            if budget is not None:
+                budget.start()
+            tree, lexer_errors, parser_errors = parse_syntax_tree(source, two_stage=self.two_stage,
+                                                                  fast_lexer=self.fast_lexer,
+                                                                  token_store=self.token_store, budget=budget)
+            if budget is not None:
+                budget.pause()
+            return tree, lexer_errors + parser_errors, budget
+
+        sources = sources or {}
+        paths = list(dict.fromkeys(paths))
+        racy_after = time.time_ns() - RACY_NANOSECONDS
+        parsed = {}  # path -> result of parse() of the files whose text changed
+        changed_names = set()
+        for path in paths:
+            entry = self.files.get(path)
+            source = sources.get(path)
+            mtime = size = None
+            if source is None:
+                stat = os.stat(path)
+                mtime, size = stat.st_mtime_ns, stat.st_size
+                if entry is not None and entry.mtime == mtime and entry.size == size:
+                    continue
+                source = read_source(path)
+                if mtime > racy_after:
+                    mtime = None
+            digest = source_digest(source)
+            if entry is not None and entry.digest == digest:
+                entry.mtime, entry.size = mtime, size
+                continue
+            parsed[path] = parse(source)
+            tree = parsed[path][0]
+            new_entry = FileEntry(mtime, size, digest, source.count("\n") + 1, declared_classes(tree),
+                                  referenced_names(tree))
+            old_classes = self.remove(path).classes if entry is not None else {}
+            changed_names.update(name for name in old_classes.keys() | new_entry.classes.keys()
+                                 if old_classes.get(name) != new_entry.classes.get(name))
+            self.add(path, new_entry)
+
+        for path in set(self.files) - set(paths):
+            changed_names.update(self.remove(path).classes)
+
+        dirty = set(parsed)
+        for name in changed_names:
+            dirty.update(self.referrers.get(name, ()))
+        self.parsed = len(parsed)
+        self.analyzed = [path for path in paths if path in dirty]
+        for path in self.analyzed:
+            if path in parsed:
+                tree, errors, budget = parsed.pop(path)
+            else:
+                source = sources.get(path)
+                tree, errors, budget = parse(read_source(path) if source is None else source)
+            entry = self.files[path]
+            errors = sort_diagnostics(errors + self.analyze_tree(path, tree, budget))
+            entry.records = tuple(error.key() for error in errors)
+            if budget is not None and budget.truncated:
+                entry.mtime = entry.digest = None
+        self.save()
+        return self.analyzed
+
+    def context(self, path):
+        """
+        Arguments of SemanticAnalyzer.preload for a file: the classes of the other files of the project that the
+        file references, declared as global classes with their methods. Its own classes are left out, so that
+        they are analyzed as declared by the file. When several other files declare a class, its methods are
+        those of all of them.
+        """
+        entry = self.files[path]
+        global_symbols = {}
+        class_methods = {}
+        for name in entry.references:
+            declaring = self.class_files.get(name)
+            if not declaring or name in entry.classes:
+                continue
+            methods = set()
+            for declaring_path in declaring:
+                methods.update(self.files[declaring_path].classes[name][0])
+            global_symbols[name] = "class"
+            class_methods[name] = methods
+        return global_symbols, set(global_symbols), class_methods
+
+    def analyze_tree(self, path, tree, budget=None):
+        # The semantic errors of a file of the project, followed by the markers of the budget of its analysis
+        from semantic_analyzer import SemanticAnalyzer
+
+        semantic_analyzer = SemanticAnalyzer(self.disabled_rules)
+        semantic_analyzer.preload(*self.context(path))
+        if budget is None:
+            semantic_analyzer.visit(tree)
+            return semantic_analyzer.errors
+        budget.resume()
+        budget.visit(semantic_analyzer, tree.statements)
+        return semantic_analyzer.errors + budget.markers()
+
+    def diagnostics(self, path):
+        # The diagnostics of a file of the project, as of the last update
+        return [Diagnostic(*record) for record in self.files[path].records]
+
+    def results(self, paths):
+        # (path, line count, diagnostics, None) of every file, as batch_checker.run_checks yields them
+        for path in paths:
+            yield path, self.files[path].line_count, self.diagnostics(path), None
+
+    def stats(self):
+        return (f"{len(self.files)} files indexed, {self.parsed} parsed and {len(self.analyzed)} analyzed "
+                f"by the last update")
+
+
+def module_source(index, count, extra_method=False, constant=0):
+    # A file of the generated project of main(): class Module<index> uses two other modules,
+    # as a field type, in an object creation and through method calls
+    first, second = (index + 1) % count, (index * 31 + 7) % count
+    lines = [
+        f"public class Module{index} {{",
+        f"    int count = {index + constant};",
+        f"    Module{first} next = new Module{first}();",
+        "",
+        "    public int value() {",
+        "        return count;",
+        "    }",
+        "",
+        "    public int compute(int a) {",
+        f"        Module{second} other = new Module{second}();",
+        "        int result = a + next.value();",
+        "        result += other.value() * 2;",
+        "        return result;",
+        "    }",
+    ]
+    if extra_method:
+        lines += ["", "    public int twice() {", "        return count * 2;", "    }"]
+    return "\n".join(lines + ["}", ""])
+
+
+def main(argv=None):
+    # Measures the project mode on a generated project of interdependent files: the initial build of the index,
+    # then an update with nothing changed, after editing a method body, after adding a method and after removing
+    # a method other files call, which must be reported in the files calling it. The final index is compared with
+    # one built from scratch. Exits with status 1 when an update analyzes other files than the edited file and its
+    # dependents, or on any mismatch.
+    arg_parser = argparse.ArgumentParser(description="Measure the project mode on a generated project.")
+    arg_parser.add_argument("-n", "--files", type=int, default=5000,
+                            help="number of files of the generated project (default: 5000)")
+    arg_parser.add_argument("--keep", metavar="DIR",
+                            help="generate the project in this directory and keep it (default: a temporary one)")
+    args = arg_parser.parse_args(argv)
+    count = max(2, args.files)
+
+    directory = args.keep or tempfile.mkdtemp(prefix="bugbuster-project-")
+    os.makedirs(directory, exist_ok=True)
+    index_path = os.path.join(directory, "project-index.pickle")
+    paths = [os.path.join(directory, f"Module{index}.java") for index in range(count)]
+
+    def write(index, **options):
+        with open(paths[index], "w", encoding="utf-8") as source_file:
+            source_file.write(module_source(index, count, **options))
+
+    def run(label, expected_analyzed):
+        start = time.perf_counter()
+        project = ProjectAnalyzer(index_path)
+        analyzed = project.update(paths)
+        print(f"{label}: {time.perf_counter() - start:.2f}s, {len(analyzed)} of {count} files analyzed")
+        if len(analyzed) != expected_analyzed:
+            print(f"MISMATCH: {expected_analyzed} files should have been analyzed.")
+            return None
+        return project
+
+    try:
+        for index in range(count):
+            write(index)
+        if run("Initial build", count) is None or run("No change", 0) is None:
+            return 1
+        edited = count // 2
+        write(edited, constant=1)
+        if run("Method body edited", 1) is None:
+            return 1
+        write(edited, constant=1, extra_method=True)
+        dependents = {index for index in range(count)
+                      if edited in ((index + 1) % count, (index * 31 + 7) % count)} - {edited}
+        if run("Method added", len(dependents) + 1) is None:
+            return 1
+        with open(paths[edited], "w", encoding="utf-8") as source_file:
+            source_file.write(module_source(edited, count).replace("value()", "amount()", 1))
+        project = run("Method removed", len(dependents) + 1)
+        if project is None:
+            return 1
+        reported = {path for path in paths for diagnostic in project.diagnostics(path)
+                    if diagnostic.code == "undeclared-method"}
+        if reported != {paths[index] for index in dependents}:
+            print("MISMATCH: the calls to the removed method are not reported in every dependent file.")
+            return 1
+        print(f"Calls to the removed method reported in the {len(reported)} dependent files.")
+        start = time.perf_counter()
+        reference = ProjectAnalyzer()
+        reference.update(paths)
+        print(f"Full rebuild: {time.perf_counter() - start:.2f}s")
+        if any(project.diagnostics(path) != reference.diagnostics(path) for path in paths):
+            print("MISMATCH: the updated index and a full rebuild report different diagnostics.")
+            return 1
+        print("The updated index matches a full rebuild.")
+        return 0
+    finally:
+        if not args.keep:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+import hashlib
+import os
+import pickle
+import tempfile
+
+from diagnostics import Diagnostic
+
+ENTRY_FORMAT = 1
+DEFAULT_RESULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "bugbuster", "results")
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+ENTRY_SUFFIX = ".pickle"
+
+
+def analyzer_fingerprint(disabled_rules=()):
+    # Identifies everything the diagnostics of a source depend on besides the source itself:
+    # the generated lexer and parser (i.e. Language.g4), the version of the semantic analysis and the rules
+    # of rule_engine.py left out of it.
+    # They are imported here rather than at module level, so that the cache constants can be imported cheaply.
+    from dfa_cache import recognizer_fingerprint
+    from generated.LanguageLexer import LanguageLexer
+    from generated.LanguageParser import LanguageParser
+    from semantic_analyzer import SemanticAnalyzer
+    parts = (recognizer_fingerprint(LanguageLexer), recognizer_fingerprint(LanguageParser),
+             str(SemanticAnalyzer.VERSION), str(ENTRY_FORMAT), ",".join(sorted(set(disabled_rules))))
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).digest()
+
+
+class ResultCache:
+    """
+    Persistent, content-addressed cache of analysis results.
+    The key of a source is the hash of its text combined with the analyzer fingerprint, so an entry never
+    has to be invalidated: a changed file, grammar, semantic analyzer or set of disabled rules simply
+    produces another key.
+    Every entry is a small file holding the diagnostics of one source. Entries are written atomically
+    (temporary file + rename) and unreadable entries count as misses, so several processes can share
+    the cache directory. Reading an entry refreshes its modification time, which prune() uses to evict
+    the least recently used entries once the cache grows beyond `max_bytes`.
+    """
+
+    def __init__(self, directory=DEFAULT_RESULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, disabled_rules=()):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.fingerprint = analyzer_fingerprint(disabled_rules)
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    def key(self, source):
+        # `source` is the text of a file or its raw bytes (decoded as UTF-8)
+        if isinstance(source, str):
+            source = source.encode("utf-8", "surrogatepass")
+        digest = hashlib.blake2b(self.fingerprint, digest_size=20)
+        digest.update(source)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + ENTRY_SUFFIX)
+
+    def get(self, key):
+        """
+        Returns the cached diagnostics for `key`, or None on a miss.
+        """
+        path = self.path(key)
+        try:
+            with open(path, "rb") as entry_file:
+                entry_format, records = pickle.load(entry_file)
+            if entry_format != ENTRY_FORMAT:
+                raise ValueError("unknown entry format")
+            diagnostics = [Diagnostic(*record) for record in records]
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError, TypeError):
+            # Corrupted entry: drop it, it will be written again
+            self.misses += 1
+            self.remove(path)
+            return None
+        try:
+            os.utime(path)  # Mark as recently used
+        except OSError:
+            pass
+        self.hits += 1
+        return diagnostics
+
+    def put(self, key, diagnostics):
+        records = [(d.phase, d.code, d.line, d.column, d.end_line, d.end_column, d.severity, d.args)
+                   for d in diagnostics]
+        path = self.path(key)
+        directory = os.path.dirname(path)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            descriptor, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        except OSError:
+            return False
+        try:
+            with os.fdopen(descriptor, "wb") as entry_file:
+                pickle.dump((ENTRY_FORMAT, records), entry_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+        except OSError:
+            self.remove(temp_path)
+            return False
+        self.writes += 1
+        return True
+
+    @staticmethod
+    def remove(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def entries(self):
+        # (modification time, size, path) of every entry in the cache directory
+        entries = []
+        try:
+            subdirectories = os.scandir(self.directory)
+        except OSError:
+            return entries
+        with subdirectories:
+            for subdirectory in subdirectories:
+                if not subdirectory.is_dir():
+                    continue
+                try:
+                    with os.scandir(subdirectory.path) as files:
+                        for entry in files:
+                            if entry.name.endswith(ENTRY_SUFFIX):
+                                try:
+                                    stat = entry.stat()
+                                except OSError:
+                                    continue
+                                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                except OSError:
+                    continue
+        return entries
+
+    def prune(self):
+        """
+        Evicts the least recently used entries until the cache fits in `max_bytes`.
+        Returns the number of evicted entries.
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        if total > self.max_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                self.remove(path)
+                total -= size
+                evicted += 1
+        self.evictions += evicted
+        return evicted
+
+    def clear(self):
+        for _, _, path in self.entries():
+            self.remove(path)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups if lookups else 0.0
+        return (f"{self.hits} hits, {self.misses} misses ({rate:.1%} hit rate), "
+                f"{self.writes} entries written, {self.evictions} evicted")
@@ -0,0 +1,173 @@
+from diagnostics import SEMANTIC, WARNING, Diagnostic
+from symbol_table import CLASS_SCOPE, GLOBAL_SCOPE
+from syntax_tree import ReturnStatement, VariableDeclaration, node_classes
+
+# Registered rules, by code (see register)
+RULES = {}
+
+
+def register(rule_class):
+    """
+    Class decorator adding a rule to RULES, under its code. Rules subscribe to the kinds of nodes they check
+    through the names of their handlers: enterVariableDeclaration(node) is called for every variable declaration
+    before the analyzer's own handler, leaveBlock(node) for every block after the analyzer has left it.
+    A handler naming no node class is reported here rather than silently never called.
+    """
+    classes = node_classes()
+    for name in dir(rule_class):
+        for prefix in ("enter", "leave"):
+            if name.startswith(prefix) and name[len(prefix):] not in classes:
+                raise ValueError(f"{rule_class.__name__}.{name} does not handle a syntax tree node")
+    if rule_class.code in RULES:
+        raise ValueError(f"Rule '{rule_class.code}' already registered")
+    RULES[rule_class.code] = rule_class
+    return rule_class
+
+
+def check_rule_codes(codes):
+    # Raises ValueError for an unknown rule code (e.g. a misspelled --disable-rule)
+    unknown = sorted(set(codes) - set(RULES))
+    if unknown:
+        raise ValueError(f"Unknown rule(s): {', '.join(unknown)} (available: {', '.join(sorted(RULES))})")
+
+
+class Rule:
+    """
+    Base class of the optional semantic checks run by the RuleEngine.
+    A rule reads the state of the analyzer running it (its symbol table, its current class, ...) and reports
+    warnings with its own code, a key of diagnostics.MESSAGES. A rule instance lives for a single analysis,
+    so it may keep state from one node to the next.
+    """
+
+    code = None
+
+    def __init__(self, analyzer):
+        self.analyzer = analyzer
+
+    def report(self, node, *args):
+        self.analyzer.errors.append(Diagnostic.at_node(SEMANTIC, self.code, node, *args, severity=WARNING))
+
+
+class RuleEngine:
+    """
+    Runs the enabled rules during the single walk of the semantic analyzer (see SemanticAnalyzer.handler_table).
+    The handlers of every rule are looked up once, into `handlers`: node class -> (enter handlers, leave handlers),
+    which the analyzer merges into its own table, so the number of rules adds no lookup per node, and the kinds
+    of nodes no rule subscribes to cost nothing.
+    """
+
+    def __init__(self, analyzer, disabled_rules=()):
+        check_rule_codes(disabled_rules)
+        self.rules = [rule_class(analyzer) for code, rule_class in RULES.items() if code not in disabled_rules]
+        self.handlers = {}
+        for name, cls in node_classes().items():
+            enter = tuple(getattr(rule, "enter" + name) for rule in self.rules if hasattr(rule, "enter" + name))
+            leave = tuple(getattr(rule, "leave" + name) for rule in self.rules if hasattr(rule, "leave" + name))
+            if enter or leave:
+                self.handlers[cls] = (enter, leave)
+
+
+def is_local(analyzer):
+    # Whether a variable declared now is a local variable (neither a global nor a field)
+    return analyzer.symbols.current_scope_kind() not in (GLOBAL_SCOPE, CLASS_SCOPE)
+
+
+@register
+class UnusedVariableRule(Rule):
+    # A local variable that no expression reads. Uses are resolved through the symbol table of the analyzer:
+    # a declaration is identified by its name and the depth of its scope, and reported when its scope ends.
+    # Parameters, fields and globals are not checked.
+    code = "unused-variable"
+
+    def __init__(self, analyzer):
+        super().__init__(analyzer)
+        self.declarations = {}  # (name, depth) -> [declaration node, used]
+        self.open = []  # Keys of `declarations` in declaration order, hence by depth (innermost scope last)
+
+    def enterVariableDeclaration(self, node):
+        symbols = self.analyzer.symbols
+        # A redeclaration is reported by the analyzer and declares nothing
+        if node.name is not None and is_local(self.analyzer) and not symbols.is_redeclaration(node.name):
+            key = (node.name, symbols.depth)
+            self.declarations[key] = [node, False]
+            self.open.append(key)
+
+    def use(self, name):
+        declarations = self.analyzer.symbols.index.get(name)
+        if declarations:
+            entry = self.declarations.get((name, declarations[-1][0]))
+            if entry is not None:
+                entry[1] = True
+
+    def enterName(self, node):
+        self.use(node.name)
+
+    def enterCompoundAssignment(self, node):
+        self.use(node.name)
+
+    def enterIncrement(self, node):
+        self.use(node.name)
+
+    def enterMethodCall(self, node):
+        if len(node.path) > 1:
+            self.use(node.path[0])  # variable.method()
+
+    def end_scopes(self, node):
+        # Reports the unused variables of the scopes the analyzer just left
+        depth = self.analyzer.symbols.depth
+        first = len(self.open)
+        while first and self.open[first - 1][1] > depth:
+            first -= 1
+        for key in self.open[first:]:
+            declaration, used = self.declarations.pop(key)
+            if not used:
+                self.report(declaration, declaration.name)
+        del self.open[first:]
+
+    leaveBlock = leaveForLoop = leaveWhileLoop = leaveMethodDeclaration = leaveMainMethodDeclaration = end_scopes
+
+
+@register
+class UnreachableCodeRule(Rule):
+    # A statement of a block following a statement that always returns: a return statement, a block ending with
+    # one, or an if statement whose two branches return. Reported once per block, at the first such statement.
+    code = "unreachable-code"
+
+    def __init__(self, analyzer):
+        super().__init__(analyzer)
+        self.returning = set()  # Blocks and if statements that always return, found bottom-up
+
+    def leaveBlock(self, node):
+        statements = node.statements
+        for index, statement in enumerate(statements):
+            if type(statement) is ReturnStatement or statement in self.returning:
+                if index + 1 < len(statements):
+                    self.report(statements[index + 1])
+                self.returning.add(node)
+                break
+
+    def leaveIfStatement(self, node):
+        if node.body in self.returning and node.else_body in self.returning:
+            self.returning.add(node)
+
+
+@register
+class ShadowedFieldRule(Rule):
+    # A local variable declared in a method with the name of a field of its class. Parameters are not checked:
+    # constructors and setters conventionally name them after the fields they set.
+    code = "shadowed-field"
+
+    def __init__(self, analyzer):
+        super().__init__(analyzer)
+        self.fields = []  # Field names of the enclosing classes, innermost last
+
+    def enterClassDeclaration(self, node):
+        self.fields.append({member.name for member in node.members
+                            if type(member) is VariableDeclaration and member.name is not None})
+
+    def leaveClassDeclaration(self, node):
+        self.fields.pop()
+
+    def enterVariableDeclaration(self, node):
+        if self.fields and node.name in self.fields[-1] and is_local(self.analyzer):
+            self.report(node, node.name, self.analyzer.current_class)
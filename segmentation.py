@@ -0,0 +1,109 @@
+import re
+
+# Only the characters that matter for finding statement boundaries are matched;
+# string literals and comments are matched as a whole so that braces and semicolons inside them are ignored.
+BOUNDARY_PATTERN = re.compile(r'"[^"\\]*"|//[^\r\n]*|[{}();]|\bclass\b')
+ELSE_PATTERN = re.compile(r'(?:\s|//[^\r\n]*)*else\b')
+
+STATEMENT = "statement"
+CLASS_HEADER = "class_header"
+MEMBER = "member"
+CLASS_END = "class_end"
+
+
+class Segment:
+    """
+    A slice of the source code that can be lexed and parsed on its own.
+    `kind` is one of STATEMENT (top-level statements), CLASS_HEADER (a top-level class up to its opening brace),
+    MEMBER (members of a top-level class) or CLASS_END (the closing brace of a top-level class).
+    Lines are 1-based and columns 0-based, like the positions of ANTLR tokens.
+    """
+
+    def __init__(self, kind, start, end, line, column):
+        self.kind = kind
+        self.start = start
+        self.end = end
+        self.line = line
+        self.column = column
+        self.end_line = line
+        self.end_column = column
+
+
+class UnbalancedSource(Exception):
+    # Raised when the braces of the source do not match, so it cannot be split reliably.
+    pass
+
+
+def split_segments(source):
+    """
+    Splits the source at top-level statement boundaries and, inside top-level classes, at member boundaries.
+    A boundary is a ';' or a closing '}' at the right brace depth (outside parentheses, string literals
+    and comments); a '}' followed by 'else' does not end an if statement.
+    The segments cover the whole source without gaps.
+    Raises UnbalancedSource when the braces do not match.
+    """
+    boundaries = []  # (position, kind of the segment ending there)
+    depth = 0
+    parens = 0
+    class_pending = False  # 'class' seen in the current top-level statement
+    in_class = False
+    for match in BOUNDARY_PATTERN.finditer(source):
+        char = match.group()
+        if char == "class":
+            if depth == 0:
+                class_pending = True
+        elif char == "(":
+            parens += 1
+        elif char == ")":
+            parens = max(parens - 1, 0)
+        elif char == "{":
+            if depth == 0 and class_pending and parens == 0:
+                boundaries.append((match.end(), CLASS_HEADER))
+                in_class = True
+                class_pending = False
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            parens = 0
+            if depth < 0:
+                raise UnbalancedSource()
+            if depth == 0:
+                if in_class:
+                    boundaries.append((match.start(), MEMBER))
+                    boundaries.append((match.end(), CLASS_END))
+                    in_class = False
+                elif not ELSE_PATTERN.match(source, match.end()):
+                    boundaries.append((match.end(), STATEMENT))
+                    class_pending = False
+            elif depth == 1 and in_class:
+                boundaries.append((match.end(), MEMBER))
+        elif char == ";" and parens == 0:
+            if depth == 0:
+                boundaries.append((match.end(), STATEMENT))
+                class_pending = False
+            elif depth == 1 and in_class:
+                boundaries.append((match.end(), MEMBER))
+    if depth != 0:
+        raise UnbalancedSource()
+    if not boundaries or boundaries[-1][0] < len(source):
+        boundaries.append((len(source), STATEMENT))
+
+    segments = []
+    start = 0
+    line = 1
+    column = 0
+    for end, kind in boundaries:
+        if end == start:
+            continue
+        segment = Segment(kind, start, end, line, column)
+        newlines = source.count("\n", start, end)
+        if newlines:
+            line += newlines
+            column = end - source.rfind("\n", start, end) - 1
+        else:
+            column += end - start
+        segment.end_line = line
+        segment.end_column = column
+        segments.append(segment)
+        start = end
+    return segments
@@ -1,61 +1,94 @@
-from generated.LanguageParser import LanguageParser
-from generated.LanguageVisitor import LanguageVisitor
+from diagnostics import SEMANTIC, Diagnostic
+from rule_engine import RuleEngine
+from symbol_table import SymbolTable, CLASS_SCOPE, METHOD_SCOPE, BLOCK_SCOPE, LOOP_SCOPE
+from syntax_tree import SKIP, MethodDeclaration, TreeWalker
+from type_inference import TypeInference
 
 
-class SemanticAnalyzer(LanguageVisitor):
+class SemanticAnalyzer(TreeWalker):
     """
-    This class extends LanguageVisitor and is responsible for performing semantic analysis on a parsed input.
+    This class extends TreeWalker and is responsible for performing semantic analysis on a parsed input,
+    represented by its syntax tree (see syntax_tree.py and tree_builder.py).
+    The tree is walked without recursion: every check is an enter or leave handler of a kind of node,
+    and the scopes opened when entering a node are closed when leaving it.
     It checks for various semantic errors, such as undeclared variables, type compatibility, and method declarations.
     It maintains state information about declared variables and methods within the current class context.
+    Declared variables live in a chain of scopes (global, class, method, block and loop scopes).
+    The optional checks of rule_engine.py (unused variables, ...) run during the same walk; `disabled_rules`
+    lists the codes of those to skip.
     """
 
-    def __init__(self):
+    # Version of the semantic checks, part of the key of cached results (see result_cache.py).
+    # Increment it whenever a change to the analysis can change the reported diagnostics.
+    VERSION = 4
+
+    def __init__(self, disabled_rules=()):
         super().__init__()
-        self.errors = []
-        self.declared_vars = {}  # Variables with associated types
+        self.errors = []  # Diagnostic records
+        self.symbols = SymbolTable()  # Variables with associated types, organized in nested scopes
         self.class_methods = {}  # Methods declared for each class
         self.predefined_methods = {"System.out.println"}  # Predefined methods
         self.current_class = None  # Current class
+        self.enclosing_classes = []  # Classes enclosing the current class, innermost last
         self.valid_data_types = {"int", "float", "double", "boolean", "char", "String"}  # Valid data types
+        self.type_inference = TypeInference(self)  # Memoized types of expressions
+        self.rule_engine = RuleEngine(self, disabled_rules)  # Rules subscribed to every kind of node
 
-    def visitDeclaration(self, ctx: LanguageParser.DeclarationContext):
+    def preload(self, global_symbols, class_names, class_methods):
+        """
+        Seeds the analyzer with the declarations made by the code preceding the code it is about to visit:
+        the global variables and classes (name -> type), the declared class names and the methods of every class.
+        Used to analyze a part of a document on its own (see parallel_analyzer.py).
         """
-        This method visits a variable declaration node in the parse tree.
-        It checks for the validity of the data type and ensures the variable is not already declared.
+        for name, data_type in global_symbols.items():
+            self.symbols.declare(name, data_type)
+        self.valid_data_types.update(class_names)
+        for class_name, methods in class_methods.items():
+            self.class_methods[class_name] = set(methods)
+
+    def handler_table(self):
+        # The analyzer's handlers, between those of the rules subscribed to the same kinds of nodes (see RuleEngine)
+        table = super().handler_table()
+        for node_class, (rule_enter, rule_leave) in self.rule_engine.handlers.items():
+            enter, leave = table.get(node_class, ((), ()))
+            table[node_class] = (rule_enter + enter, leave + rule_leave)
+        return table
+
+    def report(self, node, code, *args):
+        # Records a semantic error spanning the node (see diagnostics.MESSAGES for the codes).
+        self.errors.append(Diagnostic.at_node(SEMANTIC, code, node, *args))
+
+    def enterVariableDeclaration(self, node):
+        """
+        This method enters a variable declaration node in the syntax tree.
+        It checks for the validity of the data type and ensures the variable is not already declared in the same scope
+        (or, inside a method, in an enclosing scope of the same method).
         It also verifies type compatibility between the declared variable and any assigned expression.
         If any semantic errors are found, they are added to the errors list.
         """
 
-        # Get the line number from the context
-        if ctx.start:
-            line_number = ctx.start.line
-        else:
-            line_number = "unknown"
+        if node.name is None:
+            self.report(node, "declaration-without-identifier")
+            return SKIP
 
-        if ctx.ID() is None:
-            self.errors.append("Error at line {line_number}: Declaration without an identifier.")
-            return None
-
-        var_name = ctx.ID().getText()
-        data_type = ctx.data_type().getText() if ctx.data_type() else None
+        var_name = node.name
+        data_type = node.data_type
 
         # Check if the data type is valid
         if data_type and data_type not in self.valid_data_types:
-            self.errors.append(f"Error at line {line_number}: Invalid data type '{data_type}' for variable '{var_name}'.")
+            self.report(node, "invalid-data-type", data_type, var_name)
 
-        if var_name in self.declared_vars:
-            self.errors.append(f"Error at line {line_number}: Variable '{var_name}' already declared.")
+        if self.symbols.is_redeclaration(var_name):
+            self.report(node, "variable-already-declared", var_name)
         else:
-            self.declared_vars[var_name] = data_type  # Associate the type with the variable
+            self.symbols.declare(var_name, data_type)  # Associate the type with the variable
 
         # Check that the variable type is compatible with the assigned expression
-        if ctx.expr():
-            expr_type = self.get_expression_type(ctx.expr())
+        if node.value is not None:
+            expr_type = self.get_expression_type(node.value)
             if expr_type and not self.is_type_compatible(data_type, expr_type):
-                self.errors.append(
-                    f"Error at line {line_number}: Incompatible type '{expr_type}' with declaration '{data_type}' for variable '{var_name}'.")
-
-        return self.visitChildren(ctx)
+                self.report(node, "incompatible-declaration", expr_type, data_type, var_name)
+        return None
 
     def is_type_compatible(self, var_type, expr_type):
         """
@@ -78,53 +111,39 @@ class SemanticAnalyzer(LanguageVisitor):
         # No other conversions are allowed
         return False
 
-    def visitAssignment(self, ctx: LanguageParser.AssignmentContext):
+    def enterAssignment(self, node):
         """
-        This method visits an assignment node in the parse tree.
+        This method enters an assignment node in the syntax tree.
         It verifies that the variable being assigned to has been declared.
         It also checks that the type of the expression being assigned is compatible with the type of the variable.
         If any semantic errors are found, such as using an undeclared variable or type mismatches, they are added to the errors list.
         """
-        # Get the line number from the context
-        if ctx.start:
-            line_number = ctx.start.line
-        else:
-            line_number = "unknown"
-
-        var_name = ctx.ID().getText()
+        var_name = node.name
 
-        if var_name not in self.declared_vars:
-            self.errors.append(f"Error at line {line_number}: Variable '{var_name}' used without declaration.")
-            return None
+        if not self.symbols.is_declared(var_name):
+            self.report(node, "undeclared-variable", var_name)
+            return SKIP
 
-        var_type = self.declared_vars[var_name]
-        expr_type = self.get_expression_type(ctx.expr())
+        var_type = self.symbols.lookup(var_name)
+        expr_type = self.get_expression_type(node.value)
 
         if not self.is_type_compatible(var_type, expr_type):
-            self.errors.append(f"Error at line {line_number}: Assignment of type '{expr_type}' to variable of type '{var_type}'.")
-
-        return self.visitChildren(ctx)
+            self.report(node, "incompatible-assignment", expr_type, var_type)
+        return None
 
-    def visitMethod_declaration(self, ctx: LanguageParser.Method_declarationContext):
+    def enterMethodDeclaration(self, node):
         """
-        This method visits a method declaration node in the parse tree.
+        This method enters a method declaration node in the syntax tree.
         It checks for the presence of a method name and adds the method to the current class.
-        The method parameters are added to the list of declared variables for type checking within the method.
-        It saves the current state of declared variables before visiting the method body to ensure scope isolation.
-        After processing the method body, it restores the previous state of declared variables.
+        The method parameters are declared in a new method scope for type checking within the method.
+        The method body is walked inside that scope, which is discarded when leaving the method to ensure scope isolation.
         Any semantic errors, such as undeclared parameters or duplicate method declarations, are added to the errors list.
         """
-        # Get the line number from the context
-        if ctx.start:
-            line_number = ctx.start.line
-        else:
-            line_number = "unknown"
-
-        if ctx.ID() is None:
-            self.errors.append(f"Error at line {line_number}: Method without a name.")
-            return None
+        if node.name is None:
+            self.report(node, "method-without-name")
+            return SKIP
 
-        method_name = ctx.ID().getText()
+        method_name = node.name
 
         # Add the method to the current class
         if self.current_class:
@@ -132,53 +151,50 @@ class SemanticAnalyzer(LanguageVisitor):
                 self.class_methods[self.current_class] = set()
             self.class_methods[self.current_class].add(method_name)
 
-        # Save the current state of declared variables
-        previous_declared_vars = dict(self.declared_vars)
+        # Open the scope of the method
+        self.symbols.enter_scope(METHOD_SCOPE)
 
         # Add method parameters to declared variables
-        if ctx.param_list() is not None:
-            for param in ctx.param_list().param():
-                if param.ID() is None:
-                    self.errors.append(f"Error at line {line_number}: Parameter without an identifier.")
-                else:
-                    param_name = param.ID().getText()
-                    param_type = param.data_type().getText() if param.data_type() else None
-                    self.declared_vars[param_name] = param_type  # Associate the type with the parameter
-
-        # Visit the method body and verify variable usage
-        self.visit(ctx.block())
-
-        # Restore the previous state of declared variables
-        self.declared_vars = previous_declared_vars
-
+        for param in node.parameters:
+            if param.name is None:
+                self.report(node, "parameter-without-identifier")
+            else:
+                self.symbols.declare(param.name, param.data_type)  # Associate the type with the parameter
         return None
 
-    def visitMethod_call(self, ctx: LanguageParser.Method_callContext):
+    def leaveMethodDeclaration(self, node):
+        # Close the scope of the method
+        if node.name is not None:
+            self.symbols.exit_scope()
+
+    def enterMethodCall(self, node):
         """
-        This method visits a method call node in the parse tree.
+        This method enters a method call node in the syntax tree.
         It extracts the full method name and checks if it is a valid predefined method, such as those in System.out.
-        For methods within the current class, it verifies that the method has been declared.
+        A method called on a variable of a known class (`helper.compute()`) or on a known class (`Helper.compute()`)
+        must be declared in that class; other methods must be declared in the current class.
         If the method is not recognized or declared, a semantic error is added to the errors list.
         """
-        # Get the line number from the context
-        if ctx.start:
-            line_number = ctx.start.line
-        else:
-            line_number = "unknown"
-
         # Get the full method name (e.g., example.countNumbers)
-        method_name = ctx.qualified_name().getText()
-        method_name_parts = method_name.split('.')
+        method_name_parts = node.path
         method_name = method_name_parts[-1]
 
         # Check if it is a System.out method (predefined)
         if len(method_name_parts) > 1 and method_name_parts[0] == "System" and method_name_parts[1] == "out":
             valid_methods = {"println", "print", "readLine", "nextInt"}  # Add other valid methods if necessary
             if method_name not in valid_methods:
-                self.errors.append(
-                    f"Error at line {line_number}: Method '{method_name}' called on 'System.out' is not recognized as valid."
-                )
-            return self.visitChildren(ctx)
+                self.report(node, "invalid-system-out-method", method_name)
+            return None
+
+        # Check the methods called on an object or a class whose methods are known
+        if len(method_name_parts) == 2:
+            receiver = method_name_parts[0]
+            receiver_type = self.symbols.lookup(receiver)
+            receiver_class = receiver if receiver_type == "class" else receiver_type
+            if receiver_class in self.class_methods:
+                if method_name not in self.class_methods[receiver_class]:
+                    self.report(node, "undeclared-method", method_name, receiver_class)
+                return None
 
         # Now check methods in the current class
         if self.current_class:
@@ -186,148 +202,115 @@ class SemanticAnalyzer(LanguageVisitor):
             declared_methods = self.class_methods.get(self.current_class, set())
             # Check if the method is declared in the current class
             if method_name not in declared_methods:
-                self.errors.append(
-                    f"Error at line {line_number}: Method '{method_name}' called without being declared in class '{self.current_class}'."
-                )
+                self.report(node, "undeclared-method", method_name, self.current_class)
         else:
-            self.errors.append(f"Error at line {line_number}: Method '{method_name}' called outside of a class.")
-
-        return self.visitChildren(ctx)
+            self.report(node, "method-outside-class", method_name)
+        return None
 
-    def visitClass_declaration(self, ctx: LanguageParser.Class_declarationContext):
+    def enterClassDeclaration(self, node):
         """
-        This method visits a class declaration node in the parse tree.
+        This method enters a class declaration node in the syntax tree.
         It checks for the presence of a class name and ensures it is not already declared as a variable or another class.
         If the class name is valid, it adds the class to the list of declared variables and valid data types.
         It sets the current class context and initializes the method list for the class.
-        The method then visits all children of the class to process method declarations and other class members.
-        Finally, it restores the previous class context after visiting the class declaration.
+        The members of the class are then walked to process method declarations and other class members,
+        and the previous class context is restored when leaving the class declaration.
         Any semantic errors, such as duplicate class names or methods, are added to the errors list.
         """
-        # Get the line number from the context
-        if ctx.start:
-            line_number = ctx.start.line
-        else:
-            line_number = "unknown"
-
-        if ctx.ID() is None:
-            self.errors.append(f"Error at line {line_number}: Class without a name.")
-            return None
+        if node.name is None:
+            self.report(node, "class-without-name")
+            return SKIP
 
-        class_name = ctx.ID().getText()
+        class_name = node.name
 
         # Avoid conflicts with already declared variables or classes
-        if class_name in self.declared_vars or class_name in self.valid_data_types:
-            self.errors.append(f"Error at line {line_number}: Class '{class_name}' already declared.")
+        if self.symbols.is_declared(class_name) or class_name in self.valid_data_types:
+            self.report(node, "class-already-declared", class_name)
         else:
-            self.declared_vars[class_name] = "class"  # Add the class name
+            self.symbols.declare(class_name, "class")  # Add the class name
             self.valid_data_types.add(class_name)
 
         # Set the current class
-        previous_class = self.current_class
+        self.enclosing_classes.append(self.current_class)
         self.current_class = class_name
 
         # Initialize the methods of the class
         if class_name not in self.class_methods:
             self.class_methods[class_name] = set()
 
-        # Add the methods of the current class to the list
-        for child in ctx.children:
-            if isinstance(child, LanguageParser.Method_declarationContext):
-                method_name = child.ID().getText()
-                if method_name in self.class_methods[class_name]:
-                    self.errors.append(f"Error at line {line_number}: Method '{method_name}' already declared in class '{class_name}'.")
-                else:
-                    self.class_methods[class_name].add(method_name)
-
-        # Visit all children of the class
-        self.visitChildren(ctx)
-
-        # Restore the previous class
-        self.current_class = previous_class
+        # Add the methods of the current class to the list before visiting the class,
+        # so that a method can call the methods declared after it
+        for member in node.members:
+            if type(member) is not MethodDeclaration or member.name is None:
+                continue
+            if member.name in self.class_methods[class_name]:
+                self.report(member, "method-already-declared", member.name, class_name)
+            else:
+                self.class_methods[class_name].add(member.name)
+
+        # Walk all the members of the class, declaring its fields in the class scope
+        self.symbols.enter_scope(CLASS_SCOPE)
         return None
 
-    def visitFor_loop(self, ctx: LanguageParser.For_loopContext):
+    def leaveClassDeclaration(self, node):
+        if node.name is not None:
+            self.symbols.exit_scope()
+            # Restore the previous class
+            self.current_class = self.enclosing_classes.pop()
+
+    def enterForLoop(self, node):
         """
-        This method visits a for loop node in the parse tree.
-        It visits the initialization, condition, and increment expressions of the for loop.
-        It also visits the block of code that represents the body of the loop.
+        This method enters a for loop node in the syntax tree.
+        The initialization, condition, and increment expressions of the for loop and the block of code
+        that represents the body of the loop are then walked inside a loop scope, closed when leaving the loop.
         This ensures that all parts of the for loop are semantically analyzed.
+        Variables declared in the initialization are only visible inside the loop scope.
         """
+        self.symbols.enter_scope(LOOP_SCOPE)
 
-        # Visit the declarations, conditions, and increments of the loop
-        self.visitChildren(ctx)
-        return None
-
-    def visitWhile_loop(self, ctx: LanguageParser.While_loopContext):
+    def enterWhileLoop(self, node):
         """
-        This method visits a while loop node in the parse tree.
-        It visits the condition expression of the while loop.
-        It also visits the block of code that represents the body of the loop.
+        This method enters a while loop node in the syntax tree.
+        The condition expression and the body of the while loop are then walked inside a loop scope.
         This ensures that the condition and the body of the while loop are semantically analyzed.
         """
+        self.symbols.enter_scope(LOOP_SCOPE)
 
-        # Visit the loop condition
-        self.visitChildren(ctx)
-        return None
-
-    def visitTerm(self, ctx: LanguageParser.TermContext):
+    def enterBlock(self, node):
         """
-        This method visits a term node in the parse tree.
-        If the term is an identifier (ID), it checks whether the variable has been declared.
-        If the variable is undeclared, a semantic error is added to the errors list.
-        It ensures that terms used in expressions are valid and declared.
+        This method enters a block of code (a method body, a loop body, the branches of an if statement
+        or a standalone block). Variables declared in the block are only visible until the end of the block.
         """
-        # Get the line number from the context
-        if ctx.start:
-            line_number = ctx.start.line
-        else:
-            line_number = "unknown"
+        self.symbols.enter_scope(BLOCK_SCOPE)
 
-        # If the term is an ID (a variable)
-        if ctx.ID() is not None:
-            var_name = ctx.ID().getText()
-            if var_name not in self.declared_vars:
-                self.errors.append(f"Error at line {line_number}: Variable '{var_name}' used without declaration.")
-        return self.visitChildren(ctx)
-
-    def get_expression_type(self, expr_ctx):
+    def enterMainMethodDeclaration(self, node):
         """
-        This method determines the type of an expression in the parse tree.
-        It checks if the expression is a boolean, integer, float, string, or a declared variable.
-        If the expression is an object creation, it retrieves the type of the created object.
-        The method returns the detected type of the expression or None if the type cannot be determined.
+        This method enters the main method declaration, whose body gets its own method scope like any other method.
         """
+        self.symbols.enter_scope(METHOD_SCOPE)
 
-        # Get the text of the expression
-        text = expr_ctx.getText()
-
-        # Check if the text is a boolean value
-        if text == "true" or text == "false":
-            return "boolean"
-
-        # Check if it is an integer
-        if text.isdigit():
-            return "int"
-
-        # Check if it is a floating-point number
-        try:
-            float(text)
-            if '.' in text or text.lower().endswith('f'):
-                return "float"
-        except ValueError:
-            pass
-
-        # Check if it is a string
-        if text.startswith('"') and text.endswith('"'):
-            return "String"
-
-        # If it is a variable (ID), look it up in the list of declared variables
-        if text in self.declared_vars:
-            return self.declared_vars[text]  # Return the type of the declared variable
+    def leave_scope(self, node):
+        # Closes the scope opened when entering a loop, a block or the main method
+        self.symbols.exit_scope()
 
-        # Check if it is an object creation (e.g., `new Type()`)
-        if hasattr(expr_ctx, 'object_creation') and expr_ctx.object_creation() is not None:
-            return expr_ctx.object_creation().qualified_name().getText()
+    leaveForLoop = leaveWhileLoop = leaveBlock = leaveMainMethodDeclaration = leave_scope
 
+    def enterName(self, node):
+        """
+        This method enters a name used in an expression (a variable).
+        If the variable is undeclared, a semantic error is added to the errors list.
+        It ensures that names used in expressions are valid and declared.
+        """
+        if not self.symbols.is_declared(node.name):
+            self.report(node, "undeclared-variable", node.name)
         return None
+
+    def get_expression_type(self, expression):
+        """
+        This method determines the type of an expression of the syntax tree.
+        The type is computed once by the type inference pass, bottom-up from the literals, variables
+        and operators of the expression, and read from its cache afterwards.
+        The method returns the detected type of the expression or None if the type cannot be determined
+        (or if the expression is missing).
+        """
+        return self.type_inference.infer(expression)
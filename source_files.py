@@ -0,0 +1,8 @@
+# Reading of the analyzed source files, shared by the batch checker, the project analyzer and bugbuster.py.
+# Imports nothing else, so the modules reading files do not pull in the analysis modules with it.
+
+
+def read_source(path):
+    # The text of a source file; it is read as UTF-8, undecodable bytes being replaced
+    with open(path, encoding="utf-8", errors="replace") as source_file:
+        return source_file.read()
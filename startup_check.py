@@ -0,0 +1,83 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# (name, Python arguments, budget in milliseconds on top of the bare interpreter startup,
+#  modules that must not have been imported at the end)
+CASES = (
+    ("import bugbuster", ["-c", "import bugbuster"], 15, ("antlr4", "PyQt5")),
+    ("bugbuster.analyze (first call)", ["-c", "import bugbuster; bugbuster.analyze('int a = 1;')"], 100, ("PyQt5",)),
+    ("batch_checker.py --help", [os.path.join(HERE, "batch_checker.py"), "--help"], 60, ("antlr4", "PyQt5")),
+    ("import main (GUI module)", ["-c", "import main"], None, ("antlr4", "generated.LanguageParser")),
+)
+
+# Written last on the standard error of a case: the JSON list of the given modules it imported
+MODULE_CHECK = "import json, sys; sys.stderr.write(json.dumps(sorted(m for m in {!r} if m in sys.modules)))"
+
+
+def run_python(arguments):
+    start = time.perf_counter()
+    subprocess.run([sys.executable] + arguments, cwd=HERE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                   check=True)
+    return time.perf_counter() - start
+
+
+def best_time(arguments, repeat):
+    return min(run_python(arguments) for _ in range(repeat))
+
+
+def imported_modules(arguments, modules):
+    # Runs the case and reports which of the modules it left imported
+    if arguments[0] != "-c":
+        code = f"import runpy, sys; sys.argv = {arguments!r}; runpy.run_path({arguments[0]!r}, run_name='__main__')"
+        code = f"try:\n {code}\nexcept SystemExit:\n pass\n"
+    else:
+        code = arguments[1] + "\n"
+    code += MODULE_CHECK.format(tuple(modules))
+    result = subprocess.run([sys.executable, "-c", code], cwd=HERE, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, text=True, check=True)
+    return json.loads(result.stderr.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    # Measures the startup time of the entry points in fresh interpreters and checks them against their budgets.
+    # Exits with status 1 when a budget is exceeded or a heavy module is imported where it should not be.
+    arg_parser = argparse.ArgumentParser(description="Check the startup time of the analyzer entry points.")
+    arg_parser.add_argument("-r", "--repeat", type=int, default=5, help="runs per case, the best one is kept (default: 5)")
+    arg_parser.add_argument("--scale", type=float, default=1.0,
+                            help="multiply the budgets, e.g. on a slow machine (default: 1.0)")
+    args = arg_parser.parse_args(argv)
+
+    baseline = best_time(["-c", "pass"], args.repeat)
+    print(f"{'case':<32} {'ms':>8} {'budget':>8}  result   (interpreter startup: {baseline * 1000:.1f} ms, subtracted)")
+    failures = 0
+    for name, arguments, budget, forbidden in CASES:
+        if name.startswith("import main"):
+            try:
+                import PyQt5  # noqa: F401
+            except ImportError:
+                print(f"{name:<32} {'-':>8} {'-':>8}  skipped (PyQt5 is not installed)")
+                continue
+        elapsed = (best_time(arguments, args.repeat) - baseline) * 1000
+        imported = imported_modules(arguments, forbidden)
+        problems = []
+        limit = budget * args.scale if budget is not None else None
+        if limit is not None and elapsed > limit:
+            problems.append("over budget")
+        if imported:
+            problems.append("imports " + ", ".join(imported))
+        failures += bool(problems)
+        print(f"{name:<32} {elapsed:>8.1f} {(f'{limit:.0f}' if limit is not None else '-'):>8}  "
+              f"{'; '.join(problems) or 'ok'}")
+    if failures:
+        print("\nRun `python -X importtime -c \"...\"` to find the modules slowing down a case.")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
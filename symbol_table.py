@@ -0,0 +1,74 @@
+GLOBAL_SCOPE = "global"
+CLASS_SCOPE = "class"
+METHOD_SCOPE = "method"
+BLOCK_SCOPE = "block"
+LOOP_SCOPE = "loop"
+
+
+class SymbolTable:
+    """
+    This class implements a chain of nested scopes (global, class, method, block and loop scopes).
+    Every scope only records the names declared in it, while a per-name index keeps, for each name,
+    the stack of its visible declarations (innermost last). Looking up a name is therefore a single
+    dictionary access, entering a scope costs O(1) and leaving it costs O(number of names declared in it),
+    independently of how many symbols are visible from the enclosing scopes.
+    """
+
+    def __init__(self):
+        self.index = {}  # name -> [(scope depth, type), ...], innermost declaration last
+        self.scopes = []  # (kind, names declared in the scope)
+        self.method_depths = []  # depths of the enclosing method scopes
+        self.enter_scope(GLOBAL_SCOPE)
+
+    @property
+    def depth(self):
+        return len(self.scopes) - 1
+
+    def enter_scope(self, kind):
+        self.scopes.append((kind, []))
+        if kind == METHOD_SCOPE:
+            self.method_depths.append(self.depth)
+
+    def exit_scope(self):
+        """
+        Leaves the innermost scope, making the declarations it shadowed visible again.
+        """
+        kind, names = self.scopes.pop()
+        index = self.index
+        for name in names:
+            declarations = index[name]
+            declarations.pop()
+            if not declarations:
+                del index[name]
+        if kind == METHOD_SCOPE:
+            self.method_depths.pop()
+
+    def declare(self, name, data_type):
+        self.index.setdefault(name, []).append((self.depth, data_type))
+        self.scopes[-1][1].append(name)
+
+    def is_declared(self, name):
+        return name in self.index
+
+    def lookup(self, name):
+        """
+        Returns the type of the innermost visible declaration of the name, or None if it is not declared.
+        """
+        declarations = self.index.get(name)
+        return declarations[-1][1] if declarations else None
+
+    def is_redeclaration(self, name):
+        """
+        Checks whether declaring the name in the current scope would clash with a visible declaration.
+        Inside a method, a local variable may not redeclare a parameter or a variable of an enclosing block
+        of the same method, but it may shadow fields and globals. Outside methods, only declarations of
+        the current scope clash.
+        """
+        declarations = self.index.get(name)
+        if not declarations:
+            return False
+        boundary = self.method_depths[-1] if self.method_depths else self.depth
+        return declarations[-1][0] >= boundary
+
+    def current_scope_kind(self):
+        return self.scopes[-1][0]
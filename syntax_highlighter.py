@@ -0,0 +1,211 @@
+import argparse
+import sys
+import time
+
+from PyQt5.QtCore import QTimer
+from PyQt5.QtGui import QColor, QFont, QSyntaxHighlighter, QTextCharFormat
+from fast_lexer import COMMENT, KEYWORDS, NORMAL, tokenize_line
+from generated.LanguageLexer import LanguageLexer
+
+# Blocks re-highlighted per event loop iteration when an edit changes the state of the following lines
+# (e.g. typing a quote): the rest of such a cascade is highlighted in the following iterations
+CASCADE_LIMIT = 500
+
+TYPE_NAMES = ("int", "float", "double", "boolean", "char", "String", "void")
+
+
+def text_format(color, italic=False):
+    text_format = QTextCharFormat()
+    text_format.setForeground(QColor(color))
+    if italic:
+        text_format.setFontItalic(True)
+    return text_format
+
+
+def token_formats():
+    # Character format of every highlighted token type (identifiers and operators keep the editor's colors)
+    formats = {token_type: text_format("#569cd6") for token_type in KEYWORDS.values()}
+    for name in TYPE_NAMES:
+        formats[KEYWORDS[name]] = text_format("#4ec9b0")
+    formats[LanguageLexer.NUMBER] = text_format("#b5cea8")
+    formats[LanguageLexer.STRING_LITERAL] = text_format("#ce9178")
+    formats[COMMENT] = text_format("#6a9955", italic=True)
+    unknown = QTextCharFormat()
+    unknown.setUnderlineStyle(QTextCharFormat.WaveUnderline)
+    unknown.setUnderlineColor(QColor("#f44747"))
+    unknown.setFontWeight(QFont.Bold)
+    formats[LanguageLexer.UNKNOWN] = unknown
+    return formats
+
+
+class SyntaxHighlighter(QSyntaxHighlighter):
+    """
+    Highlights a document with the token types of the grammar, one block (line) at a time.
+    The tokens of every line are kept in `lines` (one fast_lexer.LineTokens per block, with the lexer state
+    the line starts and ends in: inside a string literal or not). Qt re-highlights the blocks touched by an
+    edit; a block is only tokenized again when its text or start state changed, and the following blocks
+    are only re-highlighted while the state at their start changes. Long cascades are spread over several
+    event loop iterations (see CASCADE_LIMIT), so that the editor stays responsive on very large documents.
+    The cached tokens are also used by the analysis (see line_tokens and TokenStore.from_lines).
+    Qt's own block state only drives the re-highlighting: it changes exactly when the next block must follow.
+    """
+
+    def __init__(self, document, cascade_limit=CASCADE_LIMIT):
+        super().__init__(None)
+        self.formats = token_formats()
+        self.cascade_limit = cascade_limit
+        self.budget = None  # Blocks left to highlight in this event loop iteration, None outside of one
+        self.pending = set()  # Blocks left out of date by interrupted cascades
+        self.lines = [None] * document.blockCount()
+        # Connected before the highlighter's own handler, so the cache is aligned before any block is highlighted
+        document.contentsChange.connect(self.track_blocks)
+        self.setDocument(document)
+
+    def track_blocks(self, position, removed, added):
+        # Keeps `lines` aligned with the blocks of the document: the entries of inserted blocks are added,
+        # those of removed blocks dropped. The blocks touched by the change are highlighted again anyway.
+        document = self.document()
+        delta = document.blockCount() - len(self.lines)
+        if not delta:
+            return
+        first = document.findBlock(position).blockNumber()
+        if delta > 0:
+            self.lines[first + 1:first + 1] = [None] * delta
+        else:
+            del self.lines[first + 1:first + 1 - delta]
+        if self.pending:
+            self.pending = {number if number <= first else max(first + 1, number + delta) for number in self.pending}
+
+    def highlightBlock(self, text):
+        if self.budget is None:
+            self.budget = self.cascade_limit
+            QTimer.singleShot(0, self.end_iteration)
+        self.budget -= 1
+
+        number = self.currentBlock().blockNumber()
+        lines = self.lines
+        previous = lines[number - 1] if number > 0 else None
+        start_state = previous.end_state if previous is not None else NORMAL
+        text = text.replace("\u00a0", " ")  # As in toPlainText(), which the analysis reads
+        entry = lines[number]
+        if entry is None or entry.start_state != start_state or entry.text_hash != hash(text):
+            entry = lines[number] = tokenize_line(text, start_state)
+        self.apply_formats(entry, text)
+
+        following = lines[number + 1] if number + 1 < len(lines) else None
+        follow = following is not None and following.start_state != entry.end_state
+        state = self.currentBlockState()
+        if follow and self.budget > 0:
+            self.setCurrentBlockState(state + 1 if state < 1000 else 0)
+        else:
+            self.setCurrentBlockState(state)
+            if follow:
+                self.pending.add(number + 1)
+
+    def apply_formats(self, entry, text):
+        tokens = entry.tokens
+        formats = self.formats
+        offsets = None
+        if not text.isascii() and any(ord(char) > 0xFFFF for char in text):
+            # Qt positions count UTF-16 code units: characters outside the BMP take two
+            offsets = [0]
+            for char in text:
+                offsets.append(offsets[-1] + (2 if ord(char) > 0xFFFF else 1))
+        for index in range(0, len(tokens), 3):
+            token_format = formats.get(tokens[index])
+            if token_format is None:
+                continue
+            start, stop = tokens[index + 1], tokens[index + 2] + 1
+            if offsets is not None:
+                start, stop = offsets[start], offsets[stop]
+            self.setFormat(start, stop - start, token_format)
+
+    def end_iteration(self):
+        # Continues the first interrupted cascade that is still out of date
+        self.budget = None
+        while self.pending:
+            number = min(self.pending)
+            self.pending.discard(number)
+            if number >= len(self.lines):
+                continue
+            previous, entry = self.lines[number - 1], self.lines[number]
+            if previous is None or entry is None or entry.start_state != previous.end_state:
+                self.rehighlightBlock(self.document().findBlockByNumber(number))
+                return
+            # Otherwise already brought up to date, e.g. by a later edit
+
+    def busy(self):
+        return self.budget is not None or bool(self.pending)
+
+    def line_tokens(self):
+        # Snapshot of the tokens of every line for the analysis (see TokenStore.from_lines),
+        # or None while some lines are not highlighted yet. Entries are never modified once created.
+        if self.pending or None in self.lines:
+            return None
+        return list(self.lines)
+
+
+def main(argv=None):
+    # Measures the highlighter on a large generated document without showing any window: the initial
+    # highlighting, then typing a line one character per edit in the middle of the document (which opens and
+    # closes a string literal), and checks that the cached tokens give the same TokenStore as the source.
+    # Exits with status 1 when they differ. Use QT_QPA_PLATFORM=offscreen where there is no display.
+    from PyQt5.QtGui import QTextCursor
+    from PyQt5.QtWidgets import QApplication, QPlainTextEdit
+    from program_generator import generate_program
+    from token_store import TokenStore
+
+    arg_parser = argparse.ArgumentParser(description="Measure the syntax highlighter on a large document.")
+    arg_parser.add_argument("-n", "--lines", type=int, default=100000,
+                            help="size of the generated document (default: 100000)")
+    arg_parser.add_argument("--typed", default='undeclaredValue = "text"; // typed\n',
+                            help="text typed one character at a time in the middle of the document")
+    args = arg_parser.parse_args(argv)
+
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    editor = QPlainTextEdit()
+    highlighter = SyntaxHighlighter(editor.document())
+
+    def settle():
+        while highlighter.busy():
+            app.processEvents()
+
+    source = generate_program(args.lines, broken=True)
+    start = time.perf_counter()
+    editor.setPlainText(source)
+    settle()
+    print(f"Initial highlighting of {len(highlighter.lines)} lines: {time.perf_counter() - start:.2f}s")
+
+    cursor = QTextCursor(editor.document().findBlockByNumber(len(highlighter.lines) // 2))
+    times = []
+    for char in args.typed:
+        start = time.perf_counter()
+        cursor.insertText(char)
+        app.processEvents()  # One event loop iteration per keystroke, as in the editor
+        times.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    settle()
+    print(f"Typed {len(times)} characters: {sum(times) / len(times) * 1000:.2f}ms per keystroke on average, "
+          f"{max(times) * 1000:.2f}ms at most; cascades finished {time.perf_counter() - start:.2f}s later")
+
+    text = editor.toPlainText()
+    start = time.perf_counter()
+    store = TokenStore.from_lines(text, highlighter.line_tokens())
+    assembled = time.perf_counter() - start
+    start = time.perf_counter()
+    expected = TokenStore.from_source(text)
+    tokenized = time.perf_counter() - start
+    if store is None:
+        print("The cached tokens were rejected.")
+        return 1
+    columns = ("types", "starts", "stops", "lines", "columns", "channels")
+    if any(getattr(store, name) != getattr(expected, name) for name in columns):
+        print("MISMATCH: the cached tokens differ from those of the lexer.")
+        return 1
+    print(f"Cached tokens match the lexer: {len(store)} tokens assembled in {assembled:.2f}s "
+          f"(tokenizing the document: {tokenized:.2f}s).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
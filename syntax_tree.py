@@ -0,0 +1,408 @@
+import sys
+
+# Returned by an enter handler of a TreeWalker to leave the children of its node out of the walk
+SKIP = "skip"
+
+
+def intern(text):
+    # Names are interned: the same identifier is stored once however often it is used
+    return None if text is None else sys.intern(text)
+
+
+class Node:
+    """
+    Base class of the nodes of the syntax tree, the compact typed tree the semantic checks run on
+    (see tree_builder.py, which builds it from the ANTLR parse tree).
+    Every node records its source span: the line and column of its first character and the position just past
+    its last character (lines 1-based, columns 0-based, all None when unknown), as Diagnostic.at_node reports it.
+    Nodes use __slots__ and the names they hold are interned, so a tree costs a fraction of the parse tree
+    and keeps neither the tokens nor the parser alive.
+    `FIELDS` lists the attributes holding child nodes (a node, None or a list of nodes), in source order.
+    """
+
+    __slots__ = ("line", "column", "end_line", "end_column")
+    FIELDS = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.VISIT = "visit" + cls.__name__  # Name of the NodeVisitor method visiting the node
+        cls.REVERSED_FIELDS = cls.FIELDS[::-1]  # Pushed in this order on the stack of a TreeWalker
+
+    def __init__(self, span):
+        self.line, self.column, self.end_line, self.end_column = span
+
+    def children(self):
+        for field in self.FIELDS:
+            value = getattr(self, field)
+            if value is None:
+                continue
+            if type(value) is list:
+                yield from value
+            else:
+                yield value
+
+    def __repr__(self):
+        attributes = ", ".join(f"{name}={getattr(self, name)!r}" for cls in type(self).__mro__[:-2]
+                               for name in cls.__slots__ if name not in Node.__slots__)
+        return f"{type(self).__name__}({attributes}) at {self.line}:{self.column}"
+
+
+class Expression(Node):
+    # Base class of the expressions, including those used as statements (assignments, calls, ...).
+    # Expressions never declare anything.
+    __slots__ = ()
+
+
+class Program(Node):
+    # A sequence of top-level statements
+    __slots__ = ("statements",)
+    FIELDS = ("statements",)
+
+    def __init__(self, span, statements):
+        super().__init__(span)
+        self.statements = statements
+
+
+class ClassDeclaration(Node):
+    # `class name { members }`; members are variable, method, main method and class declarations
+    __slots__ = ("name", "members")
+    FIELDS = ("members",)
+
+    def __init__(self, span, name, members):
+        super().__init__(span)
+        self.name = intern(name)
+        self.members = members
+
+    def with_members(self, members):
+        # Copy of the declaration with other members, at the same place
+        return ClassDeclaration((self.line, self.column, self.end_line, self.end_column), self.name, members)
+
+
+class Parameter(Node):
+    __slots__ = ("data_type", "name")
+
+    def __init__(self, span, data_type, name):
+        super().__init__(span)
+        self.data_type = intern(data_type)
+        self.name = intern(name)
+
+
+class MethodDeclaration(Node):
+    # `return_type name(parameters) body`; the return type is None when it is omitted (a constructor)
+    __slots__ = ("name", "return_type", "parameters", "body")
+    FIELDS = ("parameters", "body")
+
+    def __init__(self, span, name, return_type, parameters, body):
+        super().__init__(span)
+        self.name = intern(name)
+        self.return_type = intern(return_type)
+        self.parameters = parameters
+        self.body = body
+
+
+class MainMethodDeclaration(Node):
+    # `public static void main(String[] args) body`
+    __slots__ = ("body",)
+    FIELDS = ("body",)
+
+    def __init__(self, span, body):
+        super().__init__(span)
+        self.body = body
+
+
+class VariableDeclaration(Node):
+    # `data_type name = value`, the value being optional
+    __slots__ = ("data_type", "name", "value")
+    FIELDS = ("value",)
+
+    def __init__(self, span, data_type, name, value):
+        super().__init__(span)
+        self.data_type = intern(data_type)
+        self.name = intern(name)
+        self.value = value
+
+
+class Block(Node):
+    __slots__ = ("statements",)
+    FIELDS = ("statements",)
+
+    def __init__(self, span, statements):
+        super().__init__(span)
+        self.statements = statements
+
+
+class ForLoop(Node):
+    # `for (init; condition; update) body`, any of the three header parts may be None
+    __slots__ = ("init", "condition", "update", "body")
+    FIELDS = ("init", "condition", "update", "body")
+
+    def __init__(self, span, init, condition, update, body):
+        super().__init__(span)
+        self.init = init
+        self.condition = condition
+        self.update = update
+        self.body = body
+
+
+class WhileLoop(Node):
+    __slots__ = ("condition", "body")
+    FIELDS = ("condition", "body")
+
+    def __init__(self, span, condition, body):
+        super().__init__(span)
+        self.condition = condition
+        self.body = body
+
+
+class IfStatement(Node):
+    __slots__ = ("condition", "body", "else_body")
+    FIELDS = ("condition", "body", "else_body")
+
+    def __init__(self, span, condition, body, else_body):
+        super().__init__(span)
+        self.condition = condition
+        self.body = body
+        self.else_body = else_body
+
+
+class ReturnStatement(Node):
+    __slots__ = ("value",)
+    FIELDS = ("value",)
+
+    def __init__(self, span, value):
+        super().__init__(span)
+        self.value = value
+
+
+class Assignment(Expression):
+    # `name = value`, or `this.name = value` when `field` is set
+    __slots__ = ("name", "value", "field")
+    FIELDS = ("value",)
+
+    def __init__(self, span, name, value, field=False):
+        super().__init__(span)
+        self.name = intern(name)
+        self.value = value
+        self.field = field
+
+
+class CompoundAssignment(Expression):
+    # `name += value` (or -=, *=, /=)
+    __slots__ = ("name", "operator", "value")
+    FIELDS = ("value",)
+
+    def __init__(self, span, name, operator, value):
+        super().__init__(span)
+        self.name = intern(name)
+        self.operator = intern(operator)
+        self.value = value
+
+
+class Increment(Expression):
+    # `name++` or `name--`
+    __slots__ = ("name", "operator")
+
+    def __init__(self, span, name, operator):
+        super().__init__(span)
+        self.name = intern(name)
+        self.operator = intern(operator)
+
+
+class FieldAccess(Expression):
+    # `this.name`
+    __slots__ = ("name",)
+
+    def __init__(self, span, name):
+        super().__init__(span)
+        self.name = intern(name)
+
+
+class MethodCall(Expression):
+    # `a.b.name(arguments)`: `path` holds the parts of the qualified name, ("a", "b", "name")
+    __slots__ = ("path", "arguments")
+    FIELDS = ("arguments",)
+
+    def __init__(self, span, path, arguments):
+        super().__init__(span)
+        self.path = tuple(sys.intern(part) for part in path)
+        self.arguments = arguments
+
+
+class ObjectCreation(Expression):
+    # `new data_type(arguments)`
+    __slots__ = ("data_type", "arguments")
+    FIELDS = ("arguments",)
+
+    def __init__(self, span, data_type, arguments):
+        super().__init__(span)
+        self.data_type = intern(data_type)
+        self.arguments = arguments
+
+
+class BinaryExpression(Expression):
+    __slots__ = ("operator", "left", "right")
+    FIELDS = ("left", "right")
+
+    def __init__(self, span, operator, left, right):
+        super().__init__(span)
+        self.operator = intern(operator)
+        self.left = left
+        self.right = right
+
+
+class NotExpression(Expression):
+    __slots__ = ("operand",)
+    FIELDS = ("operand",)
+
+    def __init__(self, span, operand):
+        super().__init__(span)
+        self.operand = operand
+
+
+class Name(Expression):
+    # A variable (or class) used in an expression
+    __slots__ = ("name",)
+
+    def __init__(self, span, name):
+        super().__init__(span)
+        self.name = intern(name)
+
+
+class Literal(Expression):
+    # A number, string or boolean literal, with its type ("int", "float", "String" or "boolean")
+    __slots__ = ("data_type", "text")
+
+    def __init__(self, span, data_type, text):
+        super().__init__(span)
+        self.data_type = data_type
+        self.text = text
+
+
+class This(Expression):
+    __slots__ = ()
+
+
+class InvalidExpression(Expression):
+    # What the parser recovered of an expression with syntax errors: its well-formed parts.
+    # Its type is that of the `typed` part, if any, and unknown otherwise.
+    __slots__ = ("parts", "typed")
+    FIELDS = ("parts",)
+
+    def __init__(self, span, parts, typed=None):
+        super().__init__(span)
+        self.parts = parts
+        self.typed = typed
+
+
+def node_classes():
+    # Every class of syntax tree node, by name
+    classes = {}
+    pending = [Node]
+    while pending:
+        cls = pending.pop()
+        classes[cls.__name__] = cls
+        pending.extend(cls.__subclasses__())
+    return classes
+
+
+class TreeWalker:
+    """
+    Base class of the passes over a whole syntax tree, expressions included. The tree is walked with an explicit
+    stack rather than by recursion, so its depth (a chain of thousands of `+`, deeply nested parentheses)
+    is not bounded by the recursion limit of Python.
+    For every node, enter<NodeClass>(node) is called before the children of the node are walked and
+    leave<NodeClass>(node) after them, when the pass defines them: scopes are opened in the enter handlers and
+    closed in the leave handlers. An enter handler returns SKIP to leave the children out; the leave handler is
+    still called.
+    """
+
+    def __init__(self):
+        self.handlers = None  # node class -> (enter handlers, leave handlers), built on the first walk
+
+    def handler_table(self):
+        # The handlers of every node class, looked up once rather than for every node
+        table = {}
+        for name, node_class in node_classes().items():
+            enter = getattr(self, "enter" + name, None)
+            leave = getattr(self, "leave" + name, None)
+            if enter is not None or leave is not None:
+                table[node_class] = ((enter,) if enter else (), (leave,) if leave else ())
+        return table
+
+    def visit(self, root):
+        # Walks the tree below `root` (included), parents before their children, in source order
+        handlers = self.handlers
+        if handlers is None:
+            handlers = self.handlers = self.handler_table()
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            if type(node) is tuple:  # (leave handlers, node) once the children of the node are walked
+                leave, node = node
+                for handler in leave:
+                    handler(node)
+                continue
+            entry = handlers.get(type(node))
+            if entry is not None:
+                enter, leave = entry
+                skip = False
+                for handler in enter:
+                    if handler(node) is SKIP:
+                        skip = True
+                if leave:
+                    stack.append((leave, node))
+                if skip:
+                    continue
+            for field in node.REVERSED_FIELDS:
+                value = getattr(node, field)
+                if value is None:
+                    continue
+                if type(value) is list:
+                    stack.extend(reversed(value))
+                else:
+                    stack.append(value)
+        return None
+
+
+class NodeVisitor:
+    """
+    Base class of the recursive passes over a syntax tree. visit() calls the method named after the class of
+    the node (visitClassDeclaration, visitName, ...), or visitChildren() for the nodes the pass does not handle.
+    Only suited to passes that do not descend into expressions, whose depth is unbounded (see TreeWalker).
+    """
+
+    def visit(self, node):
+        method = getattr(self, node.VISIT, None)
+        return self.visitChildren(node) if method is None else method(node)
+
+    def visitChildren(self, node):
+        for child in node.children():
+            self.visit(child)
+        return None
+
+
+def walk(node):
+    # Yields the node and all its descendants, parents before their children, without recursion.
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        children = list(node.children())
+        children.reverse()
+        stack.extend(children)
+
+
+def shift(node, line_delta, column_delta, first_line):
+    """
+    Moves the spans of a tree by `line_delta` lines, as Diagnostic.shifted moves a diagnostic:
+    columns only move by `column_delta` on `first_line`, the first line of the moved text.
+    """
+    for descendant in walk(node):
+        if descendant.line is None:
+            continue
+        if descendant.line == first_line:
+            descendant.column += column_delta
+        if descendant.end_line == first_line:
+            descendant.end_column += column_delta
+        descendant.line += line_delta
+        descendant.end_line += line_delta
@@ -0,0 +1,405 @@
+import argparse
+import gc
+import sys
+import time
+import tracemalloc
+from array import array
+
+from antlr4.CommonTokenFactory import CommonTokenFactory
+from antlr4.Token import Token
+from antlr4.error.Errors import IllegalStateException
+from diagnostics import LEXICAL, TIME_LIMIT_EXCEEDED, Diagnostic, token_end
+from fast_lexer import COMMENT, IN_STRING, NORMAL, scan
+from generated.LanguageLexer import LanguageLexer
+from source_files import read_source
+
+# Largest source (in characters) whose offsets fit the 32-bit columns; longer sources use 64-bit columns
+MAX_INT_OFFSET = 2 ** 31 - 1
+
+
+class TokenStore:
+    """
+    Columnar storage of the tokens of one source: parallel arrays of type, start, stop, line, column and channel
+    (about 18 bytes per token), and the source string itself, which the token texts are sliced from.
+    No token object is kept: token(index) returns a lightweight TokenView reading the arrays, so the parser
+    and the diagnostics see ordinary tokens while bulk scans (see indexes_of) work on the arrays directly.
+    The last token is always EOF. The store is also the token source of its views (`source` of a token).
+    """
+
+    def __init__(self, source, source_name="<string>"):
+        self.source = source
+        self.sourceName = source_name
+        self._factory = CommonTokenFactory.DEFAULT  # Used by the parser to create missing tokens
+        offset_code = "i" if len(source) <= MAX_INT_OFFSET else "q"
+        self.types = array("b")  # Token types are below 128; EOF is -1
+        self.starts = array(offset_code)
+        self.stops = array(offset_code)
+        self.lines = array(offset_code)
+        self.columns = array(offset_code)
+        self.channels = array("b")
+
+    @classmethod
+    def from_source(cls, source, line=1, column=0, source_name="<string>"):
+        # Tokenizes the source with the regex tokenizer of fast_lexer.py, without creating token objects.
+        # `line` and `column` are the position of the source in its document.
+        store = cls(source, source_name)
+        types, starts, stops = store.types, store.starts, store.stops
+        lines, columns, channels = store.lines, store.columns, store.channels
+        channel = Token.DEFAULT_CHANNEL
+        for token_type, start, stop, token_line, token_column in scan(source, line, column):
+            types.append(token_type)
+            starts.append(start)
+            stops.append(stop)
+            lines.append(token_line)
+            columns.append(token_column)
+            channels.append(channel)
+        return store
+
+    @classmethod
+    def from_lexer(cls, lexer, source, is_cancelled=None, source_name="<string>", budget=None):
+        # Drains a lexer (e.g. LanguageLexer) into a store, one token at a time, so that its CommonToken
+        # objects are released right away. `is_cancelled` is polled every 1000 tokens and stops the lexing
+        # by returning None. With a started code_analyzer.AnalysisBudget, the time is checked as often: once it
+        # is up, the lexing phase is cut at the last token and the store ends there (with an EOF token).
+        store = cls(source, source_name)
+        types, starts, stops = store.types, store.starts, store.stops
+        lines, columns, channels = store.lines, store.columns, store.channels
+        next_token = lexer.nextToken
+        eof = Token.EOF
+        count = 0
+        while True:
+            token = next_token()
+            types.append(token.type)
+            starts.append(token.start)
+            stops.append(token.stop)
+            lines.append(token.line)
+            columns.append(token.column)
+            channels.append(token.channel)
+            if token.type == eof:
+                return store
+            count += 1
+            if count % 1000 == 0:
+                if is_cancelled is not None and is_cancelled():
+                    return None
+                if budget is not None and budget.expired():
+                    budget.cut(LEXICAL, TIME_LIMIT_EXCEEDED, token.line, token.column)
+                    # The EOF token is placed just past the last token, which may span several lines
+                    end = token.stop + 1
+                    end_line, end_column = token_end(token)
+                    types.append(eof)
+                    starts.append(end)
+                    stops.append(end - 1)
+                    lines.append(end_line)
+                    columns.append(end_column)
+                    channels.append(Token.DEFAULT_CHANNEL)
+                    return store
+
+    @classmethod
+    def from_lines(cls, source, lines, source_name="<string>"):
+        """
+        Assembles a store from the LineTokens of every line of the source (see fast_lexer.tokenize_line),
+        e.g. the tokens an editor keeps for highlighting, instead of tokenizing the source again.
+        Returns None unless the lines are exactly those of the source (same count and text hashes), each line
+        was tokenized in the state the previous one ended in, and all their tokens are exact; the source then
+        gets the same tokens as with from_source().
+        """
+        texts = source.split("\n")
+        if len(texts) != len(lines):
+            return None
+        store = cls(source, source_name)
+        types, starts, stops = store.types, store.starts, store.stops
+        lines_column, columns, channels = store.lines, store.columns, store.channels
+        channel = Token.DEFAULT_CHANNEL
+        state = NORMAL
+        offset = 0
+        for number, (text, entry) in enumerate(zip(texts, lines), 1):
+            if entry is None or entry.start_state != state or not entry.exact or entry.text_hash != hash(text):
+                return None
+            tokens = entry.tokens
+            first = 0
+            if state == IN_STRING:
+                if entry.end_state == IN_STRING and len(tokens) == 3:
+                    offset += len(text) + 1  # The whole line is inside the string
+                    continue
+                stops[-1] = offset + tokens[2]  # The end of the string started on a previous line
+                first = 3
+            for index in range(first, len(tokens), 3):
+                token_type = tokens[index]
+                if token_type == COMMENT:
+                    continue
+                types.append(token_type)
+                starts.append(offset + tokens[index + 1])
+                stops.append(offset + tokens[index + 2])
+                lines_column.append(number)
+                columns.append(tokens[index + 1])
+                channels.append(channel)
+            state = entry.end_state
+            offset += len(text) + 1
+        if state == IN_STRING:
+            return None  # The lexer does not accept a string literal left open at the end of the source
+        types.append(Token.EOF)
+        starts.append(len(source))
+        stops.append(len(source) - 1)
+        lines_column.append(len(texts))
+        columns.append(len(texts[-1]))
+        channels.append(channel)
+        return store
+
+    def __len__(self):
+        return len(self.types)
+
+    def token(self, index):
+        return TokenView(self, index)
+
+    def text(self, index):
+        if self.types[index] == Token.EOF:
+            return "<EOF>"
+        return self.source[self.starts[index]:self.stops[index] + 1]
+
+    def indexes_of(self, token_type):
+        # Indexes of the tokens of a type, found by searching the packed type column rather than
+        # visiting the tokens one by one
+        types = self.types.tobytes()
+        needle = bytes((token_type & 0xFF,))
+        index = types.find(needle)
+        while index != -1:
+            yield index
+            index = types.find(needle, index + 1)
+
+    # Token source interface, as seen through the `source` of the views
+    @property
+    def line(self):
+        return self.lines[-1]
+
+    @property
+    def column(self):
+        return self.columns[-1]
+
+    def getInputStream(self):
+        return None
+
+    def getSourceName(self):
+        return self.sourceName
+
+
+class TokenView:
+    """
+    A token of a TokenStore: its fields are read from the store's arrays when they are accessed.
+    Views are read-only and only hold the store and the token index; they are created on demand,
+    so a token without a view (e.g. one only looked at during prediction) costs no object at all.
+    """
+    __slots__ = ("store", "tokenIndex")
+
+    def __init__(self, store, index):
+        self.store = store
+        self.tokenIndex = index
+
+    @property
+    def type(self):
+        return self.store.types[self.tokenIndex]
+
+    @property
+    def start(self):
+        return self.store.starts[self.tokenIndex]
+
+    @property
+    def stop(self):
+        return self.store.stops[self.tokenIndex]
+
+    @property
+    def line(self):
+        return self.store.lines[self.tokenIndex]
+
+    @property
+    def column(self):
+        return self.store.columns[self.tokenIndex]
+
+    @property
+    def channel(self):
+        return self.store.channels[self.tokenIndex]
+
+    @property
+    def text(self):
+        return self.store.text(self.tokenIndex)
+
+    @property
+    def source(self):
+        return self.store, None
+
+    def getTokenSource(self):
+        return self.store
+
+    def getInputStream(self):
+        return None
+
+    def __str__(self):
+        text = self.text.replace("\n", "\\n").replace("\r", "\\r").replace("\t", "\\t")
+        return f"[@{self.tokenIndex},{self.start}:{self.stop}='{text}',<{self.type}>,{self.line}:{self.column}]"
+
+
+class TokenStoreStream:
+    """
+    Token stream feeding LanguageParser from a TokenStore, in place of a CommonTokenStream.
+    Lookahead (LA), which the parser's prediction calls for almost every token, reads the type column only.
+    The grammar sends no token to a hidden channel, so every token of the store is on the default channel
+    and the stream never has to skip any. The view of the current token is reused while the parser
+    looks at it, since it is requested several times (once per rule entered) before being consumed.
+    """
+
+    def __init__(self, store):
+        self.tokenSource = store
+        self.sourceName = store.sourceName
+        self.types = store.types
+        self.index = 0
+        self.last = len(store.types) - 1  # The EOF token
+        self.current = None  # View of the token at `index`, or None
+
+    @property
+    def size(self):
+        return self.last + 1
+
+    def LA(self, i):
+        index = self.index + i - 1 if i > 0 else self.index + i
+        if i == 0 or index < 0:
+            return Token.INVALID_TYPE
+        return self.types[index if index < self.last else self.last]
+
+    def LT(self, k):
+        if k == 1:
+            current = self.current
+            if current is None:
+                current = self.current = TokenView(self.tokenSource, self.index)
+            return current
+        index = self.index + k - 1 if k > 0 else self.index + k
+        if k == 0 or index < 0:
+            return None
+        return TokenView(self.tokenSource, index if index < self.last else self.last)
+
+    def consume(self):
+        if self.index == self.last:
+            raise IllegalStateException("cannot consume EOF")
+        self.index += 1
+        self.current = None
+
+    def mark(self):
+        return 0
+
+    def release(self, marker):
+        pass
+
+    def seek(self, index):
+        index = min(index, self.last)
+        if index != self.index:
+            self.index = index
+            self.current = None
+
+    def get(self, index):
+        return TokenView(self.tokenSource, index)
+
+    def getTokenSource(self):
+        return self.tokenSource
+
+    def getSourceName(self):
+        return self.sourceName
+
+    def getText(self, start=None, stop=None):
+        # Text of the tokens from start to stop (indexes or tokens), EOF excluded, as in BufferedTokenStream
+        start = 0 if start is None else getattr(start, "tokenIndex", start)
+        stop = self.last if stop is None else getattr(stop, "tokenIndex", stop)
+        store = self.tokenSource
+        return "".join(store.text(index) for index in range(max(start, 0), min(stop + 1, self.last)))
+
+
+def unknown_token_errors(store):
+    # "unrecognized-symbol" Diagnostic records for the UNKNOWN tokens of a store
+    return [Diagnostic.at_token(LEXICAL, "unrecognized-symbol", store.token(index), store.text(index))
+            for index in store.indexes_of(LanguageLexer.UNKNOWN)]
+
+
+def traced(function):
+    # Calls the function and returns its result, the memory it still holds afterwards and its duration
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, memory, elapsed
+
+
+def timed(function, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main(argv=None):
+    # Compares the token memory and the UNKNOWN-token scan of a CommonTokenStream and of a TokenStore
+    # on a generated program (or a file), and checks that both give the same tokens and lexical errors.
+    # Exits with status 1 when they differ.
+    from antlr4 import CommonTokenStream, InputStream
+    from fast_lexer import token_fields
+    from program_generator import generate_program
+
+    arg_parser = argparse.ArgumentParser(description="Measure the compact token store against CommonTokenStream.")
+    arg_parser.add_argument("path", nargs="?", help="source file (default: a generated program)")
+    arg_parser.add_argument("-t", "--tokens", type=int, default=1000000,
+                            help="approximate number of tokens of the generated program (default: 1000000)")
+    arg_parser.add_argument("-s", "--seed", type=int, default=0, help="seed of the generated program (default: 0)")
+    args = arg_parser.parse_args(argv)
+
+    if args.path:
+        source = read_source(args.path)
+    else:
+        source = generate_program(max(args.tokens // 6, 1), args.seed, broken=True)  # About 6.5 tokens per line
+
+    def antlr_stream():
+        stream = CommonTokenStream(LanguageLexer(InputStream(source)))
+        stream.fill()
+        return stream
+
+    # Only the memory left after building counts: the generated lexer keeps the whole input as a list of
+    # code points, which the tokens (through their `source`) keep alive
+    stream, stream_memory, stream_time = traced(antlr_stream)
+    store, store_memory, store_time = traced(lambda: TokenStore.from_source(source))
+    count = len(store)
+    print(f"{count} tokens, {len(source)} characters")
+    print(f"{'':<28} {'memory':>12} {'per token':>10} {'build':>8}")
+    print(f"{'CommonTokenStream':<28} {stream_memory / 2 ** 20:>10.1f}MB {stream_memory / count:>9.1f}B "
+          f"{stream_time:>7.2f}s")
+    print(f"{'TokenStore':<28} {store_memory / 2 ** 20:>10.1f}MB {store_memory / count:>9.1f}B "
+          f"{store_time:>7.2f}s   ({stream_memory / store_memory:.1f}x less memory)")
+
+    unknown = LanguageLexer.UNKNOWN
+    expected, object_scan = timed(lambda: [token for token in stream.tokens if token.type == unknown])
+    found, array_scan = timed(lambda: list(store.indexes_of(unknown)))
+    print(f"UNKNOWN scan: {object_scan * 1000:.1f}ms over the token objects, {array_scan * 1000:.1f}ms over the "
+          f"type column ({object_scan / max(array_scan, 1e-9):.0f}x faster), {len(found)} tokens")
+
+    failures = 0
+    if [token.tokenIndex for token in expected] != found:
+        print("MISMATCH: the UNKNOWN scans differ")
+        failures += 1
+    lexer_errors = [Diagnostic.at_token(LEXICAL, "unrecognized-symbol", token, token.text) for token in expected]
+    if lexer_errors != unknown_token_errors(store):
+        print("MISMATCH: the lexical errors differ")
+        failures += 1
+    for index, token in enumerate(stream.tokens):
+        if token_fields(token) != token_fields(store.token(index)):
+            print(f"MISMATCH token {index}: expected {token_fields(token)}, got {token_fields(store.token(index))}")
+            failures += 1
+            break
+    if len(stream.tokens) != count:
+        print(f"MISMATCH: expected {len(stream.tokens)} tokens, got {count}")
+        failures += 1
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,277 @@
+from antlr4.tree.Tree import TerminalNode
+from diagnostics import token_end
+from generated.LanguageParser import LanguageParser
+from syntax_tree import (Assignment, BinaryExpression, Block, ClassDeclaration, CompoundAssignment, FieldAccess,
+                         ForLoop, IfStatement, Increment, InvalidExpression, Literal, MainMethodDeclaration,
+                         MethodCall, MethodDeclaration, Name, NotExpression, ObjectCreation, Parameter, Program,
+                         ReturnStatement, This, VariableDeclaration, WhileLoop)
+
+THIS = LanguageParser.literalNames.index("'this'")
+LPAREN = LanguageParser.literalNames.index("'('")
+NOT = LanguageParser.literalNames.index("'!'")
+SEMICOLON = LanguageParser.literalNames.index("';'")
+NESTING_TOKENS = (LPAREN, NOT)  # First tokens of the terms holding an expression: `(expr)` and `!expr`
+
+# Types of the literal tokens
+LITERAL_TYPES = {
+    LanguageParser.STRING_LITERAL: "String",
+    LanguageParser.BOOLEAN_LITERAL: "boolean",
+    LanguageParser.literalNames.index("'true'"): "boolean",
+    LanguageParser.literalNames.index("'false'"): "boolean",
+}
+
+UNKNOWN_SPAN = (None, None, None, None)
+
+
+def span(ctx):
+    # Source span of a parse tree node, from its first to its last token
+    start = ctx.start
+    if start is None:
+        return UNKNOWN_SPAN
+    stop = ctx.stop if ctx.stop is not None and ctx.stop.tokenIndex >= start.tokenIndex else start
+    return (start.line, start.column, *token_end(stop))
+
+
+def text(ctx):
+    # Text of an optional parse tree node
+    return ctx.getText() if ctx is not None else None
+
+
+class TreeBuilder:
+    """
+    Converts an ANTLR parse tree into the syntax tree of syntax_tree.py, once, right after parsing;
+    the parse tree (and with it the parser and its tokens) can be dropped afterwards.
+    The conversion keeps everything the semantic checks read and in the order they read it, including what the
+    parser recovered from syntax errors: the parts of a malformed expression are kept as an InvalidExpression.
+    Rules that only group other rules (statement, loop, expression, class_body, arg_list) leave no node.
+    Expressions are converted with an explicit stack (see expr), since they nest far deeper than statements.
+    """
+
+    def __init__(self):
+        P = LanguageParser
+        self.rules = {
+            P.DeclarationContext: self.declaration,
+            P.Class_declarationContext: self.class_declaration,
+            P.Method_declarationContext: self.method_declaration,
+            P.Main_method_declarationContext: self.main_method_declaration,
+            P.BlockContext: self.block,
+            P.For_loopContext: self.for_loop,
+            P.While_loopContext: self.while_loop,
+            P.If_statementContext: self.if_statement,
+            P.Return_statementContext: self.return_statement,
+            P.ExpressionContext: self.expression,
+            P.AssignmentContext: self.assignment,
+            P.Assignment_exprContext: self.assignment_expr,
+            P.Increment_exprContext: self.increment_expr,
+            P.Method_callContext: self.method_call,
+            P.Object_creationContext: self.object_creation,
+            P.ExprContext: self.expr,
+            P.TermContext: self.expr,
+            # Names and types are read by the rules using them
+            P.Data_typeContext: None,
+            P.Return_typeContext: None,
+            P.Qualified_nameContext: None,
+            P.Visibility_specifierContext: None,
+            P.Param_listContext: None,
+            P.ParamContext: None,
+        }
+
+    def build(self, tree):
+        # The Program of a start_ rule
+        return Program(span(tree), self.nodes(tree))
+
+    def convert(self, ctx):
+        return self.rules[type(ctx)](ctx) if ctx is not None else None
+
+    def nodes(self, ctx, nodes=None):
+        # The nodes of the rule children of a node, looking through the rules that only group other rules
+        if nodes is None:
+            nodes = []
+        for child in ctx.children or ():
+            if isinstance(child, TerminalNode):
+                continue
+            child_type = type(child)
+            if child_type not in self.rules:
+                self.nodes(child, nodes)
+                continue
+            convert = self.rules[child_type]
+            if convert is not None:
+                node = convert(child)
+                if node is not None:
+                    nodes.append(node)
+        return nodes
+
+    @staticmethod
+    def name(identifier):
+        # Text of an ID terminal (None when the rule has no identifier)
+        return identifier.getText() if identifier is not None else None
+
+    def declaration(self, ctx):
+        return VariableDeclaration(span(ctx), text(ctx.data_type()), self.name(ctx.ID()), self.convert(ctx.expr()))
+
+    def class_declaration(self, ctx):
+        body = ctx.class_body()
+        return ClassDeclaration(span(ctx), self.name(ctx.ID()), self.nodes(body) if body is not None else [])
+
+    def method_declaration(self, ctx):
+        param_list = ctx.param_list()
+        parameters = [Parameter(span(param), text(param.data_type()), self.name(param.ID()))
+                      for param in (param_list.param() if param_list is not None else ())]
+        return MethodDeclaration(span(ctx), self.name(ctx.ID()), text(ctx.return_type()), parameters,
+                                 self.convert(ctx.block()))
+
+    def main_method_declaration(self, ctx):
+        return MainMethodDeclaration(span(ctx), self.convert(ctx.block()))
+
+    def block(self, ctx):
+        return Block(span(ctx), self.nodes(ctx))
+
+    def for_loop(self, ctx):
+        # The header parts are told apart by the semicolons preceding them
+        parts = [None, None, None]
+        body = None
+        semicolons = 0
+        for child in ctx.children or ():
+            if isinstance(child, TerminalNode):
+                if child.symbol.type == SEMICOLON:
+                    semicolons += 1
+            elif isinstance(child, LanguageParser.BlockContext):
+                body = self.block(child)
+            else:
+                parts[min(semicolons, 2)] = self.convert(child)
+        return ForLoop(span(ctx), *parts, body)
+
+    def while_loop(self, ctx):
+        return WhileLoop(span(ctx), self.convert(ctx.expr()), self.convert(ctx.block()))
+
+    def if_statement(self, ctx):
+        blocks = [self.block(block) for block in ctx.block()]
+        return IfStatement(span(ctx), self.convert(ctx.expr()), blocks[0] if blocks else None,
+                           blocks[1] if len(blocks) > 1 else None)
+
+    def return_statement(self, ctx):
+        return ReturnStatement(span(ctx), self.convert(ctx.expr()))
+
+    def expression(self, ctx):
+        parts = self.nodes(ctx)
+        if len(parts) == 1:
+            return parts[0]
+        if parts:
+            return InvalidExpression(span(ctx), parts)
+        identifier = ctx.ID()  # this.name
+        return FieldAccess(span(ctx), identifier.getText()) if identifier is not None else None
+
+    def assignment(self, ctx):
+        identifier = ctx.ID()
+        if identifier is None:
+            # The object creation alternative (`new Name(...);` used as a statement)
+            creation = ctx.object_creation()
+            return self.object_creation(creation) if creation is not None else self.invalid(ctx)
+        first = ctx.getChild(0)
+        field = isinstance(first, TerminalNode) and first.symbol.type == THIS
+        return Assignment(span(ctx), identifier.getText(), self.convert(ctx.expr()), field)
+
+    def assignment_expr(self, ctx):
+        operator = ctx.getChild(1)
+        return CompoundAssignment(span(ctx), self.name(ctx.ID()), text(operator), self.convert(ctx.expr()))
+
+    def increment_expr(self, ctx):
+        return Increment(span(ctx), self.name(ctx.ID()), text(ctx.getChild(1)))
+
+    def method_call(self, ctx):
+        return MethodCall(span(ctx), ctx.qualified_name().getText().split("."), self.nodes(ctx))
+
+    def object_creation(self, ctx):
+        name = ctx.qualified_name()
+        data_type = ".".join(identifier.getText() for identifier in name.ID()) if name is not None else None
+        return ObjectCreation(span(ctx), data_type, self.nodes(ctx))
+
+    def invalid(self, ctx):
+        return InvalidExpression(span(ctx), self.nodes(ctx))
+
+    def expr(self, ctx):
+        """
+        Converts an expr or term rule. Operator chains (`a + b + ...`, a left-deep tree), parentheses and `!`
+        nest without bound, so they are converted without recursion: `pending` holds the rules left to convert
+        and, below their operands, the (converter, rule) pairs of the operators and nested terms waiting for them;
+        `done` holds the converted operands, in source order.
+        Method calls and object creations convert their arguments on their own.
+        """
+        pending = [ctx]
+        done = []
+        while pending:
+            current = pending.pop()
+            if type(current) is tuple:
+                finish, current = current
+                done.append(finish(current, done))
+                continue
+            if type(current) is LanguageParser.ExprContext:
+                term = current.term()
+                if term is None:
+                    operands = current.expr()
+                    if len(operands) != 2 or not isinstance(current.getChild(1), TerminalNode):
+                        done.append(self.invalid(current))
+                    else:
+                        pending += [(self.binary_expression, current), operands[1], operands[0]]
+                    continue
+                current = term
+            if not current.children:
+                done.append(self.invalid(current))
+                continue
+            first = current.children[0]
+            if isinstance(first, TerminalNode) and first.symbol.type in NESTING_TOKENS:
+                operand = current.expr()
+                if operand is not None:
+                    pending += [(self.nested_term, current), operand]
+                    continue
+            done.append(self.term(current, self.term_value(current)))
+        return done[0]
+
+    @staticmethod
+    def binary_expression(ctx, done):
+        right = done.pop()
+        left = done.pop()
+        return BinaryExpression(span(ctx), ctx.getChild(1).getText(), left, right)
+
+    def nested_term(self, ctx, done):
+        # `(operand)` or `!operand`, the operand being converted
+        operand = done.pop()
+        if ctx.children[0].symbol.type == NOT:
+            operand = NotExpression(span(ctx), operand)
+        return self.term(ctx, operand)
+
+    @staticmethod
+    def term(ctx, node):
+        # The node of a term whose value is `node`
+        identifier = ctx.ID()
+        if identifier is not None and type(node) is not Name:
+            # An identifier skipped by the error recovery after the term, e.g. `(1 b)`: it is still checked,
+            # the term keeps the type of its value
+            return InvalidExpression(span(ctx), [Name(span(ctx), identifier.getText()), node], node)
+        return node
+
+    def term_value(self, ctx):
+        # The value of a term that is not `(operand)` or `!operand`
+        first = ctx.children[0]
+        if not isinstance(first, TerminalNode):
+            if isinstance(first, (LanguageParser.Method_callContext, LanguageParser.Object_creationContext)):
+                return self.convert(first)
+            return self.invalid(ctx)
+
+        token = first.symbol
+        token_type = token.type
+        if token_type == LanguageParser.ID:
+            return Name(span(ctx), token.text)
+        if token_type == LanguageParser.NUMBER:
+            value = token.text
+            return Literal(span(ctx), "float" if "." in value or value[-1] in "fF" else "int", value)
+        if token_type in LITERAL_TYPES:
+            return Literal(span(ctx), LITERAL_TYPES[token_type], token.text)
+        if token_type == THIS:
+            return This(span(ctx))
+        return self.invalid(ctx)
+
+
+def build_syntax_tree(tree):
+    # The syntax tree of a start_ rule (see TreeBuilder)
+    return TreeBuilder().build(tree)
@@ -0,0 +1,95 @@
+from syntax_tree import BinaryExpression, InvalidExpression, Literal, Name, NotExpression, ObjectCreation, This
+
+ARITHMETIC = {"*", "/", "%", "-"}
+PLUS = "+"
+RELATIONAL = {"<", "<=", ">", ">="}
+EQUALITY = {"==", "!="}
+LOGICAL = {"&&", "||"}
+
+# Numeric types ordered by width: the result of an arithmetic operation is the widest operand type
+NUMERIC_RANK = {"int": 0, "float": 1, "double": 2}
+
+
+class TypeInference:
+    """
+    This class computes the static type of the expressions of the syntax tree (see syntax_tree.py).
+    Types are computed bottom-up from the leaves (literals, names, object creations)
+    and the operators of the inner nodes, with an explicit stack instead of recursion.
+    Every node is typed at most once: results are memoized per node, so reading the type of an expression
+    and of all its sub-expressions costs linear time overall.
+    Identifiers are resolved through the semantic analyzer at the moment the expression is first typed.
+    The type of an expression that cannot be determined (e.g. a method call) is None.
+    """
+
+    def __init__(self, analyzer):
+        self.analyzer = analyzer
+        self.types = {}  # node -> inferred type
+
+    def infer(self, node):
+        """
+        Returns the type of an expression, computing it (and the types of its operands) if needed.
+        """
+        if node is None:
+            return None
+        types = self.types
+        if node in types:
+            return types[node]
+        stack = [(node, False)]
+        while stack:
+            current, operands_done = stack.pop()
+            if current in types:
+                continue
+            if operands_done:
+                types[current] = self.node_type(current)
+            else:
+                stack.append((current, True))
+                for operand in self.operands(current):
+                    if operand not in types:
+                        stack.append((operand, False))
+        return types[node]
+
+    @staticmethod
+    def operands(node):
+        # The sub-expressions whose types are needed to type the node.
+        node_class = type(node)
+        if node_class is BinaryExpression:
+            return (node.left, node.right)
+        if node_class is NotExpression:
+            return (node.operand,)
+        if node_class is InvalidExpression and node.typed is not None:
+            return (node.typed,)
+        return ()
+
+    def node_type(self, node):
+        node_class = type(node)
+        if node_class is Name:
+            return self.analyzer.symbols.lookup(node.name)
+        if node_class is Literal or node_class is ObjectCreation:
+            return node.data_type
+        if node_class is BinaryExpression:
+            types = self.types
+            return self.binary_type(node.operator, types[node.left], types[node.right])
+        if node_class is NotExpression:
+            return "boolean" if self.types[node.operand] == "boolean" else None
+        if node_class is This:
+            return self.analyzer.current_class
+        if node_class is InvalidExpression and node.typed is not None:
+            return self.types[node.typed]
+        return None  # method call (the return type is not tracked) or malformed expression
+
+    @staticmethod
+    def binary_type(operator, left, right):
+        # Type of `left operator right`, or None if the operands are not valid for the operator.
+        if operator == PLUS and (left == "String" or right == "String"):
+            return "String"
+        if operator == PLUS or operator in ARITHMETIC:
+            if left in NUMERIC_RANK and right in NUMERIC_RANK:
+                return left if NUMERIC_RANK[left] >= NUMERIC_RANK[right] else right
+            return None
+        if operator in RELATIONAL:
+            return "boolean" if left in NUMERIC_RANK and right in NUMERIC_RANK else None
+        if operator in EQUALITY:
+            return "boolean"
+        if operator in LOGICAL:
+            return "boolean" if left == "boolean" and right == "boolean" else None
+        return None